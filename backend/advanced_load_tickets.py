@@ -274,32 +274,32 @@ class TicketLoader:
             with app.app_context():
                 # Import AI automation service within app context
                 from services.ai_automation_service import ai_automation
+                from services.openai_rate_limiter_service import BACKGROUND, openai_rate_limiter
                 
                 automation_count = 0
-                for _, row in new_tickets_df.iterrows():
-                    try:
-                        ticket = Ticket.query.get(str(row['id']))
-                        if ticket:
-                            logger.info(f"Processing ticket {ticket.id} for AI automation")
+                # Background class: waits on the shared RPM/TPM buckets and yields to interactive chat
+                with openai_rate_limiter.priority(BACKGROUND):
+                    for _, row in new_tickets_df.iterrows():
+                        try:
+                            ticket = Ticket.query.get(str(row['id']))
+                            if ticket:
+                                logger.info(f"Processing ticket {ticket.id} for AI automation")
                             
-                            # Trigger auto-triage
-                            triage_action = ai_automation.auto_triage_ticket(ticket)
-                            if triage_action:
-                                logger.info(f"Created auto-triage action for ticket {ticket.id}")
-                                automation_count += 1
+                                # Trigger auto-triage
+                                triage_action = ai_automation.auto_triage_ticket(ticket)
+                                if triage_action:
+                                    logger.info(f"Created auto-triage action for ticket {ticket.id}")
+                                    automation_count += 1
                             
-                            # Trigger auto-solution (with slight delay to avoid rate limits)
-                            import time
-                            time.sleep(0.5)  # Small delay between API calls
-                            
-                            solution_action = ai_automation.auto_generate_solution(ticket)
-                            if solution_action:
-                                logger.info(f"Created auto-solution action for ticket {ticket.id}")
-                                automation_count += 1
+                                # Trigger auto-solution
+                                solution_action = ai_automation.auto_generate_solution(ticket)
+                                if solution_action:
+                                    logger.info(f"Created auto-solution action for ticket {ticket.id}")
+                                    automation_count += 1
                                 
-                    except Exception as ticket_error:
-                        logger.error(f"Error processing ticket {row['id']} for AI automation: {ticket_error}")
-                        continue
+                        except Exception as ticket_error:
+                            logger.error(f"Error processing ticket {row['id']} for AI automation: {ticket_error}")
+                            continue
                 
                 logger.info(f"✅ AI automation triggered successfully! Created {automation_count} AI actions")
                 
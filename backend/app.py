@@ -4,7 +4,7 @@ import logging
 from flask import Flask, request
 from flask_cors import CORS
 from dotenv import load_dotenv
-from openai import OpenAI
+from services.openai_gateway_service import openai_gateway
 from extensions import db, migrate
 from cli import register_cli_commands
 from config import FRONTEND_ORIGINS, SQLALCHEMY_DATABASE_URI, DATABASE_URL
@@ -69,8 +69,8 @@ def create_app():
         resources={r"/*": {"origins": list(allowed_origins) + [swa_regex]}},
         supports_credentials=True,  # keep True if you use cookies/Authorization headers
         methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-        allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
-        expose_headers=["Content-Disposition"],
+        allow_headers=["Content-Type", "Authorization", "X-Requested-With", "If-None-Match"],
+        expose_headers=["Content-Disposition", "ETag", "X-Next-Cursor"],
     )
 
     @app.after_request
@@ -88,13 +88,25 @@ def create_app():
     from config import OPENAI_KEY
     if OPENAI_KEY:
         try:
-            app.config["OPENAI_CLIENT"] = OpenAI(api_key=OPENAI_KEY)
-            log.info("OpenAI client initialized successfully")
+            app.config["OPENAI_CLIENT"] = openai_gateway.client
+            log.info(f"OpenAI client initialized (max {openai_gateway.max_concurrency} concurrent calls, {openai_gateway.timeout:.0f}s timeout)")
         except Exception as e:
             log.warning(f"Failed to initialize OpenAI client: {e}")
     else:
         log.info("OPENAI_KEY is not set; skipping OpenAI client initialization.")
 
+    # ---------------------------------------------------------------------
+    # Local triage classifier (loaded once per process)
+    # ---------------------------------------------------------------------
+    from services.triage_classifier_service import triage_classifier
+    triage_classifier.load()
+
+    # ---------------------------------------------------------------------
+    # Similar-past-answer FAISS index (memory-mapped once per process)
+    # ---------------------------------------------------------------------
+    from services.answer_retrieval_service import answer_retrieval
+    answer_retrieval.load()
+
     # ---------------------------------------------------------------------
     # Blueprints & CLI
     # ---------------------------------------------------------------------
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the /threads list query
+Seeds N tickets into a throwaway SQLite database and times the page query and
+the separate COUNT produced by thread_list_query for each corpus size.
+
+Usage: python bench_list_threads.py 1000 100000 1000000
+"""
+
+import os
+import sys
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add backend to path; the OpenAI client is never called here
+sys.path.append(os.path.dirname(__file__))
+os.environ.setdefault("OPENAI_API_KEY", "bench-not-used")
+
+from flask import Flask
+from extensions import db
+from models import Ticket
+from db_helpers import thread_list_query
+
+SEED_CHUNK = 20000
+PAGE_SIZE = 20
+RUNS = 20
+
+
+def seed(n: int):
+    """Insert n synthetic tickets spread over departments, levels and statuses"""
+    now = datetime.now(timezone.utc)
+    statuses = ["open", "open", "open", "escalated", "closed", "resolved"]
+    for start in range(0, n, SEED_CHUNK):
+        rows = []
+        for i in range(start, min(start + SEED_CHUNK, n)):
+            rows.append({
+                "id": f"T{i:08d}",
+                "status": random.choice(statuses),
+                "subject": f"Synthetic ticket {i}",
+                "requester_name": "Bench",
+                "category": "General",
+                "department_id": random.randint(1, 8),
+                "priority": "Medium",
+                "impact_level": "Medium",
+                "urgency_level": "Medium",
+                "requester_email": "bench@example.com",
+                "level": random.choice([1, 1, 2, 3]),
+                "archived": random.random() < 0.1,
+                "updated_at": now - timedelta(seconds=i),
+                "version": 1,
+            })
+        db.session.execute(Ticket.__table__.insert(), rows)
+        db.session.commit()
+
+
+def timed(fn) -> float:
+    """Median wall time of fn() in milliseconds"""
+    samples = []
+    for _ in range(RUNS):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def bench(n: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        seed(n)
+
+        for role, dept in [("L1", 7), ("L2", 3), ("L3", None)]:
+            query = thread_list_query(role, user_department_id=dept, status="open")
+            page = lambda: query.order_by(Ticket.updated_at.desc(), Ticket.id.desc()).offset(0).limit(PAGE_SIZE).all()
+            count = lambda: query.order_by(None).count()
+            print(f"{n:>9} tickets  {role:<3} page={timed(page):7.2f} ms  count={timed(count):8.2f} ms")
+
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    for size in sizes:
+        bench(size)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the pooled SMTP sender
+Sends N messages to a local aiosmtpd stand-in, once opening a connection per
+message (the old send_via_gmail behaviour) and once through a reused pooled
+connection. The stand-in needs `pip install aiosmtpd`; pass --latency to add a
+per-command delay that approximates a remote server's round trips.
+
+Usage: python bench_smtp_pool.py 500 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from email.message import EmailMessage
+
+sys.path.append(os.path.dirname(__file__))
+os.environ.setdefault("OPENAI_API_KEY", "bench-not-used")
+
+from aiosmtpd.controller import Controller
+from services.smtp_pool_service import SMTPPool
+
+HOST, PORT = "127.0.0.1", 8025
+
+
+class SlowHandler:
+    """Accepts every message; waits `latency` seconds on connect and on each command"""
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.latency * 3)  # connect + greeting + TLS/login round trips on a real server
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await asyncio.sleep(self.latency)
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        return "250 Message accepted for delivery"
+
+
+def message(i: int) -> EmailMessage:
+    em = EmailMessage()
+    em["From"] = "Support <support@example.com>"
+    em["To"] = f"user{i}@example.com"
+    em["Subject"] = f"[Ticket T{i:05d}] Update"
+    em.set_content("Hello,\n\nUpdate on your ticket.\n\nThanks,\nSupport Team")
+    return em
+
+
+def run(label: str, pool: SMTPPool, n: int):
+    t0 = time.perf_counter()
+    for i in range(n):
+        pool.send(message(i))
+    elapsed = time.perf_counter() - t0
+    pool.close_idle()
+    stats = pool.stats()
+    print(f"{label:<22} {n} msgs in {elapsed:6.2f}s  {n / elapsed:8.1f} msg/s  connects={stats['connects']}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("messages", type=int, nargs="?", default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    handler = SlowHandler(args.latency)
+    controller = Controller(handler, hostname=HOST, port=PORT)
+    controller.start()
+    try:
+        common = dict(host=HOST, port=PORT, user=None, password=None, security="none", size=1)
+        per_message = run("connection per message", SMTPPool(max_messages=1, **common), args.messages)
+        pooled = run("pooled connection", SMTPPool(max_messages=0, **common), args.messages)
+        print(f"speedup: {per_message / pooled:.1f}x  (server received {handler.received})")
+    finally:
+        controller.stop()
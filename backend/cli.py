@@ -1,5 +1,4 @@
 import logging
-import os
 import click
 import pandas as pd
 import numpy as np
@@ -7,12 +6,12 @@ from datetime import datetime, timezone
 from sqlalchemy import or_
 from models import Ticket, Department, Message
 from extensions import db
-from config import DATA_PATH
+from config import DATA_PATH, TRIAGE_CLASSIFIER_PATH
 from openai_helpers import categorize_department_with_gpt
-from openai import OpenAI
+from services.openai_gateway_service import openai_gateway
 
-# Initialize OpenAI client here for CLI commands
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Shared OpenAI gateway (bounded concurrency + timeouts) for CLI commands
+client = openai_gateway
 
 # Utility function to load data
 def load_df():
@@ -69,6 +68,14 @@ def register_cli_commands(app):
                 logging.info(f"[HYDRATE] {hydrated_count} tickets loaded from CSV into DB.")
             else:
                 logging.info("[HYDRATE] All tickets already exist in the database.")
+
+            # Embed new subjects at ingest so related-tickets never embeds on the request path
+            from services.ticket_embedding_service import ticket_embeddings
+            try:
+                embedded = ticket_embeddings.backfill()
+                logging.info(f"[HYDRATE] Embedded {embedded} ticket subjects.")
+            except Exception as e:
+                logging.warning(f"[HYDRATE] Ticket embedding skipped ({e}); run `flask embed-tickets` later.")
     
     @app.cli.command("auto-assign")
     def auto_assign():
@@ -114,3 +121,45 @@ def register_cli_commands(app):
             
             db.session.commit()
             logging.info(f"[AUTO-ASSIGN] Auto-assignment complete. {count} tickets updated.")
+
+    @app.cli.command("embed-tickets")
+    def embed_tickets():
+        """
+        Embeds every ticket subject that has no current vector in ticket_embeddings.
+        """
+        from services.ticket_embedding_service import ticket_embeddings
+
+        with app.app_context():
+            embedded = ticket_embeddings.backfill()
+            logging.info(f"[EMBED-TICKETS] Embedded {embedded} tickets; index holds {len(ticket_embeddings.index)}.")
+
+    @app.cli.command("embed-kb")
+    def embed_kb():
+        """
+        Embeds every KB article whose content has no current vector in kb_article_embeddings.
+        """
+        from services.kb_embedding_service import kb_embeddings
+
+        with app.app_context():
+            embedded = kb_embeddings.backfill()
+            logging.info(f"[EMBED-KB] Embedded {embedded} articles; store holds {len(kb_embeddings.index)} ({kb_embeddings.model}, dim {kb_embeddings.dim}).")
+
+    @app.cli.command("train-triage")
+    @click.option('--min-samples', default=50, show_default=True, help='Minimum GPT-labelled tickets required to train.')
+    def train_triage(min_samples):
+        """
+        Retrains the local triage classifier from tickets whose category GPT confirmed.
+        """
+        from train_classifier import train_pipeline, save_classifier
+        from services.triage_classifier_service import triage_classifier
+
+        with app.app_context():
+            texts, labels = triage_classifier.training_data()
+            if len(texts) < min_samples or len(set(labels)) < 2:
+                logging.warning(f"[TRAIN-TRIAGE] Not enough labelled tickets ({len(texts)} samples, {len(set(labels))} labels).")
+                return
+
+            payload = train_pipeline(texts, labels)
+            save_classifier(payload, TRIAGE_CLASSIFIER_PATH)
+            triage_classifier.load(TRIAGE_CLASSIFIER_PATH)
+            logging.info(f"[TRAIN-TRIAGE] Trained on {len(texts)} tickets; saved to {TRIAGE_CLASSIFIER_PATH}.")
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables immediately after imports.
@@ -47,6 +48,28 @@ SMTP_USER   = os.getenv("SMTP_USER")
 SMTP_PASS   = os.getenv("SMTP_PASS") 
 FROM_NAME   = os.getenv("FROM_NAME") 
 CONFIRM_SALT = "solution-confirm-v1"
+# services/smtp_pool_service.py: "ssl" (implicit TLS, port 465), "starttls" or "none" (local test servers)
+SMTP_SECURITY = (os.getenv("SMTP_SECURITY") or ("ssl" if SMTP_PORT == 465 else "starttls")).lower()
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS") or 30)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE") or 4)                         # open connections kept per process
+SMTP_POOL_IDLE_SECONDS = float(os.getenv("SMTP_POOL_IDLE_SECONDS") or 60)      # drop connections idle longer than this
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION") or 100)
+# email_worker_loop claims this many queued emails per batch; SENDING rows whose lease
+# ran out (worker crashed mid-batch) become claimable again
+EMAIL_CLAIM_BATCH_SIZE = int(os.getenv("EMAIL_CLAIM_BATCH_SIZE") or 25)
+EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS") or 900)
+# Sends run on EMAIL_SEND_CONCURRENCY threads (keep <= SMTP_POOL_SIZE), at most
+# EMAIL_DOMAIN_CONCURRENCY at once per recipient domain
+EMAIL_SEND_CONCURRENCY = int(os.getenv("EMAIL_SEND_CONCURRENCY") or 4)
+EMAIL_DOMAIN_CONCURRENCY = int(os.getenv("EMAIL_DOMAIN_CONCURRENCY") or 2)
+# Transient failures are retried with exponential backoff plus jitter, then marked FAILED
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS") or 6)
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS") or 30)
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS") or 3600)
+# Enqueues wake the email worker through sockets in this directory (services/email_wakeup_service.py);
+# the worker still polls this often when no wakeup arrives
+EMAIL_WAKEUP_DIR = os.getenv("EMAIL_WAKEUP_DIR", os.path.join(tempfile.gettempdir(), "email-wakeup"))
+EMAIL_POLL_FALLBACK_SECONDS = float(os.getenv("EMAIL_POLL_FALLBACK_SECONDS") or 30)
 
 # ─── Additional Configs ───────────────────────────────────────────────────────
 # CORS origins for frontend and local dev
@@ -81,6 +104,70 @@ CONFIRM_REDIRECT_URL         = f"{FRONTEND_ORIGINS}/thank-you"
 # ─── OpenAI & FAISS setup ──────────────────────────────────────────────────────
 CHAT_MODEL = "gpt-3.5-turbo"
 EMB_MODEL  = "text-embedding-ada-002"
+# In-process LRU of embedding vectors (services/embedding_service.py); each ada-002
+# vector is ~6 KB and every gunicorn worker holds its own copy
+EMBEDDING_CACHE_ENTRIES = int(os.getenv("EMBEDDING_CACHE_ENTRIES") or 2000)
+
+# ─── OpenAI gateway ────────────────────────────────────────────────────────────
+# Every OpenAI call goes through services/openai_gateway_service.py: a bounded
+# per-process pool so a slow upstream cannot pin every web worker.
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS") or 30)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES") or 1)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY") or 8)
+OPENAI_MAX_QUEUE = int(os.getenv("OPENAI_MAX_QUEUE") or 32)
+OPENAI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OPENAI_QUEUE_TIMEOUT_SECONDS") or 10)
+
+# Account limits shared by every worker on the host (services/openai_rate_limiter_service.py);
+# set a limit to 0 to disable that bucket. Defaults sit a little under the usage-tier-1 limits.
+OPENAI_CHAT_RPM_LIMIT = int(os.getenv("OPENAI_CHAT_RPM_LIMIT") or 450)
+OPENAI_CHAT_TPM_LIMIT = int(os.getenv("OPENAI_CHAT_TPM_LIMIT") or 180000)
+OPENAI_EMBEDDING_RPM_LIMIT = int(os.getenv("OPENAI_EMBEDDING_RPM_LIMIT") or 2700)
+OPENAI_EMBEDDING_TPM_LIMIT = int(os.getenv("OPENAI_EMBEDDING_TPM_LIMIT") or 900000)
+OPENAI_RATE_STATE_PATH = os.getenv(
+    "OPENAI_RATE_STATE_PATH",
+    os.path.join(os.path.dirname(__file__), "openai_ratelimit.json"),
+)
+
+# ─── Local triage classifier ───────────────────────────────────────────────────
+# TF-IDF + LogisticRegression model trained by `flask train-triage`; GPT is only
+# consulted when the model's top probability falls below the threshold.
+TRIAGE_CLASSIFIER_PATH = os.getenv(
+    "TRIAGE_CLASSIFIER_PATH",
+    os.path.join(os.path.dirname(__file__), "triage_classifier.pkl"),
+)
+TRIAGE_CONFIDENCE_THRESHOLD = float(os.getenv("TRIAGE_CONFIDENCE_THRESHOLD") or 0.6)
+
+# ─── LLM response cache ────────────────────────────────────────────────────────
+# Opt-in per call site (services/llm_cache_service.py); memory LRU in front of the llm_cache table
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS") or 7 * 24 * 3600)
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES") or 2048)
+
+# ─── Rolling conversation summaries ────────────────────────────────────────────
+# services/conversation_summary_service.py folds new messages into a per-ticket
+# summary once this many have accumulated since the last checkpoint.
+CONVERSATION_SUMMARY_MIN_NEW_MESSAGES = int(os.getenv("CONVERSATION_SUMMARY_MIN_NEW_MESSAGES") or 6)
+
+# ─── Prompt context budgets ────────────────────────────────────────────────────
+# Token budgets for prompt assembly (services/prompt_context_service.py).
+# PROMPT_TOKEN_BUDGET=0 uses the per-model default; KB excerpts and past answers
+# share KB_CONTEXT_TOKEN_BUDGET inside the system prompt.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET") or 0)
+KB_CONTEXT_TOKEN_BUDGET = int(os.getenv("KB_CONTEXT_TOKEN_BUDGET") or 800)
+
+# ─── KB semantic search ────────────────────────────────────────────────────────
+# Cosine floor for search_relevant_articles; ada-002 scores unrelated text around 0.7,
+# so weaker matches are dropped rather than injected into chat context.
+KB_SEARCH_MIN_SIMILARITY = float(os.getenv("KB_SEARCH_MIN_SIMILARITY") or 0.75)
+# FAISS index of past ticket answers written by kb_ingest.py; metadata defaults to
+# faiss_meta.jsonl / faiss_meta.json next to the index
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", os.path.join(os.path.dirname(__file__), "faiss_index.bin"))
+FAISS_META_PATH = os.getenv("FAISS_META_PATH")
+# On-disk snapshot of the BM25 keyword index (rebuilt automatically when stale)
+KB_BM25_SNAPSHOT_PATH = os.getenv(
+    "KB_BM25_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(__file__), "kb_bm25_index.pkl"),
+)
 
 # ─── CSV loader ────────────────────────────────────────────────────────────────
 DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "cleaned_tickets.csv")
@@ -7,11 +7,10 @@ from flask import abort
 from sqlalchemy import text as _sql_text, func
 from extensions import db
 from models import Ticket, Message, ResolutionAttempt, TicketEvent, Solution, KBArticle, Department, TicketCC, EmailQueue, StepSequence, TicketHistory, SolutionGeneratedBy, SolutionStatus # Import all models
-from email_helpers import _fingerprint, _normalize
+from email_helpers import _fingerprint, _normalize, _email_fingerprint
 from openai_helpers import categorize_department_with_gpt
-from utils import extract_mentions
+from utils import extract_mentions, _can_view_clause, encode_cursor, decode_cursor
 from cli import load_df
-from openai_helpers import get_embedding_for_article
 
 # Insert a new message and store @mentions
 def insert_message_with_mentions(ticket_id, sender, content):
@@ -91,6 +90,9 @@ def run_sqlite_migrations():
     _add_column_no_default('tickets', 'level INTEGER')
     _add_column_no_default('tickets', 'resolved_by INTEGER')
     _add_column_no_default('tickets', 'assigned_to INTEGER')
+    _add_column_no_default('tickets', 'version INTEGER')
+    _add_column_no_default('tickets', 'escalation_count INTEGER NOT NULL DEFAULT 0')
+    _add_column_no_default('tickets', 'archived INTEGER NOT NULL DEFAULT 0')
 
     # messages QoL
     _add_column_no_default('messages', 'created_at TEXT')
@@ -158,6 +160,12 @@ def run_sqlite_migrations():
         );
     """))
 
+    _add_column_no_default('email_queue', 'claim_token TEXT')
+    _add_column_no_default('email_queue', 'lease_expires_at TEXT')
+    _add_column_no_default('email_queue', 'attempts INTEGER NOT NULL DEFAULT 0')
+    _add_column_no_default('email_queue', 'next_attempt_at TEXT')
+    _add_column_no_default('email_queue', 'fingerprint TEXT')
+
     db.session.execute(_sql_text("""
         CREATE TABLE IF NOT EXISTS ticket_feedback(
             id INTEGER PRIMARY KEY,
@@ -180,9 +188,87 @@ def run_sqlite_migrations():
         );
     """))
 
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS ticket_summaries(
+            ticket_id TEXT PRIMARY KEY REFERENCES tickets(id) ON DELETE CASCADE,
+            content_hash TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            model TEXT,
+            updated_at TEXT
+        );
+    """))
+
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS ticket_conversation_summaries(
+            ticket_id TEXT PRIMARY KEY REFERENCES tickets(id) ON DELETE CASCADE,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL DEFAULT 0,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            model TEXT,
+            updated_at TEXT
+        );
+    """))
+
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS ticket_activity(
+            ticket_id TEXT PRIMARY KEY REFERENCES tickets(id) ON DELETE CASCADE,
+            last_viewed_at TEXT NOT NULL,
+            last_viewed_by INTEGER REFERENCES agents(id) ON DELETE SET NULL,
+            view_count INTEGER NOT NULL DEFAULT 0
+        );
+    """))
+
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS ticket_triage(
+            ticket_id TEXT PRIMARY KEY REFERENCES tickets(id) ON DELETE CASCADE,
+            predicted_category TEXT NOT NULL,
+            assigned_team TEXT NOT NULL,
+            confidence REAL,
+            source TEXT NOT NULL DEFAULT 'model',
+            updated_at TEXT
+        );
+    """))
+
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS kb_article_embeddings(
+            article_id INTEGER PRIMARY KEY REFERENCES kb_articles(id) ON DELETE CASCADE,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            updated_at TEXT
+        );
+    """))
+
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS llm_cache(
+            key TEXT PRIMARY KEY,
+            call_site TEXT NOT NULL,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        );
+    """))
+    db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at ON llm_cache(expires_at);"))
+
+    db.session.execute(_sql_text("""
+        CREATE TABLE IF NOT EXISTS ticket_embeddings(
+            ticket_id TEXT PRIMARY KEY REFERENCES tickets(id) ON DELETE CASCADE,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            updated_at TEXT
+        );
+    """))
+
     # helpful indexes
     db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_tickets_dept ON tickets(department_id);"))
     db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_tickets_priority ON tickets(priority);"))
+    db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_tickets_archived_updated ON tickets(archived, updated_at, id);"))
+    db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_tickets_assignee_archived_updated ON tickets(assigned_to, archived, updated_at, id);"))
+    db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_tickets_dept_archived_updated ON tickets(department_id, archived, updated_at, id);"))
     db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_messages_ticket_time ON messages(ticket_id, timestamp);"))
     db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_eq_status ON email_queue(status, created_at);"))
     db.session.commit()
@@ -201,6 +287,54 @@ def run_sqlite_migrations():
         WHERE updated_at IS NULL;
     """))
 
+    # tickets.version: every existing ticket starts at version 1
+    db.session.execute(_sql_text("""
+        UPDATE tickets
+        SET version = 1
+        WHERE version IS NULL;
+    """))
+
+    # tickets.escalation_count: backfill from the event log (only tickets that were ever escalated)
+    db.session.execute(_sql_text("""
+        UPDATE tickets
+        SET escalation_count = (
+            SELECT COUNT(*) FROM ticket_events e
+            WHERE e.ticket_id = tickets.id AND e.event_type = 'ESCALATED'
+        )
+        WHERE escalation_count = 0
+          AND EXISTS (
+            SELECT 1 FROM ticket_events e
+            WHERE e.ticket_id = tickets.id AND e.event_type = 'ESCALATED'
+          );
+    """))
+
+    # email_queue.fingerprint: hash rows queued before the column existed, then keep only
+    # the oldest of any identical queued emails so the unique index below can be built
+    rows = db.session.execute(_sql_text(
+        "SELECT id, to_email, subject, body FROM email_queue WHERE fingerprint IS NULL"
+    )).fetchall()
+    if rows:
+        db.session.execute(_sql_text("UPDATE email_queue SET fingerprint = :fp WHERE id = :id"),
+                           [{"id": r.id, "fp": _email_fingerprint(r.to_email, r.subject, r.body)} for r in rows])
+    db.session.execute(_sql_text("""
+        UPDATE email_queue
+        SET status = 'FAILED', error = 'duplicate of an earlier queued email'
+        WHERE status IN ('PENDING', 'SENDING')
+          AND EXISTS (
+            SELECT 1 FROM email_queue older
+            WHERE older.fingerprint = email_queue.fingerprint
+              AND older.status IN ('PENDING', 'SENDING')
+              AND older.id < email_queue.id
+          );
+    """))
+    # Plain index serves the dedup lookup (a partial index can't match its bound status params);
+    # the partial unique one stops concurrent enqueues of the same email
+    db.session.execute(_sql_text("CREATE INDEX IF NOT EXISTS ix_email_queue_fingerprint ON email_queue(fingerprint);"))
+    db.session.execute(_sql_text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_eq_queued_fingerprint
+        ON email_queue(fingerprint) WHERE status IN ('PENDING', 'SENDING');
+    """))
+
     # messages.created_at mirror (optional)
     db.session.execute(_sql_text("""
         UPDATE messages
@@ -250,6 +384,17 @@ def add_event(ticket_id, event_type, actor_agent_id=None, **details):
         details=json.dumps(details, ensure_ascii=False),
     )
     db.session.add(ev)
+    if event_type == "ESCALATED":
+        _count_escalation(ticket_id)
+
+def _count_escalation(ticket_id):
+    """Keep tickets.escalation_count in step with ESCALATED events (atomic, no read-modify-write)"""
+    # Bulk updates skip the before_update hook, so bump the ETag version here too
+    Ticket.query.filter_by(id=ticket_id).update(
+        {Ticket.escalation_count: func.coalesce(Ticket.escalation_count, 0) + 1,
+         Ticket.version: func.coalesce(Ticket.version, 0) + 1},
+        synchronize_session=False,
+    )
 
 def create_solution(ticket_id: str, text: str, proposed_by: str | None = None):
     now = datetime.utcnow()
@@ -460,6 +605,8 @@ def log_event(ticket_id: str, event_type: str, details: dict | None = None, acto
     created_at=datetime.utcnow()
     )
     db.session.add(ev)
+    if event_type == "ESCALATED":
+        _count_escalation(ticket_id)
     db.session.commit()
 
 def get_timeline(ticket_id: str):
@@ -490,6 +637,79 @@ def get_timeline(ticket_id: str):
     return items
 
 
+THREAD_STATUS_FILTERS = ("open", "escalated", "closed", "resolved")
+
+def thread_list_query(role, user_department_id=None, archived=False, status=None, department_id=None):
+    """
+    Compile the /threads visibility model (archive flag, department rules,
+    role level rules, status filter) into a single ticket query.
+    department_id is an explicit filter the caller has already authorized.
+    """
+    query = Ticket.query.filter(Ticket.archived == archived)
+
+    if department_id is not None:
+        query = query.filter(Ticket.department_id == department_id)
+    elif user_department_id and user_department_id != 7:
+        # Helpdesk (7) and users without a department see every department
+        query = query.filter(Ticket.department_id == user_department_id)
+
+    query = query.filter(_can_view_clause(role, Ticket.level))
+
+    if status in THREAD_STATUS_FILTERS:
+        query = query.filter(func.coalesce(Ticket.status, "open") == status)
+
+    return query
+
+def _keyset_sort_key(model):
+    """
+    updated_at as the page key. SQLite stores it as text in whatever format the
+    writer used ('YYYY-MM-DD HH:MM:SS' from CURRENT_TIMESTAMP, with microseconds
+    from Python), so it is normalized to millisecond text there; otherwise text
+    comparison against a bound cursor value never matches the cursor row itself.
+    """
+    if db.engine.dialect.name == "sqlite":
+        return func.strftime("%Y-%m-%d %H:%M:%f", model.updated_at)
+    return model.updated_at
+
+def _keyset_bind(after_updated):
+    if db.engine.dialect.name == "sqlite":
+        return after_updated.strftime("%Y-%m-%d %H:%M:%S.") + f"{after_updated.microsecond // 1000:03d}"
+    return after_updated
+
+def keyset_page(query, model, limit: int, cursor: str | None = None, offset: int = 0):
+    """
+    Fetch one page ordered by (updated_at DESC, id DESC).
+    With a cursor the page starts right after the cursor row (cost independent of depth);
+    otherwise the legacy offset is applied. Returns (rows, next_cursor or None).
+    NULL updated_at rows sort last on both MySQL and SQLite, ordered by id.
+    """
+    limit = max(1, int(limit))
+    sort_key = _keyset_sort_key(model)
+    query = query.add_columns(sort_key).order_by(sort_key.desc(), model.id.desc())
+    if cursor:
+        after_updated, after_id = decode_cursor(cursor)
+        if after_updated is None:
+            query = query.filter(model.updated_at.is_(None), model.id < after_id)
+        else:
+            after_key = _keyset_bind(after_updated)
+            query = query.filter(db.or_(
+                sort_key < after_key,
+                db.and_(sort_key == after_key, model.id < after_id),
+                model.updated_at.is_(None),
+            ))
+    elif offset:
+        query = query.offset(offset)
+
+    results = query.limit(limit + 1).all()
+    rows = [row for row, _ in results]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last_key = results[limit - 1][1]
+    if isinstance(last_key, str):
+        last_key = datetime.fromisoformat(last_key)
+    return rows, encode_cursor(last_key, rows[-1].id)
+
 def ensure_owner_or_manager(ticket, user):
     if user.get("role") == "MANAGER":
         return
@@ -509,17 +729,14 @@ def _derive_subject_from_text(text: str) -> str:
 # ─── OpenAI & FAISS setup ──────────────────────────────────────────────────────
 # Create FAISS index for KB articles
 def create_faiss_index():
-    index = faiss.IndexFlatL2(768)  # Use 768-dimensional vectors (for BERT embeddings)
-    
-    # Load KB articles and their embeddings from the database
-    kb_articles = KBArticle.query.all()
-    embeddings = []
-    for article in kb_articles:
-        embeddings.append(get_embedding_for_article(article))  # Function to get embeddings from OpenAI or other models
-    
-    # Convert embeddings to a numpy array and add to FAISS index
-    embeddings = np.array(embeddings).astype(np.float32)
-    index.add(embeddings)
+    """Build a FAISS index over the stored KB article embeddings (no embedding calls)"""
+    from services.kb_embedding_service import kb_embeddings
+
+    article_ids = [a.id for a in KBArticle.query.with_entities(KBArticle.id).all()]
+    vectors = kb_embeddings.vectors_for(article_ids)
+    index = faiss.IndexFlatL2(kb_embeddings.dim or 1536)  # dimension of the stored embedding model
+    if vectors:
+        index.add(np.vstack([vectors[i] for i in article_ids if i in vectors]).astype(np.float32))
 
     return index
 
@@ -1,6 +1,5 @@
 import hashlib
 import json
-import ssl
 import smtplib
 import os
 from email.mime.text import MIMEText
@@ -8,10 +7,22 @@ from email.mime.multipart import MIMEMultipart
 from email.message import EmailMessage
 from datetime import datetime, timezone
 from flask import app
+from sqlalchemy.exc import IntegrityError
 from itsdangerous import URLSafeTimedSerializer
 from extensions import db
 from models import Ticket, TicketCC, EmailQueue
-from config import SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS, FROM_NAME, SECRET_KEY
+from config import SMTP_USER, SMTP_PASS, FROM_NAME, SECRET_KEY
+from services.smtp_pool_service import smtp_pool
+from services.email_wakeup_service import email_wakeup
+
+
+# Statuses covered by the unique fingerprint index: an identical email is queued or being sent
+EMAIL_DEDUP_STATUSES = ('PENDING', 'SENDING')
+
+
+def _email_fingerprint(to_email: str, subject: str, body: str) -> str:
+    """Dedup key for the email queue; matches the SHA2 backfill in schema_updates.sql"""
+    return hashlib.sha256(f"{to_email}\n{subject}\n{body}".encode("utf-8")).hexdigest()
 
 
 def enqueue_status_email(ticket_id: str, label: str, extra: str = ""):
@@ -31,8 +42,10 @@ def enqueue_status_email(ticket_id: str, label: str, extra: str = ""):
     requester_name = t.requester_name if t and t.requester_name else "there"
     body = f"Hello {requester_name},\n\nUpdate on your ticket {ticket_id}: {label}.\n\n{extra}\n\nThanks,\nSupport Team"
 
-    # Prevent duplicate emails: only queue if not already pending for this ticket/subject/body
-    existing = EmailQueue.query.filter_by(ticket_id=ticket_id, to_email=to_email, subject=subject, body=body, status='PENDING').first()
+    # Prevent duplicate emails: one index probe on the fingerprint of an identical queued email
+    fingerprint = _email_fingerprint(to_email, subject, body)
+    existing = EmailQueue.query.filter(EmailQueue.fingerprint == fingerprint,
+                                       EmailQueue.status.in_(EMAIL_DEDUP_STATUSES)).first()
     if existing:
         return
 
@@ -43,10 +56,17 @@ def enqueue_status_email(ticket_id: str, label: str, extra: str = ""):
         subject=subject,
         body=body,
         status='PENDING',
+        fingerprint=fingerprint,
     created_at=datetime.utcnow()
     )
     db.session.add(q)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent enqueue of the same email won the unique index
+        db.session.rollback()
+        return
+    email_wakeup.notify()
 
 def send_via_gmail(to_email: str, subject: str, body: str, cc_list: list[str] | None = None):
     """Send a plain‑text email via the unified Gmail account."""
@@ -63,8 +83,6 @@ def send_via_gmail(to_email: str, subject: str, body: str, cc_list: list[str] |
     
     try:
         print(f"📧 Attempting to send email to {to_email}")
-        print(f"📧 Using SMTP server: {SMTP_SERVER}:{SMTP_PORT}")
-        print(f"📧 Using SMTP user: {SMTP_USER}")
         
         em = EmailMessage()
         em["From"] = f"{FROM_NAME} <{SMTP_USER}>"
@@ -74,27 +92,23 @@ def send_via_gmail(to_email: str, subject: str, body: str, cc_list: list[str] |
         em["Subject"] = subject
         em.set_content(body)
 
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=context) as smtp:
-            smtp.set_debuglevel(1)  # Enable debug output
-            print(f"📧 Connecting to {SMTP_SERVER}:{SMTP_PORT}")
-            smtp.login(SMTP_USER, SMTP_PASS)
-            print(f"📧 Login successful, sending message...")
-            smtp.send_message(em)
-            print(f"📧 Email sent successfully to {to_email}")
+        # Pooled, already-authenticated connection; reconnects by itself if the server dropped it
+        # before the message was handed over (never after DATA, which could deliver it twice)
+        smtp_pool.send(em)
+        print(f"📧 Email sent successfully to {to_email}")
             
     except smtplib.SMTPAuthenticationError as e:
         error_msg = f"SMTP Authentication failed: {str(e)}. Check your email credentials."
         print(f"❌ {error_msg}")
-        raise Exception(error_msg)
+        raise Exception(error_msg) from e
     except smtplib.SMTPException as e:
         error_msg = f"SMTP error occurred: {str(e)}"
         print(f"❌ {error_msg}")
-        raise Exception(error_msg)
+        raise Exception(error_msg) from e
     except Exception as e:
         error_msg = f"Email send failed: {str(e)}"
         print(f"❌ {error_msg}")
-        raise Exception(error_msg)
+        raise Exception(error_msg) from e
 
 
 def _serializer(secret_key: str, salt: str = "solution-links-v1"):
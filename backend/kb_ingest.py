@@ -1,70 +1,240 @@
 import os
 import csv
 import json
+import argparse
 import faiss
 import numpy as np
-from openai import OpenAI
 from dotenv import load_dotenv
 
-OPENAI_API_KEY=os.environ["OPENAI_API_KEY"]
-client = OpenAI(api_key=OPENAI_API_KEY)
 # ─── Configuration ──────────────────────────────────────────────────────────────
-load_dotenv()  
+load_dotenv()
 API_KEY   = os.getenv("OPENAI_API_KEY")
 EMB_MODEL = "text-embedding-ada-002"
 INPUT_CSV = os.path.join(os.path.dirname(__file__), "data", "cleaned_tickets.csv")
 INDEX_FILE= os.path.join(os.path.dirname(__file__), "faiss_index.bin")
 META_FILE = os.path.join(os.path.dirname(__file__), "faiss_meta.json")
 
-if not API_KEY:
-    raise RuntimeError("Missing OPENAI_API_KEY in environment")
-
-# ─── Initialize OpenAI & FAISS ──────────────────────────────────────────────────
-client = OpenAI(api_key=API_KEY)
-dim    = 1536  # dimensionality of text-embedding-ada-002
-index  = faiss.IndexFlatL2(dim)
-metadatas = []
-
-# ─── Ingest & Embed ─────────────────────────────────────────────────────────────
-print("Reading CSV and chunking answers…")
-with open(INPUT_CSV, newline="", encoding="utf8") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        ticket_id = row["id"]
-        answer    = row.get("answer", "").strip()
-        if not answer:
-            continue
-
-        # Split into ~1000-char chunks (approx 500-800 tokens)
-        for i in range(0, len(answer), 1000):
-            chunk = answer[i : i + 1000]
-
-            # Embed the chunk
-            resp = client.embeddings.create(model=EMB_MODEL, input=chunk)
-            emb  = np.array(resp.data[0].embedding, dtype="float32")
-
-            # Add to FAISS index
-            index.add(emb.reshape(1, -1))
-
-            # Record metadata for retrieval
-            metadatas.append({
-                "ticket_id": ticket_id,
-                "chunk": chunk
-            })
-
-print(f"Embedded and indexed {len(metadatas)} chunks.")
-
-# ─── Persist Index & Metadata ──────────────────────────────────────────────────
-print(f"Saving FAISS index to {INDEX_FILE} …")
-faiss.write_index(index, INDEX_FILE)
-
-print(f"Saving metadata to {META_FILE} …")
-with open(META_FILE, "w", encoding="utf8") as f:
-    json.dump(metadatas, f, ensure_ascii=False, indent=2)
-
-print("Ingestion complete! You can now load faiss_index.bin and faiss_meta.json in your app.")
-
-
+# Streaming mode: append-only outputs plus a checkpoint describing how much of them is valid
+VECTORS_FILE    = os.path.join(os.path.dirname(__file__), "faiss_vectors.f32")   # raw float32 rows
+META_JSONL_FILE = os.path.join(os.path.dirname(__file__), "faiss_meta.jsonl")    # one JSON object per row
+CHECKPOINT_FILE = os.path.join(os.path.dirname(__file__), "kb_ingest.checkpoint.json")
 
+CHUNK_CHARS      = 1000   # ~1000-char chunks (approx 500-800 tokens)
+BATCH_CHUNKS     = 512    # chunks buffered before one embedding call
+CHECKPOINT_ROWS  = 5000   # CSV rows between checkpoints
+INDEX_BUILD_ROWS = 10000  # vectors read per block when building the FAISS index
 
+if not API_KEY:
+    raise RuntimeError("Missing OPENAI_API_KEY in environment")
 
+# Shared client: token-packed batches, duplicates embedded once, retry with backoff
+from services.embedding_service import embeddings
+
+
+def iter_chunks(answer: str):
+    for i in range(0, len(answer), CHUNK_CHARS):
+        yield answer[i : i + CHUNK_CHARS]
+
+
+def _atomic_write_json(path: str, payload: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ─── One-shot ingest (original behaviour) ───────────────────────────────────────
+def ingest_all():
+    dim    = 1536  # dimensionality of text-embedding-ada-002
+    index  = faiss.IndexFlatL2(dim)
+    metadatas = []
+
+    print("Reading CSV and chunking answers…")
+    with open(INPUT_CSV, newline="", encoding="utf8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            ticket_id = row["id"]
+            answer    = row.get("answer", "").strip()
+            if not answer:
+                continue
+
+            for chunk in iter_chunks(answer):
+                # Record metadata for retrieval
+                metadatas.append({
+                    "ticket_id": ticket_id,
+                    "chunk": chunk
+                })
+
+    vectors = embeddings.embed([m["chunk"] for m in metadatas], EMB_MODEL)
+    if vectors:
+        index.add(np.vstack(vectors).astype("float32"))
+
+    print(f"Embedded and indexed {len(metadatas)} chunks in {embeddings.stats['requests']} requests.")
+
+    print(f"Saving FAISS index to {INDEX_FILE} …")
+    faiss.write_index(index, INDEX_FILE)
+
+    print(f"Saving metadata to {META_FILE} …")
+    with open(META_FILE, "w", encoding="utf8") as f:
+        json.dump(metadatas, f, ensure_ascii=False, indent=2)
+
+    print("Ingestion complete! You can now load faiss_index.bin and faiss_meta.json in your app.")
+
+
+# ─── Streaming, resumable ingest ────────────────────────────────────────────────
+class StreamingIngest:
+    """
+    Reads the CSV row by row and embeds chunks in fixed-size batches, appending
+    vectors to VECTORS_FILE and metadata to META_JSONL_FILE. Every CHECKPOINT_ROWS
+    rows both files are fsynced and the checkpoint records how many rows and bytes
+    are durable; a restart truncates anything written after that and skips ahead.
+    Memory during embedding is bounded by BATCH_CHUNKS regardless of CSV size;
+    build_index() still holds every vector in an in-memory flat index.
+    """
+
+    def __init__(self, batch_chunks=BATCH_CHUNKS, checkpoint_rows=CHECKPOINT_ROWS):
+        self.batch_chunks = batch_chunks
+        self.checkpoint_rows = checkpoint_rows
+        self.rows_done = 0
+        self.vectors = 0
+        self.dim = None
+        self._pending = []  # (ticket_id, chunk)
+
+    @staticmethod
+    def _discard_outputs():
+        for path in (VECTORS_FILE, META_JSONL_FILE, CHECKPOINT_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_checkpoint(self, restart: bool):
+        if restart or not os.path.exists(CHECKPOINT_FILE):
+            self._discard_outputs()
+            return
+        with open(CHECKPOINT_FILE, encoding="utf8") as f:
+            ckpt = json.load(f)
+        if ckpt.get("model") != EMB_MODEL or ckpt.get("input") != os.path.abspath(INPUT_CSV):
+            raise RuntimeError(f"Checkpoint {CHECKPOINT_FILE} is for a different model or input; use --restart")
+        vector_bytes = ckpt["vectors"] * ckpt["dim"] * 4 if ckpt["dim"] else 0
+        # The checkpoint is only valid if both outputs still hold at least what it recorded
+        for path, needed in ((VECTORS_FILE, vector_bytes), (META_JSONL_FILE, ckpt["meta_bytes"])):
+            size = os.path.getsize(path) if os.path.exists(path) else None
+            if size is None or size < needed:
+                state = "is missing" if size is None else f"has {size} bytes, checkpoint expects {needed}"
+                print(f"{path} {state}; discarding the checkpoint and restarting from the first row.")
+                self._discard_outputs()
+                return
+        self.rows_done = ckpt["rows_done"]
+        self.vectors = ckpt["vectors"]
+        self.dim = ckpt["dim"]
+        # Drop anything appended after the last durable checkpoint
+        with open(VECTORS_FILE, "r+b") as f:
+            f.truncate(vector_bytes)
+        with open(META_JSONL_FILE, "r+b") as f:
+            f.truncate(ckpt["meta_bytes"])
+        print(f"Resuming after row {self.rows_done} ({self.vectors} vectors already embedded).")
+
+    def _flush(self, vec_out, meta_out):
+        if not self._pending:
+            return
+        vectors = embeddings.embed([chunk for _, chunk in self._pending], EMB_MODEL)
+        block = np.vstack(vectors).astype("<f4")
+        if self.dim is None:
+            self.dim = block.shape[1]
+        vec_out.write(block.tobytes())
+        for ticket_id, chunk in self._pending:
+            meta_out.write(json.dumps({"ticket_id": ticket_id, "chunk": chunk}, ensure_ascii=False) + "\n")
+        self.vectors += len(self._pending)
+        self._pending = []
+
+    def _checkpoint(self, vec_out, meta_out):
+        self._flush(vec_out, meta_out)
+        for out in (vec_out, meta_out):
+            out.flush()
+            os.fsync(out.fileno())
+        _atomic_write_json(CHECKPOINT_FILE, {
+            "model": EMB_MODEL,
+            "input": os.path.abspath(INPUT_CSV),
+            "dim": self.dim,
+            "rows_done": self.rows_done,
+            "vectors": self.vectors,
+            "meta_bytes": meta_out.tell(),
+        })
+        print(f"Checkpoint: {self.rows_done} rows, {self.vectors} vectors.")
+
+    def run(self, restart: bool = False):
+        self._load_checkpoint(restart)
+        with open(INPUT_CSV, newline="", encoding="utf8") as f, \
+             open(VECTORS_FILE, "ab") as vec_out, \
+             open(META_JSONL_FILE, "ab") as meta_bin:
+            meta_out = _BinaryLineWriter(meta_bin)
+            reader = csv.DictReader(f)
+            for row_no, row in enumerate(reader, 1):
+                if row_no <= self.rows_done:
+                    continue
+                answer = row.get("answer", "").strip()
+                if answer:
+                    for chunk in iter_chunks(answer):
+                        self._pending.append((row["id"], chunk))
+                        if len(self._pending) >= self.batch_chunks:
+                            self._flush(vec_out, meta_out)
+                self.rows_done = row_no
+                if row_no % self.checkpoint_rows == 0:
+                    self._checkpoint(vec_out, meta_out)
+            self._checkpoint(vec_out, meta_out)
+        print(f"Embedded {self.vectors} chunks from {self.rows_done} rows.")
+
+    def build_index(self):
+        """Build faiss_index.bin from VECTORS_FILE block by block (memmap, no full copy)"""
+        if not self.vectors:
+            print("No vectors to index.")
+            return
+        vectors = np.memmap(VECTORS_FILE, dtype="<f4", mode="r", shape=(self.vectors, self.dim))
+        index = faiss.IndexFlatL2(self.dim)
+        for start in range(0, self.vectors, INDEX_BUILD_ROWS):
+            index.add(np.ascontiguousarray(vectors[start:start + INDEX_BUILD_ROWS], dtype=np.float32))
+        tmp = f"{INDEX_FILE}.tmp"
+        faiss.write_index(index, tmp)
+        os.replace(tmp, INDEX_FILE)
+        print(f"Saved FAISS index with {index.ntotal} vectors to {INDEX_FILE}; metadata in {META_JSONL_FILE}.")
+
+
+class _BinaryLineWriter:
+    """Text lines into a binary append handle, so tell() is a byte offset usable for truncation"""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, text: str):
+        self.raw.write(text.encode("utf8"))
+
+    def flush(self):
+        self.raw.flush()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def tell(self):
+        return self.raw.tell()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Embed ticket answers into a FAISS index.",
+        epilog="--stream bounds memory only while embedding. Building faiss_index.bin loads every vector into an "
+               "in-memory flat index (about 6 KB per chunk); use --no-index to stop after embedding.")
+    parser.add_argument("--stream", action="store_true", help="Streaming, checkpointed ingest (resumes automatically).")
+    parser.add_argument("--restart", action="store_true", help="With --stream: discard any checkpoint and start over.")
+    parser.add_argument("--batch-chunks", type=int, default=BATCH_CHUNKS, help="Chunks per embedding batch.")
+    parser.add_argument("--checkpoint-rows", type=int, default=CHECKPOINT_ROWS, help="CSV rows between checkpoints.")
+    parser.add_argument("--no-index", action="store_true", help="With --stream: skip building faiss_index.bin.")
+    args = parser.parse_args()
+
+    if args.stream:
+        ingest = StreamingIngest(batch_chunks=args.batch_chunks, checkpoint_rows=args.checkpoint_rows)
+        ingest.run(restart=args.restart)
+        if not args.no_index:
+            ingest.build_index()
+    else:
+        ingest_all()
@@ -6,13 +6,16 @@ import logging
 import requests
 from datetime import datetime
 from typing import List, Dict, Optional
-from openai import OpenAI
+from services.openai_gateway_service import openai_gateway
 from models import KBArticle, KBArticleSource, KBArticleStatus, KBArticleVisibility, Department
 from extensions import db
-from config import OPENAI_KEY
+from config import OPENAI_KEY, KB_SEARCH_MIN_SIMILARITY
 
 log = logging.getLogger(__name__)
 
+# Cap on legacy articles one search queues for background embedding; the rest wait for later searches or `flask embed-kb`
+_EMBED_ON_SEARCH_LIMIT = 50
+
 class KBProtocolLoader:
     """Load static protocol documents into KB system"""
     
@@ -22,7 +25,7 @@ class KBProtocolLoader:
             self.protocols_base_url = "https://proud-tree-0c99b8f00.1.azurestaticapps.net/kb_protocols"
         else:
             self.protocols_base_url = protocols_base_url.rstrip('/')
-        self.client = OpenAI(api_key=OPENAI_KEY) if OPENAI_KEY else None
+        self.client = openai_gateway if OPENAI_KEY else None
         
         # List of known protocol files (since we can't directory-list via HTTP)
         self.known_protocol_files = [
@@ -115,23 +118,8 @@ class KBProtocolLoader:
             return None
             
         try:
-            # Try text-embedding-3-small first, fallback to ada-002 if not available
-            try:
-                response = self.client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=text
-                )
-                return response.data[0].embedding
-            except Exception as e:
-                if "model_not_found" in str(e) or "403" in str(e):
-                    log.warning("text-embedding-3-small not available, falling back to text-embedding-ada-002")
-                    response = self.client.embeddings.create(
-                        model="text-embedding-ada-002",
-                        input=text
-                    )
-                    return response.data[0].embedding
-                else:
-                    raise e
+            from services.embedding_service import embeddings
+            return embeddings.embed_one(text).tolist()
         except Exception as e:
             log.error(f"Error generating embedding: {e}")
             return None
@@ -165,10 +153,6 @@ class KBProtocolLoader:
                 log.warning(f"Could not check for existing article: {e}")
                 existing = None  # Continue with creation
             
-            # Generate embedding for semantic search
-            embedding_text = f"{protocol_data['title']} {protocol_data['problem_summary']} {protocol_data['solution_content']}"
-            embedding = self.generate_embedding(embedding_text)
-            
             # Create markdown content
             markdown_content = f"""# {protocol_data['title']}
 
@@ -203,11 +187,6 @@ class KBProtocolLoader:
                 source_value = KBArticleSource.human
                 log.info("Using 'human' source for protocol document (protocol enum not available)")
                 
-            # Determine embedding model name based on what was used
-            embedding_model_name = None
-            if embedding:
-                embedding_model_name = "text-embedding-ada-002"  # Default to ada-002 since it's more widely available
-                
             article = KBArticle(
                 title=protocol_data['title'],
                 problem_summary=protocol_data['problem_summary'][:500],  # Truncate for summary
@@ -217,8 +196,6 @@ class KBProtocolLoader:
                 visibility=KBArticleVisibility.internal,
                 status=KBArticleStatus.published,
                 canonical_fingerprint=fingerprint,
-                embedding_model=embedding_model_name,
-                embedding_hash=hashlib.md5(str(embedding).encode()).hexdigest() if embedding else None,
                 created_at=datetime.utcnow(),
                 updated_at=datetime.utcnow(),
                 approved_by="system"
@@ -227,10 +204,7 @@ class KBProtocolLoader:
             db.session.add(article)
             db.session.flush()
             
-            # Store embedding if available (you might want to add an embeddings table)
-            if embedding:
-                log.info(f"Generated embedding for: {protocol_data['title']}")
-            
+            # Embedding is written by load_all_protocols once the article is committed
             return article
             
         except Exception as e:
@@ -241,11 +215,6 @@ class KBProtocolLoader:
             if "Data truncated for column 'source'" in str(e) or "protocol" in str(e).lower():
                 log.warning("Retrying with 'human' source due to database schema issue")
                 try:
-                    # Determine embedding model name for retry
-                    retry_embedding_model_name = None
-                    if embedding:
-                        retry_embedding_model_name = "text-embedding-ada-002"
-                        
                     # Retry with human source
                     article = KBArticle(
                         title=protocol_data['title'],
@@ -256,8 +225,6 @@ class KBProtocolLoader:
                         visibility=KBArticleVisibility.internal,
                         status=KBArticleStatus.published,
                         canonical_fingerprint=fingerprint,
-                        embedding_model=retry_embedding_model_name,
-                        embedding_hash=hashlib.md5(str(embedding).encode()).hexdigest() if embedding else None,
                         created_at=datetime.utcnow(),
                         updated_at=datetime.utcnow(),
                         approved_by="system"
@@ -277,6 +244,7 @@ class KBProtocolLoader:
     def load_all_protocols(self) -> Dict[str, int]:
         """Load all protocol files from HTTP URLs"""
         results = {"loaded": 0, "skipped": 0, "errors": 0, "files_processed": []}
+        loaded_articles = []
         
         log.info(f"Loading protocols from: {self.protocols_base_url}")
         log.info(f"Known protocol files: {self.known_protocol_files}")
@@ -306,6 +274,7 @@ class KBProtocolLoader:
                 try:
                     article = self.create_kb_article(protocol_data)
                     if article:
+                        loaded_articles.append(article)
                         results["loaded"] += 1
                         results["files_processed"].append(filename)
                         log.info(f"✅ Successfully loaded protocol: {protocol_data['title']}")
@@ -330,52 +299,79 @@ class KBProtocolLoader:
             log.error(f"Error committing KB articles: {e}")
             results["errors"] = results["loaded"]
             results["loaded"] = 0
+            return results
+
+        # Write vectors once, at load time, so search never re-embeds the corpus
+        try:
+            from services.kb_embedding_service import kb_embeddings
+            results["embedded"] = kb_embeddings.embed_articles(loaded_articles)
+        except Exception as e:
+            db.session.rollback()
+            log.error(f"Error embedding loaded KB articles: {e}")
+            results["embedded"] = 0
+
+        try:
+            from services.kb_bm25_service import kb_bm25
+            kb_bm25.update_articles(loaded_articles)
+        except Exception as e:
+            log.error(f"Error updating BM25 index for loaded KB articles: {e}")
         
         return results
     
     def search_relevant_articles(self, query: str, department_id: Optional[int] = None, limit: int = 5) -> List[KBArticle]:
-        """Search for relevant KB articles (both protocol and dynamic)"""
+        """Search for relevant KB articles (both protocol and dynamic) by embedding similarity"""
         try:
-            # Start with basic text search
-            search_query = KBArticle.query.filter(
+            candidates = KBArticle.query.filter(
                 KBArticle.status == KBArticleStatus.published
             )
             
             # Filter by department if specified
             if department_id:
-                search_query = search_query.filter(KBArticle.category_id == department_id)
+                candidates = candidates.filter(KBArticle.category_id == department_id)
             
-            # Text-based search in title and content
-            search_terms = query.lower().split()
-            for term in search_terms:
-                search_query = search_query.filter(
-                    db.or_(
-                        KBArticle.title.ilike(f'%{term}%'),
-                        KBArticle.problem_summary.ilike(f'%{term}%'),
-                        KBArticle.content_md.ilike(f'%{term}%')
-                    )
-                )
-            
-            # Safe ordering with fallback
+            candidate_ids = [row.id for row in candidates.with_entities(KBArticle.id).all()]
+            if not candidate_ids or not (query or "").strip():
+                return []
+
             try:
-                articles = search_query.order_by(
-                    # Try to prioritize protocol articles if enum exists
-                    KBArticle.source == 'protocol',
-                    KBArticle.created_at.desc()
-                ).limit(limit).all()
+                from services.kb_embedding_service import kb_embeddings
+                # Articles that predate the embedding store are embedded in the background;
+                # this search ranks the ones that already have a vector
+                stored = kb_embeddings.vectors_for(candidate_ids)
+                unembedded = [i for i in candidate_ids if i not in stored][:_EMBED_ON_SEARCH_LIMIT]
+                if unembedded:
+                    kb_embeddings.schedule_embed(unembedded)
+                if not stored:
+                    return self._keyword_search(candidates, query, limit)
+
+                query_vec = kb_embeddings.embed_query(query)
+                matches = kb_embeddings.search(query_vec, k=limit, candidate_ids=list(stored))
             except Exception as e:
-                log.warning(f"Could not order by protocol source: {e}")
-                # Fallback to simple ordering
-                articles = search_query.order_by(
-                    KBArticle.created_at.desc()
-                ).limit(limit).all()
-            
-            return articles
+                log.warning(f"Semantic KB search unavailable, using keyword match: {e}")
+                return self._keyword_search(candidates, query, limit)
+
+            matches = [(article_id, sim) for article_id, sim in matches if sim >= KB_SEARCH_MIN_SIMILARITY]
+            if not matches:
+                return []
+            by_id = {a.id: a for a in KBArticle.query.filter(KBArticle.id.in_([i for i, _ in matches])).all()}
+            return [by_id[i] for i, _ in matches if i in by_id]
             
         except Exception as e:
             log.error(f"Error searching KB articles: {e}")
             return []
 
+    def _keyword_search(self, search_query, query: str, limit: int) -> List[KBArticle]:
+        """Fallback when embeddings are unavailable: every term must appear somewhere in the article"""
+        for term in query.lower().split():
+            search_query = search_query.filter(
+                db.or_(
+                    KBArticle.title.ilike(f'%{term}%'),
+                    KBArticle.problem_summary.ilike(f'%{term}%'),
+                    KBArticle.content_md.ilike(f'%{term}%')
+                )
+            )
+        return search_query.order_by(KBArticle.created_at.desc()).limit(limit).all()
+
 
 def get_kb_loader() -> KBProtocolLoader:
     """Get KB loader instance"""
@@ -6,6 +6,7 @@ from sqlalchemy.dialects.mysql import JSON as MySQLJSON
 from sqlalchemy.dialects.sqlite import JSON as SQLiteJSON
 from sqlalchemy import Enum, Float, UniqueConstraint, ForeignKey, Integer, String, Boolean, DateTime, Text, JSON
 from sqlalchemy import Enum as SAEnum
+from sqlalchemy import event, inspect
 from extensions import db
 from sqlalchemy.sql import func
 
@@ -117,6 +118,15 @@ class KBArticle(db.Model):
     updated_at = db.Column(db.DateTime(timezone=True), onupdate=func.now())
     approved_by = db.Column(db.String(45))  # Agent who promoted the article
 
+class KBArticleEmbedding(db.Model):
+    __tablename__ = 'kb_article_embeddings'
+    article_id = db.Column(db.Integer, db.ForeignKey('kb_articles.id', ondelete='CASCADE'), primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    dim = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of the embedded title/summary/content
+    vector = db.Column(db.LargeBinary, nullable=False)  # float32 little-endian, `dim` values
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 # KBArticleVersion model removed - unused versioning feature
 
 class KBFeedback(db.Model):
@@ -157,10 +167,34 @@ class Ticket(db.Model):
     resolved_by = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=True)
     assigned_to = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=True)
     archived = db.Column(db.Boolean, nullable=False, default=False)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # bumped on every state change
+    escalation_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # number of ESCALATED events
     
     # Relationships
     messages = db.relationship('Message', backref='ticket', lazy='dynamic', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_tickets_archived_updated', 'archived', 'updated_at', 'id'),
+        db.Index('ix_tickets_assignee_archived_updated', 'assigned_to', 'archived', 'updated_at', 'id'),
+        db.Index('ix_tickets_dept_archived_updated', 'department_id', 'archived', 'updated_at', 'id'),
+    )
+
+
+# Columns whose changes alone don't count as a new ticket version
+_UNVERSIONED_TICKET_COLUMNS = {'version', 'updated_at'}
+
+@event.listens_for(Ticket, 'before_update')
+def _bump_ticket_version(mapper, connection, target):
+    """Increment Ticket.version whenever a tracked column actually changes."""
+    state = inspect(target)
+    changed = any(
+        state.attrs[prop.key].history.has_changes()
+        for prop in mapper.column_attrs
+        if prop.key not in _UNVERSIONED_TICKET_COLUMNS
+    )
+    if changed:
+        target.version = (target.version or 0) + 1
+
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -174,6 +208,48 @@ class Message(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     sender_agent_id = db.Column(db.Integer, db.ForeignKey('agents.id'))
 
+class TicketSummary(db.Model):
+    __tablename__ = 'ticket_summaries'
+    ticket_id = db.Column(db.String(45), db.ForeignKey('tickets.id', ondelete='CASCADE'), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of the summarized subject + messages
+    summary = db.Column(db.Text, nullable=False)
+    model = db.Column(db.String(100))
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class TicketConversationSummary(db.Model):
+    __tablename__ = 'ticket_conversation_summaries'
+    ticket_id = db.Column(db.String(45), db.ForeignKey('tickets.id', ondelete='CASCADE'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False, default=0)  # checkpoint: newest message folded in
+    message_count = db.Column(db.Integer, nullable=False, default=0)    # messages folded in so far
+    model = db.Column(db.String(100))
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class TicketActivity(db.Model):
+    __tablename__ = 'ticket_activity'
+    ticket_id = db.Column(db.String(45), db.ForeignKey('tickets.id', ondelete='CASCADE'), primary_key=True)
+    last_viewed_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_viewed_by = db.Column(db.Integer, db.ForeignKey('agents.id', ondelete='SET NULL'), nullable=True)
+    view_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class TicketTriage(db.Model):
+    __tablename__ = 'ticket_triage'
+    ticket_id = db.Column(db.String(45), db.ForeignKey('tickets.id', ondelete='CASCADE'), primary_key=True)
+    predicted_category = db.Column(db.String(100), nullable=False)
+    assigned_team = db.Column(db.String(100), nullable=False)
+    confidence = db.Column(db.Float)
+    source = db.Column(db.String(20), nullable=False, default='model')  # model | gpt | pending_gpt
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class TicketEmbedding(db.Model):
+    __tablename__ = 'ticket_embeddings'
+    ticket_id = db.Column(db.String(45), db.ForeignKey('tickets.id', ondelete='CASCADE'), primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    dim = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of the embedded subject
+    vector = db.Column(db.LargeBinary, nullable=False)  # float32 little-endian, `dim` values
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class ResolutionAttempt(db.Model):
     __tablename__ = 'resolution_attempts'
     id = db.Column(db.Integer, primary_key=True)
@@ -252,6 +328,12 @@ class EmailQueue(db.Model):
     error = db.Column(db.Text)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     sent_at = db.Column(db.DateTime(timezone=True))
+    claim_token = db.Column(db.String(32))             # worker batch that holds the SENDING lease
+    lease_expires_at = db.Column(db.DateTime)          # SENDING rows past this are reclaimed (naive UTC)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = db.Column(db.DateTime)           # PENDING rows wait until this after a transient failure (naive UTC)
+    # sha256(to_email, subject, body); unique among PENDING/SENDING rows (see schema_updates.sql / run_sqlite_migrations)
+    fingerprint = db.Column(db.String(64), index=True)
 
 class TicketFeedback(db.Model):
     __tablename__ = 'ticket_feedback'
@@ -364,5 +446,15 @@ class DashboardView(db.Model):
         db.UniqueConstraint('owner_id', 'name', 'target', name='ux_dashboard_views_owner_name_target'),
     )
 
+
+class LLMCacheEntry(db.Model):
+    __tablename__ = 'llm_cache'
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of (model, normalized messages, params)
+    call_site = db.Column(db.String(100), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
 # KBDraft model removed - unused drafting feature
     
\ No newline at end of file
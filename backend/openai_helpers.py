@@ -1,14 +1,15 @@
 # ─── Intent Expansion Helper ────────────────────────────────────────────────
 import difflib
 import re
-from openai import OpenAI
 from category_map import LABELS, TEAM_MAP
-from config import ASSISTANT_STYLE, OPENAI_KEY
+from config import ASSISTANT_STYLE
 
 from models import Department, Ticket
+from services.llm_cache_service import llm_cache
+from services.openai_gateway_service import openai_gateway
 
 
-client     = OpenAI(api_key=OPENAI_KEY)
+client     = openai_gateway  # bounded pool + timeouts; same create() API as the SDK client
 CHAT_MODEL = "gpt-3.5-turbo"
 EMB_MODEL  = "text-embedding-ada-002"
 
@@ -59,16 +60,15 @@ Issue description:
 """
 
     try:
-        resp = client.chat.completions.create(
-            model=CHAT_MODEL,
+        label = llm_cache.chat(
+            "categorize_with_gpt", client, CHAT_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful ticket classifier."},
                 {"role": "user",   "content": prompt}
             ],
             temperature=0.0,
             max_tokens=10
-        )
-        label = resp.choices[0].message.content.strip()
+        ).strip()
         # Clean up any stray punctuation
         label = re.sub(r'[^a-zA-Z0-9_]', '', label)
         team  = TEAM_MAP.get(label, TEAM_MAP.get("other", "General-Support"))
@@ -94,16 +94,15 @@ Respond with exactly one of those department names, and nothing else.
 Issue description:
 {text}
 """
-    resp = client.chat.completions.create(
-        model=CHAT_MODEL,
+    dep = llm_cache.chat(
+        "categorize_department_with_gpt", client, CHAT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful ticket classifier."},
             {"role": "user",   "content": prompt}
         ],
         temperature=0.0,
         max_tokens=10
-    )
-    dep = resp.choices[0].message.content.strip()
+    ).strip()
     dep = re.sub(r'[^a-zA-Z0-9 ]', '', dep)
     # Return department name if valid
     if dep in department_list:
@@ -163,10 +162,7 @@ def get_embedding_for_article(article):
     content = getattr(article, 'content_md', None) or article.get('content_md', '')
     text = f"Title: {title}\nSummary: {summary}\nContent: {content}"
 
-    # Call OpenAI API for embedding
-    response = client.embeddings.create(
-        input=text,
-        model=EMB_MODEL
-    )
-    return response.data[0].embedding
+    # Shared batched/cached embedding client
+    from services.embedding_service import embeddings
+    return embeddings.embed_one(text, EMB_MODEL).tolist()
 
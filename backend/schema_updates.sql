@@ -0,0 +1,136 @@
+-- Incremental schema updates for MySQL deployments
+-- SQLite dev databases get the same changes from run_sqlite_migrations()
+-- Run each section once, in order, in MySQL Workbench
+
+USE tickets;
+
+-- Ticket summary store (served by GET /threads/<id>)
+CREATE TABLE IF NOT EXISTS ticket_summaries (
+    ticket_id VARCHAR(45) NOT NULL PRIMARY KEY,
+    content_hash VARCHAR(64) NOT NULL,
+    summary TEXT NOT NULL,
+    model VARCHAR(100),
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_ticket_summaries_ticket FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+);
+
+-- Ticket version counter (GET /threads/<id>/state ETag)
+ALTER TABLE tickets
+ADD COLUMN version INT NOT NULL DEFAULT 1;
+
+-- Buffered "last viewed" activity (flushed by services/ticket_activity_service.py)
+CREATE TABLE IF NOT EXISTS ticket_activity (
+    ticket_id VARCHAR(45) NOT NULL PRIMARY KEY,
+    last_viewed_at DATETIME NOT NULL,
+    last_viewed_by INT NULL,
+    view_count INT NOT NULL DEFAULT 0,
+    CONSTRAINT fk_ticket_activity_ticket FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE,
+    CONSTRAINT fk_ticket_activity_agent FOREIGN KEY (last_viewed_by) REFERENCES agents(id) ON DELETE SET NULL
+);
+
+-- Persisted per-ticket triage (services/triage_classifier_service.py)
+CREATE TABLE IF NOT EXISTS ticket_triage (
+    ticket_id VARCHAR(45) NOT NULL PRIMARY KEY,
+    predicted_category VARCHAR(100) NOT NULL,
+    assigned_team VARCHAR(100) NOT NULL,
+    confidence FLOAT NULL,
+    source VARCHAR(20) NOT NULL DEFAULT 'model',
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_ticket_triage_ticket FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+);
+
+-- /threads page query: WHERE archived = ? ORDER BY updated_at DESC, id DESC LIMIT ?
+CREATE INDEX ix_tickets_archived_updated ON tickets (archived, updated_at, id);
+
+-- Keyset pages for /dashboard/my-tickets: WHERE assigned_to = ? AND archived = ? ORDER BY updated_at DESC, id DESC
+CREATE INDEX ix_tickets_assignee_archived_updated ON tickets (assigned_to, archived, updated_at, id);
+-- Keyset pages for department tickets on the dashboard
+CREATE INDEX ix_tickets_dept_archived_updated ON tickets (department_id, archived, updated_at, id);
+
+-- Denormalized escalation counter (replaces the per-ticket ESCALATED COUNT in GET /threads)
+ALTER TABLE tickets
+ADD COLUMN escalation_count INT NOT NULL DEFAULT 0;
+
+UPDATE tickets t
+JOIN (
+    SELECT ticket_id, COUNT(*) AS n
+    FROM ticket_events
+    WHERE event_type = 'ESCALATED'
+    GROUP BY ticket_id
+) e ON e.ticket_id = t.id
+SET t.escalation_count = e.n,
+    t.updated_at = t.updated_at;  -- keep list ordering unchanged
+
+-- Persisted ticket subject embeddings (services/ticket_embedding_service.py)
+CREATE TABLE IF NOT EXISTS ticket_embeddings (
+    ticket_id VARCHAR(45) NOT NULL PRIMARY KEY,
+    model VARCHAR(100) NOT NULL,
+    dim INT NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    vector BLOB NOT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_ticket_embeddings_ticket FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+);
+
+-- Persisted KB article embeddings (services/kb_embedding_service.py)
+CREATE TABLE IF NOT EXISTS kb_article_embeddings (
+    article_id INT NOT NULL PRIMARY KEY,
+    model VARCHAR(100) NOT NULL,
+    dim INT NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    vector BLOB NOT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_kb_article_embeddings_article FOREIGN KEY (article_id) REFERENCES kb_articles(id) ON DELETE CASCADE
+);
+
+-- Persistent tier of the LLM response cache (services/llm_cache_service.py)
+CREATE TABLE IF NOT EXISTS llm_cache (
+    `key` CHAR(64) NOT NULL PRIMARY KEY,
+    call_site VARCHAR(100) NOT NULL,
+    model VARCHAR(100) NOT NULL,
+    response TEXT NOT NULL,
+    created_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    INDEX ix_llm_cache_expires_at (expires_at)
+);
+
+-- Rolling per-ticket conversation summary (services/conversation_summary_service.py)
+CREATE TABLE IF NOT EXISTS ticket_conversation_summaries (
+    ticket_id VARCHAR(45) NOT NULL PRIMARY KEY,
+    summary TEXT NOT NULL,
+    last_message_id INT NOT NULL DEFAULT 0,
+    message_count INT NOT NULL DEFAULT 0,
+    model VARCHAR(100),
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_ticket_conversation_summaries_ticket FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+);
+
+-- Batch claim lease for the email worker (urls._claim_pending_ids)
+ALTER TABLE email_queue
+    ADD COLUMN claim_token VARCHAR(32) NULL,
+    ADD COLUMN lease_expires_at DATETIME NULL;
+
+-- Scheduled retries for transient SMTP failures (urls.email_worker_loop)
+ALTER TABLE email_queue
+    ADD COLUMN attempts INT NOT NULL DEFAULT 0,
+    ADD COLUMN next_attempt_at DATETIME NULL;
+
+-- Dedup key for queued emails (email_helpers.enqueue_status_email). MySQL has no partial
+-- indexes, so the unique index sits on a virtual column that is NULL once a row is SENT/FAILED.
+ALTER TABLE email_queue
+    ADD COLUMN fingerprint CHAR(64) NULL,
+    ADD INDEX ix_email_queue_fingerprint (fingerprint);
+UPDATE email_queue
+SET fingerprint = SHA2(CONCAT(to_email, '\n', subject, '\n', body), 256)
+WHERE fingerprint IS NULL;
+UPDATE email_queue e
+JOIN email_queue older
+  ON older.fingerprint = e.fingerprint
+ AND older.status IN ('PENDING', 'SENDING')
+ AND older.id < e.id
+SET e.status = 'FAILED', e.error = 'duplicate of an earlier queued email'
+WHERE e.status IN ('PENDING', 'SENDING');
+ALTER TABLE email_queue
+    ADD COLUMN queued_fingerprint CHAR(64)
+        AS (IF(status IN ('PENDING', 'SENDING'), fingerprint, NULL)) VIRTUAL,
+    ADD UNIQUE INDEX ux_eq_queued_fingerprint (queued_fingerprint);
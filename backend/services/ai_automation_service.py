@@ -8,16 +8,17 @@ import logging
 import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional
-from openai import OpenAI
 from models import Ticket, AIAutomationSettings, AIAction, Department, KBArticle, Agent, db, Message, Solution, ResolutionAttempt, SolutionStatus, SolutionGeneratedBy
 from openai_helpers import categorize_department_with_gpt, client, CHAT_MODEL
-from config import OPENAI_KEY
+from services.llm_cache_service import llm_cache
+from services.openai_gateway_service import openai_gateway
+from services.prompt_context_service import ContextSnippet, prompt_context
 
 logger = logging.getLogger(__name__)
 
 class AIAutomationService:
     def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_KEY)
+        self.client = openai_gateway
         
     def get_settings(self) -> AIAutomationSettings:
         """Get current AI automation settings"""
@@ -305,8 +306,8 @@ Respond in JSON format:
 }}
 """
         
-        response = self.client.chat.completions.create(
-            model=CHAT_MODEL,
+        content = llm_cache.chat(
+            "ai_automation.predict_department", self.client, CHAT_MODEL,
             messages=[
                 {"role": "system", "content": "You are a ticket triage expert. Always respond with valid JSON."},
                 {"role": "user", "content": prompt}
@@ -315,7 +316,7 @@ Respond in JSON format:
             max_tokens=200
         )
         
-        result = json.loads(response.choices[0].message.content)
+        result = json.loads(content)
         
         # Find department ID
         dept = Department.query.filter_by(name=result['department']).first()
@@ -331,9 +332,8 @@ Respond in JSON format:
     
     def _generate_solution_with_confidence(self, ticket: Ticket) -> Dict:
         """Generate solution email with confidence scoring"""
-        # Get relevant KB articles
-        kb_articles = self._get_relevant_kb_articles(ticket)
-        kb_context = "\n".join([f"- {art.title}: {art.content[:200]}..." for art in kb_articles[:3]])
+        # Relevant KB articles and past answers, packed into the KB context token budget
+        kb_context, past_answers, kb_articles = self._solution_context(ticket)
         
         prompt = f"""
 You are an expert technical support agent. Generate a professional solution email for this ticket.
@@ -347,6 +347,9 @@ Ticket Details:
 Relevant Knowledge Base Articles:
 {kb_context}
 
+Similar Past Ticket Answers:
+{past_answers}
+
 Generate a response in JSON format:
 {{
     "solution_email": "Clear solution steps and instructions only (no greeting or signature)",
@@ -368,10 +371,10 @@ Guidelines:
         
         response = self.client.chat.completions.create(
             model=CHAT_MODEL,
-            messages=[
+            messages=prompt_context.fit_messages("ai_automation.solution", [
                 {"role": "system", "content": "You are a professional technical support expert."},
                 {"role": "user", "content": prompt}
-            ],
+            ], completion_tokens=500),
             temperature=0.1,
             max_tokens=500
         )
@@ -447,18 +450,44 @@ Guidelines:
     
     def _get_relevant_kb_articles(self, ticket: Ticket) -> List[KBArticle]:
         """Get relevant KB articles for ticket"""
-        # Simple keyword matching - could be enhanced with embeddings
-        search_text = f"{ticket.subject} {ticket.category}".lower()
-        
-        articles = KBArticle.query.filter(
-            KBArticle.status == 'published',
-            db.or_(
-                KBArticle.title.ilike(f'%{search_text}%'),
-                KBArticle.content_md.ilike(f'%{search_text}%')
+        # Semantic search over the stored KB embeddings (same engine as chat and /kb/search)
+        from kb_loader import get_kb_loader
+        search_text = f"{ticket.subject or ''} {ticket.category or ''}".strip()
+        return get_kb_loader().search_relevant_articles(search_text, limit=5)
+    
+    def _get_similar_past_answers(self, ticket: Ticket) -> List[Dict]:
+        """Answers from similar past tickets (FAISS answer index)"""
+        from services.answer_retrieval_service import answer_retrieval
+        from config import KB_SEARCH_MIN_SIMILARITY
+        try:
+            return answer_retrieval.similar_answers(
+                f"{ticket.subject or ''} {ticket.category or ''}".strip(), k=2,
+                min_similarity=KB_SEARCH_MIN_SIMILARITY, exclude_ticket_id=ticket.id
             )
-        ).limit(5).all()
-        
-        return articles
+        except Exception as e:
+            logger.warning(f"Similar-answer lookup failed for ticket {ticket.id}: {e}")
+            return []
+
+    def _solution_context(self, ticket: Ticket) -> Tuple[str, str, List[KBArticle]]:
+        """
+        KB excerpts and past answers for the solution prompt, best-first within
+        KB_CONTEXT_TOKEN_BUDGET, plus the KB articles that made it into the prompt
+        """
+        from config import KB_CONTEXT_TOKEN_BUDGET
+        query = f"{ticket.subject or ''} {ticket.category or ''}"
+        snippets = []
+        for rank, art in enumerate(self._get_relevant_kb_articles(ticket)[:3]):
+            text = f"- {art.title}: {art.content_md or ''}"
+            score = 1.0 - 0.1 * rank + 0.3 * prompt_context.relevance(query, text)
+            snippets.append(ContextSnippet(text, score, order=rank, min_tokens=40, payload=art))
+        for j, a in enumerate(self._get_similar_past_answers(ticket)):
+            snippets.append(ContextSnippet(f"- {a['chunk']}", 0.8 * a["similarity"], order=10 + j,
+                                           min_tokens=40, payload="answer"))
+        chosen, _ = prompt_context.pack(snippets, KB_CONTEXT_TOKEN_BUDGET)
+        kb_chosen = [s for s in chosen if isinstance(s.payload, KBArticle)]
+        kb_context = "\n".join(s.text for s in kb_chosen)
+        past_answers = "\n".join(s.text for s in chosen if s.payload == "answer") or "(none)"
+        return kb_context, past_answers, [s.payload for s in kb_chosen]
     
     def _apply_triage_action(self, ai_action: AIAction, ticket: Ticket, new_dept_id: int):
         """Apply the triage action to the ticket"""
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Answer Retrieval Service
+Serves "similar past answers" from the FAISS index written by kb_ingest.py.
+The index is memory-mapped once per process, checked against the embedding
+model's dimension, and swapped in place when the file on disk changes.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from config import FAISS_INDEX_PATH, FAISS_META_PATH
+from openai_helpers import EMB_MODEL
+from services.embedding_service import embeddings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import faiss
+except ImportError:  # retrieval is optional; chat works without it
+    faiss = None
+
+MODEL_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+RELOAD_CHECK_SECONDS = 5.0
+
+
+class _Snapshot:
+    """One loaded index + metadata pair; replaced wholesale on reload"""
+
+    def __init__(self, index, meta, signature):
+        self.index = index
+        self.meta = meta
+        self.signature = signature
+
+
+class _JsonlMeta:
+    """Line offsets into faiss_meta.jsonl; rows are read on demand so metadata never sits in memory"""
+
+    def __init__(self, path: str):
+        self.path = path
+        offsets = []
+        with open(path, "rb") as f:
+            pos = 0
+            for line in f:
+                offsets.append(pos)
+                pos += len(line)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> Dict:
+        with open(self.path, "rb") as f:
+            f.seek(int(self.offsets[i]))
+            return json.loads(f.readline())
+
+
+class AnswerRetrievalService:
+    def __init__(self, index_path: str = FAISS_INDEX_PATH, meta_path: str = FAISS_META_PATH, model: str = EMB_MODEL):
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.model = model
+        self._snapshot: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def _meta_candidates(self) -> List[str]:
+        """Explicit path, else the streaming ingest's JSONL, then the one-shot JSON file"""
+        if self.meta_path:
+            return [self.meta_path]
+        base = os.path.join(os.path.dirname(self.index_path), "faiss_meta")
+        return [p for p in (f"{base}.jsonl", f"{base}.json") if os.path.exists(p)]
+
+    @staticmethod
+    def _read_meta(path: str):
+        if path.endswith(".jsonl"):
+            return _JsonlMeta(path)
+        with open(path, encoding="utf8") as f:
+            return json.load(f)
+
+    def _signature(self):
+        try:
+            st = os.stat(self.index_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def load(self) -> bool:
+        """(Re)load the index if present and valid; keeps serving the previous one on failure"""
+        if faiss is None:
+            logger.info("faiss not installed; similar-answer retrieval disabled")
+            return False
+        signature = self._signature()
+        meta_paths = self._meta_candidates()
+        if signature is None or not meta_paths:
+            logger.info(f"No FAISS answer index at {self.index_path}; similar-answer retrieval disabled")
+            return False
+        try:
+            try:
+                index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                # Not every index type supports mmap; a flat index is then read into memory
+                index = faiss.read_index(self.index_path)
+
+            expected = MODEL_DIMENSIONS.get(self.model)
+            if expected and index.d != expected:
+                logger.error(f"FAISS index {self.index_path} has dim {index.d}, but {self.model} produces {expected}; not loading")
+                return False
+
+            # Use the metadata file whose row count matches the index (both ingest modes may have run)
+            meta = None
+            for meta_path in meta_paths:
+                candidate = self._read_meta(meta_path)
+                if len(candidate) == index.ntotal:
+                    meta = candidate
+                    break
+                logger.warning(f"{meta_path} has {len(candidate)} rows but the index has {index.ntotal} vectors")
+            if meta is None:
+                logger.error(f"No metadata file matches FAISS index {self.index_path}; not loading")
+                return False
+
+            with self._lock:
+                self._snapshot = _Snapshot(index, meta, signature)
+            logger.info(f"Loaded FAISS answer index: {index.ntotal} vectors, dim {index.d}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load FAISS answer index {self.index_path}: {e}")
+            return False
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_SECONDS:
+            return
+        self._last_check = now
+        current = self._snapshot
+        signature = self._signature()
+        if signature and (current is None or signature != current.signature):
+            logger.info("FAISS answer index changed on disk; reloading")
+            self.load()
+
+    def similar_answers(self, query: str, k: int = 3, min_similarity: float = 0.0,
+                        exclude_ticket_id: Optional[str] = None) -> List[Dict]:
+        """
+        Top-k past answer chunks for `query`, at most one per ticket:
+        [{"ticket_id", "chunk", "similarity"}], best first.
+        """
+        self._maybe_reload()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.index.ntotal == 0 or k <= 0 or not (query or "").strip():
+            return []
+
+        vec = embeddings.embed_one(query, self.model).reshape(1, -1)
+        # Over-fetch so per-ticket de-duplication still leaves k results
+        distances, ids = snapshot.index.search(np.ascontiguousarray(vec, dtype=np.float32), min(k * 4, snapshot.index.ntotal))
+        results, seen = [], set()
+        for dist, idx in zip(distances[0], ids[0]):
+            if idx < 0:
+                continue
+            row = snapshot.meta[int(idx)]
+            ticket_id = row.get("ticket_id")
+            if ticket_id == exclude_ticket_id or ticket_id in seen:
+                continue
+            similarity = 1.0 - float(dist) / 2.0  # embeddings are unit length, so L2^2 = 2 - 2cos
+            if similarity < min_similarity:
+                break
+            seen.add(ticket_id)
+            results.append({"ticket_id": ticket_id, "chunk": row.get("chunk", ""), "similarity": similarity})
+            if len(results) >= k:
+                break
+        return results
+
+
+# Service instance
+answer_retrieval = AnswerRetrievalService()
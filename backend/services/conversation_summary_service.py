@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Conversation Summary Service
+Keeps a compact rolling summary of each ticket's conversation. A checkpoint
+(the newest message id folded in) means each refresh only sends the previous
+summary plus the messages added since, so the cost of a refresh does not grow
+with the length of the thread. Chat, escalation and the ticket report read the
+stored summary instead of re-reading every message.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from config import CONVERSATION_SUMMARY_MIN_NEW_MESSAGES
+from models import Message, TicketConversationSummary, db
+from openai_helpers import client, CHAT_MODEL
+from services.openai_rate_limiter_service import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+FOLD_MAX_MESSAGES = 40       # messages folded per model call
+FOLD_MAX_CHARS = 6000        # ...and at most this much message text
+MESSAGE_MAX_CHARS = 600      # longer messages are clipped before folding
+SUMMARY_MAX_TOKENS = 350
+
+_FOLD_PROMPT = (
+    "You maintain a running summary of an IT support ticket conversation for the agents working it. "
+    "Merge the new messages into the existing summary. Keep it under 200 words with these parts: "
+    "Issue, Environment/details, Steps tried and results, Current status, Open questions. "
+    "Keep concrete facts (error codes, versions, names, commands); drop greetings and repetition."
+)
+
+
+class ConversationSummaryService:
+    def __init__(self, max_workers: int = 1, min_new_messages: int = CONVERSATION_SUMMARY_MIN_NEW_MESSAGES):
+        self.min_new_messages = min_new_messages
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conversation-summary")
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def get(self, ticket_id: str) -> Optional[TicketConversationSummary]:
+        return db.session.get(TicketConversationSummary, ticket_id)
+
+    def pending_count(self, ticket_id: str, row: Optional[TicketConversationSummary] = None) -> int:
+        """Messages added since the checkpoint"""
+        row = row if row is not None else self.get(ticket_id)
+        checkpoint = row.last_message_id if row else 0
+        return (db.session.query(db.func.count(Message.id))
+                .filter(Message.ticket_id == ticket_id, Message.id > checkpoint)
+                .scalar() or 0)
+
+    # ─── Folding ──────────────────────────────────────────────────────────────
+    @staticmethod
+    def _format(message: Message) -> str:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        content = " ".join(content.replace("[SYSTEM]", "").split())
+        if len(content) > MESSAGE_MAX_CHARS:
+            content = content[:MESSAGE_MAX_CHARS] + " …"
+        return f"{message.sender}: {content}"
+
+    def _next_batch(self, ticket_id: str, checkpoint: int) -> List[Message]:
+        rows = (Message.query
+                .filter(Message.ticket_id == ticket_id, Message.id > checkpoint)
+                .order_by(Message.id.asc())
+                .limit(FOLD_MAX_MESSAGES)
+                .all())
+        batch, size = [], 0
+        for m in rows:
+            line = self._format(m)
+            if batch and size + len(line) > FOLD_MAX_CHARS:
+                break
+            batch.append(m)
+            size += len(line)
+        return batch
+
+    def _fold(self, subject: str, summary: str, batch: List[Message], priority: str = None) -> str:
+        new_lines = "\n".join(self._format(m) for m in batch)
+        kwargs = {"priority": priority} if priority else {}
+        resp = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": _FOLD_PROMPT},
+                {"role": "user", "content": f"Ticket subject: {subject or '(none)'}\n\n"
+                                            f"Existing summary:\n{summary or '(none yet)'}\n\n"
+                                            f"New messages:\n{new_lines}"},
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            **kwargs
+        )
+        return (resp.choices[0].message.content or "").strip()
+
+    def refresh(self, ticket_id: str, subject: str = "", priority: str = None, max_folds: int = None) -> Optional[str]:
+        """
+        Fold messages newer than the checkpoint into the summary, oldest first
+        (at most `max_folds` model calls), and commit. Returns the current summary.
+        """
+        row = self.get(ticket_id)
+        existed = row is not None
+        summary = row.summary if row else ""
+        checkpoint = row.last_message_id if row else 0
+        count = row.message_count if row else 0
+        folds = 0
+        while max_folds is None or folds < max_folds:
+            batch = self._next_batch(ticket_id, checkpoint)
+            if not batch:
+                break
+            summary = self._fold(subject, summary, batch, priority) or summary
+            checkpoint = batch[-1].id
+            count += len(batch)
+            folds += 1
+        if not folds:
+            return summary or None
+
+        if self._save(ticket_id, existed, summary, checkpoint, count):
+            logger.info(f"Folded {folds} batch(es) into conversation summary for ticket {ticket_id} (through message {checkpoint})")
+            return summary
+        # Another refresher got further meanwhile; keep its result
+        row = db.session.get(TicketConversationSummary, ticket_id, populate_existing=True)
+        return row.summary if row else summary
+
+    def _save(self, ticket_id: str, existed: bool, summary: str, checkpoint: int, count: int) -> bool:
+        """
+        Store the folded summary unless a concurrent refresh already moved the
+        checkpoint to or past ours. Returns False when ours was discarded.
+        """
+        values = {"summary": summary, "last_message_id": checkpoint, "message_count": count,
+                  "model": CHAT_MODEL, "updated_at": datetime.now(timezone.utc)}
+        table = TicketConversationSummary.__table__
+        conditional_update = (table.update()
+                              .where(table.c.ticket_id == ticket_id, table.c.last_message_id < checkpoint)
+                              .values(**values))
+        try:
+            if existed:
+                saved = db.session.execute(conditional_update).rowcount > 0
+            else:
+                try:
+                    db.session.execute(table.insert().values(ticket_id=ticket_id, **values))
+                    db.session.flush()
+                    saved = True
+                except IntegrityError:
+                    # A concurrent first refresh inserted the row; apply ours only if it is further along
+                    db.session.rollback()
+                    saved = db.session.execute(conditional_update).rowcount > 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return saved
+
+    def current(self, ticket_id: str, subject: str = "", priority: str = None, max_folds: int = 1) -> Tuple[str, int]:
+        """
+        Summary for a caller that is waiting on it: folds at most `max_folds`
+        batches in-line so the cost stays bounded, hands any remaining backlog
+        to the background worker, and returns (summary, messages not yet covered).
+        """
+        summary = self.refresh(ticket_id, subject, priority=priority, max_folds=max_folds) or ""
+        pending = self.pending_count(ticket_id)
+        if pending:
+            self.schedule_refresh(ticket_id, subject, min_new_messages=1)
+        return summary, pending
+
+    # ─── Background refresh ───────────────────────────────────────────────────
+    def schedule_refresh(self, ticket_id: str, subject: str = "", min_new_messages: int = None) -> bool:
+        """Queue a background fold once enough new messages have accumulated"""
+        from flask import current_app
+        row = self.get(ticket_id)
+        threshold = self.min_new_messages if min_new_messages is None else min_new_messages
+        if self.pending_count(ticket_id, row) < threshold:
+            return False
+        with self._lock:
+            if ticket_id in self._inflight:
+                return False
+            self._inflight.add(ticket_id)
+
+        app = current_app._get_current_object()
+        self._executor.submit(self._refresh_in_background, app, ticket_id, subject)
+        return True
+
+    def _refresh_in_background(self, app, ticket_id: str, subject: str):
+        try:
+            with app.app_context():
+                self.refresh(ticket_id, subject, priority=BACKGROUND)
+        except Exception as e:
+            logger.error(f"Failed to refresh conversation summary for ticket {ticket_id}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(ticket_id)
+
+    # ─── Consumers ────────────────────────────────────────────────────────────
+    @staticmethod
+    def with_backlog_note(summary: str, pending: int) -> str:
+        """Append how much of the thread the summary does not cover yet"""
+        if not pending:
+            return summary
+        note = f"({pending} newer message{'s' if pending != 1 else ''} not yet summarised)"
+        return f"{summary}\n{note}" if summary else note
+
+    def summary_and_pending(self, ticket_id: str) -> Tuple[str, int]:
+        """Stored summary (may lag) and how many messages it does not cover yet"""
+        row = self.get(ticket_id)
+        return (row.summary if row else ""), self.pending_count(ticket_id, row)
+
+
+# Service instance
+conversation_summaries = ConversationSummaryService()
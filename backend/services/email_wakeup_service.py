@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Email Wakeup Service
+Wakes the email worker as soon as something is queued instead of leaving it
+to its next poll. Inside a process this is a condition variable; across
+processes every waiting worker listens on its own Unix datagram socket in a
+shared directory and enqueuers send one byte to each. Polling stays as the
+fallback when no signal arrives (other hosts, platforms without AF_UNIX).
+"""
+import glob
+import logging
+import os
+import socket
+import threading
+from config import EMAIL_WAKEUP_DIR
+
+logger = logging.getLogger(__name__)
+
+
+class EmailWakeup:
+    def __init__(self, directory: str = EMAIL_WAKEUP_DIR):
+        self.directory = directory
+        self._cond = threading.Condition()
+        self._pending = False
+        self._listener = None
+        self._path = None
+
+    # ─── Signalling ───────────────────────────────────────────────────────────
+    def _wake_local(self):
+        with self._cond:
+            self._pending = True
+            self._cond.notify_all()
+
+    def notify(self):
+        """Wake email workers in this process and in every other process on the host"""
+        self._wake_local()
+        if not self.directory or not hasattr(socket, "AF_UNIX"):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for path in glob.glob(os.path.join(self.directory, "email-worker-*.sock")):
+                if path == self._path:
+                    continue
+                try:
+                    sock.sendto(b"1", path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Listener exited without cleaning up
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except BlockingIOError:
+                    pass  # its buffer is full, so a wakeup is already pending there
+                except OSError as e:
+                    logger.debug(f"Email wakeup to {path} failed: {e}")
+
+    # ─── Waiting ──────────────────────────────────────────────────────────────
+    def listen(self):
+        """Start receiving cross-process wakeups for this process (idempotent)"""
+        if self._listener is not None or not self.directory or not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"email-worker-{os.getpid()}.sock")
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self._path)
+        except OSError as e:
+            logger.warning(f"Email wakeup socket unavailable, falling back to polling: {e}")
+            self._path = None
+            return
+
+        def receive():
+            while True:
+                try:
+                    sock.recv(64)
+                except OSError:
+                    return
+                self._wake_local()
+
+        self._listener = threading.Thread(target=receive, name="email-wakeup", daemon=True)
+        self._listener.start()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until notified or `timeout` seconds pass; True if woken by a notification"""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            woken, self._pending = self._pending, False
+        return woken
+
+
+# Service instance
+email_wakeup = EmailWakeup()
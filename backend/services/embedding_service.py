@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Embedding Service
+Single entry point for OpenAI embeddings. Inputs are deduplicated, served from
+a content-hash cache when possible, packed into token-bounded batches and sent
+with retry/backoff, so callers pay one round trip per batch instead of per text.
+Only background work backs off at length; request-path callers fail fast so
+their fallbacks run.
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+import openai
+from config import EMBEDDING_CACHE_ENTRIES
+from openai_helpers import client, EMB_MODEL
+from services.openai_gateway_service import OpenAIGatewayBusy, OpenAIGatewayTimeout
+from services.openai_rate_limiter_service import BACKGROUND, OpenAIRateLimited, openai_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # optional; fall back to a length heuristic
+    tiktoken = None
+
+MAX_BATCH_INPUTS = 2048       # API limit on inputs per request
+MAX_BATCH_TOKENS = 100_000    # keep each request well under the per-request token ceiling
+MAX_INPUT_TOKENS = 8191       # per-input limit of the ada-002 / text-embedding-3 models
+MAX_ATTEMPTS = 5              # background priority
+FOREGROUND_MAX_ATTEMPTS = 2   # interactive/default priority: one short retry
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError,
+              OpenAIGatewayBusy, OpenAIGatewayTimeout, OpenAIRateLimited)
+# Local rejections that already waited in the limiter/gateway; only background work retries them
+_LOCAL_REJECTIONS = (OpenAIGatewayBusy, OpenAIGatewayTimeout, OpenAIRateLimited)
+
+
+class EmbeddingService:
+    def __init__(self, model: str = EMB_MODEL, cache_size: int = EMBEDDING_CACHE_ENTRIES):
+        self.model = model
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._encoders = {}
+        self.stats = {"requests": 0, "inputs": 0, "cache_hits": 0, "retries": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.stats[name] += n
+
+    # ─── Token accounting ─────────────────────────────────────────────────────
+    def _encoder(self, model: str):
+        if tiktoken is None:
+            return None
+        if model not in self._encoders:
+            try:
+                self._encoders[model] = tiktoken.encoding_for_model(model)
+            except Exception:
+                self._encoders[model] = tiktoken.get_encoding("cl100k_base")
+        return self._encoders[model]
+
+    def count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        enc = self._encoder(model or self.model)
+        if enc is not None:
+            return len(enc.encode(text))
+        return len(text) // 3 + 1  # conservative for English/code without a tokenizer
+
+    def _truncate(self, text: str, model: str) -> str:
+        enc = self._encoder(model)
+        if enc is not None:
+            tokens = enc.encode(text)
+            if len(tokens) <= MAX_INPUT_TOKENS:
+                return text
+            return enc.decode(tokens[:MAX_INPUT_TOKENS])
+        max_chars = (MAX_INPUT_TOKENS - 1) * 3
+        return text if len(text) <= max_chars else text[:max_chars]
+
+    # ─── Cache ────────────────────────────────────────────────────────────────
+    @staticmethod
+    def cache_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+            return vec
+
+    def _cache_put(self, key: str, vec: np.ndarray):
+        with self._lock:
+            self._cache[key] = vec
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ─── Embedding ────────────────────────────────────────────────────────────
+    def embed(self, texts: List[str], model: Optional[str] = None) -> List[np.ndarray]:
+        """Float32 vectors for `texts`, in order; identical texts are embedded once"""
+        model = model or self.model
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+        pending_text: Dict[str, str] = {}
+
+        for i, text in enumerate(texts):
+            text = self._truncate(text or " ", model)  # the API rejects empty strings
+            key = self.cache_key(text, model)
+            cached = self._cache_get(key)
+            if cached is not None:
+                results[i] = cached
+                self._count("cache_hits")
+                continue
+            pending.setdefault(key, []).append(i)
+            pending_text[key] = text
+
+        for batch in self._pack(list(pending), pending_text, model):
+            vectors = self._request([pending_text[k] for k in batch], model)
+            for key, vec in zip(batch, vectors):
+                self._cache_put(key, vec)
+                for i in pending[key]:
+                    results[i] = vec
+        return results
+
+    def embed_one(self, text: str, model: Optional[str] = None) -> np.ndarray:
+        return self.embed([text], model)[0]
+
+    def _pack(self, keys: List[str], texts: Dict[str, str], model: str) -> List[List[str]]:
+        """Greedy packing into batches bounded by input count and total tokens"""
+        batches, current, current_tokens = [], [], 0
+        for key in keys:
+            n = self.count_tokens(texts[key], model)
+            if current and (len(current) >= MAX_BATCH_INPUTS or current_tokens + n > MAX_BATCH_TOKENS):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(key)
+            current_tokens += n
+        if current:
+            batches.append(current)
+        return batches
+
+    def _request(self, inputs: List[str], model: str) -> List[np.ndarray]:
+        background = openai_rate_limiter.current_priority() == BACKGROUND
+        max_attempts = MAX_ATTEMPTS if background else FOREGROUND_MAX_ATTEMPTS
+        delay = 1.0
+        for attempt in range(1, max_attempts + 1):
+            try:
+                resp = client.embeddings.create(model=model, input=inputs)
+                self._count("requests")
+                self._count("inputs", len(inputs))
+                data = sorted(resp.data, key=lambda d: d.index)
+                return [np.asarray(d.embedding, dtype=np.float32) for d in data]
+            except _RETRYABLE as e:
+                if attempt == max_attempts or (not background and isinstance(e, _LOCAL_REJECTIONS)):
+                    raise
+                self._count("retries")
+                wait = delay + random.uniform(0, delay / 2)
+                logger.warning(f"Embedding batch of {len(inputs)} failed ({e.__class__.__name__}); "
+                               f"retry {attempt}/{max_attempts - 1} in {wait:.1f}s")
+                time.sleep(wait)
+                delay = min(delay * 2, 30.0)
+
+
+# Service instance
+embeddings = EmbeddingService()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+KB BM25 Service
+In-process BM25 inverted index over published KB articles (title, problem
+summary, content). Exact tokens such as error codes and product names keep
+their identity here, which embeddings blur. Updated incrementally by the KB
+routes and snapshotted to disk so a restart does not re-tokenize the corpus.
+"""
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from config import KB_BM25_SNAPSHOT_PATH
+from models import KBArticle, KBArticleStatus, db
+
+logger = logging.getLogger(__name__)
+
+# Keeps dotted/dashed identifiers like "0x80070005", "err-404" or "office365.exe" as one token
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+TITLE_WEIGHT = 2           # title terms count this many times
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DELAY_SECONDS = 30  # debounce disk writes after incremental updates
+RESYNC_SECONDS = 60          # how often a worker checks the table for changes made by other workers
+RESYNC_OVERLAP_SECONDS = 60  # re-read articles touched this long before the last change seen (clock skew, coarse timestamps)
+_IN_CHUNK = 500
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class BM25Index:
+    """Term -> {doc_id: tf} postings with per-document lengths; Okapi BM25 scoring"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_terms: Dict[int, Dict[str, int]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.doc_dept: Dict[int, Optional[int]] = {}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, doc_id: int, tokens: List[str], department_id: Optional[int] = None):
+        """Insert or replace a document"""
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        tf = Counter(tokens)
+        for term, n in tf.items():
+            self.postings.setdefault(term, {})[doc_id] = n
+        self.doc_terms[doc_id] = dict(tf)
+        self.doc_len[doc_id] = len(tokens)
+        self.doc_dept[doc_id] = department_id
+        self.total_len += len(tokens)
+
+    def remove(self, doc_id: int) -> bool:
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+        for term in terms:
+            plist = self.postings.get(term)
+            if plist is not None:
+                plist.pop(doc_id, None)
+                if not plist:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+        self.doc_dept.pop(doc_id, None)
+        return True
+
+    def search(self, query: str, k: int = 5, department_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top-k (doc_id, score); rarest query terms are scored first"""
+        n_docs = len(self.doc_len)
+        if n_docs == 0:
+            return []
+        avgdl = self.total_len / n_docs
+        k1, b = self.k1, self.b
+        doc_len = self.doc_len
+
+        terms = [t for t in set(tokenize(query)) if t in self.postings]
+        terms.sort(key=lambda t: len(self.postings[t]))
+        scores: Dict[int, float] = {}
+        for term in terms:
+            plist = self.postings[term]
+            df = len(plist)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in plist.items():
+                norm = k1 * (1 - b + b * doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        if department_id:
+            dept = self.doc_dept
+            scores = {d: s for d, s in scores.items() if dept.get(d) == department_id}
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class KBBM25Service:
+    def __init__(self, snapshot_path: str = KB_BM25_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
+        self.index = BM25Index()
+        self._signature = None
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._save_timer = None
+        self._last_sync_check = 0.0
+        self._resyncing = False
+
+    @staticmethod
+    def article_tokens(article: KBArticle) -> List[str]:
+        return (tokenize(article.title) * TITLE_WEIGHT
+                + tokenize(article.problem_summary)
+                + tokenize(article.content_md))
+
+    @staticmethod
+    def _is_indexed_status(article: KBArticle) -> bool:
+        return article.status == KBArticleStatus.published
+
+    def _corpus_signature(self):
+        """Cheap fingerprint of the published corpus: (count, max id, newest update)"""
+        count, max_id, newest = (db.session.query(
+            db.func.count(KBArticle.id),
+            db.func.max(KBArticle.id),
+            db.func.max(db.func.coalesce(KBArticle.updated_at, KBArticle.created_at)),
+        ).filter(KBArticle.status == KBArticleStatus.published).one())
+        return (int(count or 0), int(max_id or 0), str(newest) if newest else None)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            signature = self._corpus_signature()
+            if not self._load_snapshot(signature):
+                self.rebuild(signature)
+            self._loaded = True
+            self._last_sync_check = time.monotonic()
+
+    def _maybe_resync(self):
+        """Apply changes another worker made to the corpus since this index was last in sync"""
+        with self._lock:
+            if self._resyncing or time.monotonic() - self._last_sync_check < RESYNC_SECONDS:
+                return
+            self._resyncing = True
+            self._last_sync_check = time.monotonic()
+        try:
+            signature = self._corpus_signature()
+            if signature != self._signature:
+                self._apply_changes(signature)
+        except Exception as e:
+            logger.warning(f"BM25 resync failed; serving the current index: {e}")
+        finally:
+            with self._lock:
+                self._resyncing = False
+
+    def _apply_changes(self, signature):
+        """
+        Re-tokenize only articles touched since the last change this index saw,
+        add published ones it is missing and drop ones no longer published.
+        Searches keep using the index until the changes are swapped in.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            previous = self._signature
+            indexed = set(self.index.doc_len)
+        published = {row.id for row in db.session.query(KBArticle.id)
+                     .filter(KBArticle.status == KBArticleStatus.published)}
+
+        changed = {}
+        since = datetime.fromisoformat(previous[2]) if previous and previous[2] else None
+        if since is not None:
+            touched = db.func.coalesce(KBArticle.updated_at, KBArticle.created_at)
+            for article in (KBArticle.query
+                            .filter(KBArticle.status == KBArticleStatus.published,
+                                    touched >= since - timedelta(seconds=RESYNC_OVERLAP_SECONDS))):
+                changed[article.id] = (self.article_tokens(article), article.category_id)
+        missing = [i for i in published - indexed if i not in changed]
+        for i in range(0, len(missing), _IN_CHUNK):
+            for article in KBArticle.query.filter(KBArticle.id.in_(missing[i:i + _IN_CHUNK])):
+                changed[article.id] = (self.article_tokens(article), article.category_id)
+        removed = indexed - published
+
+        with self._lock:
+            for doc_id in removed:
+                self.index.remove(doc_id)
+            for doc_id, (tokens, department_id) in changed.items():
+                self.index.add(doc_id, tokens, department_id)
+            self._signature = signature
+        logger.info(f"Synced BM25 index with changes from other workers ({len(changed)} updated, "
+                    f"{len(removed)} removed) in {time.perf_counter() - started:.2f}s")
+        self._schedule_snapshot()
+
+    def rebuild(self, signature=None):
+        """Tokenize every published article from scratch and snapshot the result"""
+        started = time.perf_counter()
+        index = BM25Index()
+        query = (KBArticle.query
+                 .filter(KBArticle.status == KBArticleStatus.published)
+                 .order_by(KBArticle.id)
+                 .yield_per(1000))
+        for article in query:
+            index.add(article.id, self.article_tokens(article), article.category_id)
+        with self._lock:
+            self.index = index
+            self._signature = signature or self._corpus_signature()
+        logger.info(f"Built BM25 index over {len(index)} KB articles in {time.perf_counter() - started:.2f}s")
+        self.save_snapshot()
+
+    def _load_snapshot(self, signature) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                payload = pickle.load(f)
+            if payload.get("version") != SNAPSHOT_VERSION or payload.get("signature") != signature:
+                logger.info("BM25 snapshot is out of date; rebuilding")
+                return False
+            self.index = payload["index"]
+            self._signature = signature
+            logger.info(f"Loaded BM25 snapshot with {len(self.index)} KB articles from {self.snapshot_path}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not read BM25 snapshot {self.snapshot_path}: {e}")
+            return False
+
+    def save_snapshot(self):
+        """Write the index atomically so a crash mid-write never leaves a torn file"""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            self._save_timer = None
+            payload = {"version": SNAPSHOT_VERSION, "signature": self._signature, "index": self.index}
+            # Per-process tmp name: gunicorn workers may save concurrently and must not share one file
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.snapshot_path)
+            except Exception as e:
+                logger.warning(f"Could not write BM25 snapshot {self.snapshot_path}: {e}")
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def _schedule_snapshot(self):
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(SNAPSHOT_DELAY_SECONDS, self.save_snapshot)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def update_articles(self, articles: List[KBArticle]):
+        """Apply changes for the given articles: published ones are (re)indexed, others removed"""
+        self._ensure_loaded()
+        with self._lock:
+            for article in articles:
+                if article is None or article.id is None:
+                    continue
+                if self._is_indexed_status(article):
+                    self.index.add(article.id, self.article_tokens(article), article.category_id)
+                else:
+                    self.index.remove(article.id)
+            self._signature = self._corpus_signature()
+        self._schedule_snapshot()
+
+    def search(self, query: str, department_id: Optional[int] = None, limit: int = 5) -> List[Tuple[int, float]]:
+        """Top-k (article_id, bm25 score) over published articles"""
+        self._ensure_loaded()
+        self._maybe_resync()
+        with self._lock:
+            return self.index.search(query, k=limit, department_id=department_id)
+
+
+# Service instance
+kb_bm25 = KBBM25Service()
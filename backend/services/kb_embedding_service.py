@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+KB Embedding Service
+Stores one embedding per KB article version in kb_article_embeddings (model
+and dimension recorded) and mirrors them in an in-process vector index.
+Vectors are written when articles are loaded, promoted or published; query
+paths only ever embed the query text. Legacy articles a search finds without a
+vector are embedded by a background worker in its own session.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from models import KBArticle, KBArticleEmbedding, db
+from openai_helpers import EMB_MODEL
+from services.embedding_service import embeddings
+from services.openai_rate_limiter_service import BACKGROUND, INTERACTIVE, openai_rate_limiter
+from services.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+_IN_CHUNK = 500
+_MATRIX_CACHE_ENTRIES = 8  # stacked candidate matrices kept (one per department filter in practice)
+
+
+class KBEmbeddingService:
+    def __init__(self, model: str = EMB_MODEL, max_workers: int = 1):
+        self.model = model
+        self.index = VectorIndex()
+        self._hashes: Dict[int, str] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._version = 0  # bumped whenever the index changes; invalidates cached matrices
+        self._matrices: "OrderedDict[frozenset, Tuple[int, List[int], np.ndarray]]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kb-embedding")
+        self._inflight = set()
+
+    @staticmethod
+    def article_text(article: KBArticle) -> str:
+        """Text that represents an article in embedding space"""
+        return (f"Title: {article.title or ''}\n"
+                f"Summary: {article.problem_summary or ''}\n"
+                f"Content: {article.content_md or ''}")
+
+    def content_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{text}".encode("utf-8")).hexdigest()
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.index.dim
+
+    def _ensure_loaded(self):
+        """Load every stored vector for the current model, once per process"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = (db.session.query(KBArticleEmbedding.article_id, KBArticleEmbedding.content_hash,
+                                     KBArticleEmbedding.dim, KBArticleEmbedding.vector)
+                    .filter(KBArticleEmbedding.model == self.model)
+                    .all())
+            for article_id, digest, dim, blob in rows:
+                vec = np.frombuffer(blob, dtype=np.float32)
+                if vec.shape[0] != dim:
+                    logger.warning(f"Skipping corrupt embedding for KB article {article_id}")
+                    continue
+                self.index.add(article_id, vec)
+                self._hashes[article_id] = digest
+            self._loaded = True
+            self._version += 1
+            logger.info(f"Loaded {len(self.index)} KB article embeddings ({self.model})")
+
+    def reload(self):
+        """Drop the in-memory copy; the next access reloads from the table"""
+        with self._lock:
+            self.index = VectorIndex()
+            self._hashes = {}
+            self._loaded = False
+            self._version += 1
+            self._matrices.clear()
+
+    def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        return embeddings.embed(texts, self.model)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a search query with the same model the corpus was embedded with (a user is waiting)"""
+        with openai_rate_limiter.priority(INTERACTIVE):
+            return self._embed([text])[0]
+
+    def embed_articles(self, articles: Iterable[KBArticle]) -> int:
+        """
+        Embed and persist articles whose content changed since they were last
+        embedded. Commits the rows; returns how many articles were (re)embedded.
+        """
+        self._ensure_loaded()
+        todo = []
+        for article in articles:
+            if article is None or article.id is None:
+                continue
+            text = self.article_text(article)
+            digest = self.content_hash(text)
+            if self._hashes.get(article.id) != digest:
+                todo.append((article.id, text, digest))
+        if not todo:
+            return 0
+
+        vectors = self._embed([text for _, text, _ in todo])
+        for (article_id, _, digest), vec in zip(todo, vectors):
+            db.session.merge(KBArticleEmbedding(
+                article_id=article_id,
+                model=self.model,
+                dim=int(vec.shape[0]),
+                content_hash=digest,
+                vector=vec.astype("<f4").tobytes(),
+            ))
+        db.session.commit()
+
+        with self._lock:
+            for (article_id, _, digest), vec in zip(todo, vectors):
+                self.index.add(article_id, vec)
+                self._hashes[article_id] = digest
+            self._version += 1
+        logger.info(f"Embedded {len(todo)} KB articles")
+        return len(todo)
+
+    def backfill(self) -> int:
+        """Embed every article that has no current vector"""
+        self._ensure_loaded()
+        stale = [a for a in KBArticle.query.all()
+                 if self._hashes.get(a.id) != self.content_hash(self.article_text(a))]
+        return self.embed_articles(stale)
+
+    def schedule_embed(self, article_ids: List[int]) -> bool:
+        """Embed the given articles in the background (own app context and session); skips ones already queued"""
+        from flask import current_app
+        with self._lock:
+            todo = [i for i in article_ids if i not in self._inflight]
+            self._inflight.update(todo)
+        if not todo:
+            return False
+
+        app = current_app._get_current_object()
+        self._executor.submit(self._embed_in_background, app, todo)
+        return True
+
+    def _embed_in_background(self, app, article_ids: List[int]):
+        try:
+            with app.app_context(), openai_rate_limiter.priority(BACKGROUND):
+                self.embed_articles(KBArticle.query.filter(KBArticle.id.in_(article_ids)).all())
+        except Exception as e:
+            logger.error(f"Background embedding of {len(article_ids)} KB articles failed: {e}")
+        finally:
+            with self._lock:
+                self._inflight.difference_update(article_ids)
+
+    def vectors_for(self, article_ids: List[int]) -> Dict[int, np.ndarray]:
+        """Stored (normalized) vectors for the given articles; missing ones are looked up in the table"""
+        self._ensure_loaded()
+        found = {}
+        missing = []
+        for article_id in article_ids:
+            vec = self.index.get(article_id)
+            if vec is None:
+                missing.append(article_id)
+            else:
+                found[article_id] = vec
+        for i in range(0, len(missing), _IN_CHUNK):
+            rows = (KBArticleEmbedding.query
+                    .filter(KBArticleEmbedding.article_id.in_(missing[i:i + _IN_CHUNK]),
+                            KBArticleEmbedding.model == self.model)
+                    .all())
+            with self._lock:
+                for row in rows:
+                    self.index.add(row.article_id, np.frombuffer(row.vector, dtype=np.float32))
+                    self._hashes[row.article_id] = row.content_hash
+                    found[row.article_id] = self.index.get(row.article_id)
+                if rows:
+                    self._version += 1
+        return found
+
+    def remove(self, article_id: int):
+        with self._lock:
+            self.index.remove(article_id)
+            self._hashes.pop(article_id, None)
+            self._version += 1
+
+    def search(self, query_vector: np.ndarray, k: int = 5,
+               candidate_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Cosine top-k as (article_id, similarity). When candidate_ids is given,
+        only those articles are scored (e.g. published ones in a department).
+        """
+        self._ensure_loaded()
+        if candidate_ids is None:
+            return self.index.search(query_vector, k=k)
+
+        ids, matrix = self._candidate_matrix(list(candidate_ids))
+        if not ids:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        sims = matrix @ query
+        order = np.argsort(-sims)[:k]
+        return [(ids[i], float(sims[i])) for i in order]
+
+    def _candidate_matrix(self, candidate_ids: List[int]) -> Tuple[List[int], Optional[np.ndarray]]:
+        """Stacked vectors for a candidate set, reused until the index changes"""
+        key = frozenset(candidate_ids)
+        with self._lock:
+            cached = self._matrices.get(key)
+            if cached is not None and cached[0] == self._version:
+                self._matrices.move_to_end(key)
+                return cached[1], cached[2]
+
+        vectors = self.vectors_for(candidate_ids)
+        with self._lock:
+            version = self._version
+        if not vectors:
+            return [], None
+        ids = list(vectors)
+        matrix = np.vstack([vectors[i] for i in ids])
+        with self._lock:
+            if version == self._version:
+                self._matrices[key] = (version, ids, matrix)
+                self._matrices.move_to_end(key)
+                while len(self._matrices) > _MATRIX_CACHE_ENTRIES:
+                    self._matrices.popitem(last=False)
+        return ids, matrix
+
+
+# Service instance
+kb_embeddings = KBEmbeddingService()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+LLM Cache Service
+Response cache for chat completions whose output depends only on the prompt
+(classification, department prediction, summaries). Keyed by model, normalized
+messages and sampling parameters; an in-process LRU sits in front of the
+llm_cache table so every worker shares results. Call sites opt in explicitly.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from flask import has_app_context
+from sqlalchemy import event, select
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_TTL_SECONDS
+from models import LLMCacheEntry, db
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+PURGE_INTERVAL_SECONDS = 3600  # how often a worker deletes expired rows
+_PENDING_KEY = "llm_cache_pending"      # session.info: entries waiting for the caller's transaction to end
+_LISTENING_KEY = "llm_cache_listening"
+
+
+class LLMCacheService:
+    def __init__(self, enabled: bool = LLM_CACHE_ENABLED, ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MEMORY_ENTRIES):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (expires monotonic, response)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._last_purge = 0.0
+
+    # ─── Keys ─────────────────────────────────────────────────────────────────
+    @staticmethod
+    def cache_key(model: str, messages: List[Dict], params: Dict) -> str:
+        """sha256 over model, messages with whitespace collapsed, and sorted parameters"""
+        normalized = [
+            {"role": m.get("role"), "content": _WS_RE.sub(" ", str(m.get("content") or "")).strip()}
+            for m in messages
+        ]
+        payload = json.dumps({"model": model, "messages": normalized, "params": params},
+                             sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ─── Counters ─────────────────────────────────────────────────────────────
+    def _count(self, call_site: str, outcome: str):
+        with self._lock:
+            site = self._counters.setdefault(call_site, {"memory_hits": 0, "db_hits": 0, "misses": 0})
+            site[outcome] += 1
+
+    def stats(self) -> Dict:
+        """Per-call-site hit/miss counters for this worker, with hit rates"""
+        with self._lock:
+            sites = {name: dict(c) for name, c in self._counters.items()}
+            memory_entries = len(self._memory)
+        for c in sites.values():
+            total = c["memory_hits"] + c["db_hits"] + c["misses"]
+            c["hit_rate"] = round((c["memory_hits"] + c["db_hits"]) / total, 4) if total else 0.0
+        return {"enabled": self.enabled, "memory_entries": memory_entries, "call_sites": sites}
+
+    # ─── Memory tier ──────────────────────────────────────────────────────────
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires, response = entry
+            if expires < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return response
+
+    def _memory_put(self, key: str, response: str, ttl: int):
+        with self._lock:
+            self._memory[key] = (time.monotonic() + ttl, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # ─── DB tier ──────────────────────────────────────────────────────────────
+    # Core statements on their own connection so a cache read/write never
+    # flushes or commits the caller's session. Writes wait until the caller's
+    # transaction has ended: on SQLite a second connection cannot take the
+    # write lock while the session holds flushed changes.
+    def _db_get(self, key: str) -> Optional[Tuple[str, int]]:
+        if not has_app_context():
+            return None
+        table = LLMCacheEntry.__table__
+        try:
+            with db.engine.connect() as conn:
+                row = conn.execute(
+                    select(table.c.response, table.c.expires_at).where(table.c.key == key)
+                ).first()
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+        if row is None:
+            return None
+        remaining = (row.expires_at.replace(tzinfo=None) - datetime.utcnow()).total_seconds()
+        if remaining <= 0:
+            return None
+        return row.response, int(remaining)
+
+    def _db_put(self, key: str, call_site: str, model: str, response: str, ttl: int):
+        if not has_app_context():
+            return
+        entry = (key, call_site, model, response, ttl)
+        session = db.session()
+        if not session.in_transaction():
+            self._db_write([entry])
+            return
+        if not session.info.get(_LISTENING_KEY):
+            event.listen(session, "after_transaction_end", self._after_transaction_end)
+            session.info[_LISTENING_KEY] = True
+        session.info.setdefault(_PENDING_KEY, []).append(entry)
+
+    def _after_transaction_end(self, session, transaction):
+        """Persist entries queued during the caller's transaction once it commits, rolls back or closes"""
+        if transaction.parent is not None:
+            return  # savepoint or subtransaction; the outer transaction still holds the connection
+        pending = session.info.pop(_PENDING_KEY, None)
+        if pending:
+            self._db_write(pending)
+
+    def _db_write(self, entries: List[Tuple[str, str, str, str, int]]):
+        table = LLMCacheEntry.__table__
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as conn:
+                for key, call_site, model, response, ttl in entries:
+                    conn.execute(table.delete().where(table.c.key == key))
+                    conn.execute(table.insert().values(
+                        key=key, call_site=call_site, model=model, response=response,
+                        created_at=now, expires_at=now + timedelta(seconds=ttl),
+                    ))
+                if time.monotonic() - self._last_purge > PURGE_INTERVAL_SECONDS:
+                    self._last_purge = time.monotonic()
+                    purged = conn.execute(table.delete().where(table.c.expires_at < now)).rowcount
+                    if purged:
+                        logger.info(f"Purged {purged} expired LLM cache rows")
+        except Exception as e:
+            # Another worker may have inserted the same key first; the cache is best effort
+            logger.warning(f"LLM cache write failed: {e}")
+
+    # ─── Completions ──────────────────────────────────────────────────────────
+    def chat(self, call_site: str, client, model: str, messages: List[Dict],
+             ttl: Optional[int] = None, **params) -> str:
+        """
+        Content of the first choice for a chat completion, served from cache
+        when the same (model, messages, params) was answered before. Extra
+        keyword arguments are passed to the API and, except `priority`, are
+        part of the key.
+        """
+        if not self.enabled:
+            return self._complete(client, model, messages, params)
+
+        ttl = ttl or self.ttl_seconds
+        key = self.cache_key(model, messages, {k: v for k, v in params.items() if k != "priority"})
+
+        response = self._memory_get(key)
+        if response is not None:
+            self._count(call_site, "memory_hits")
+            return response
+
+        stored = self._db_get(key)
+        if stored is not None:
+            response, remaining = stored
+            self._memory_put(key, response, remaining)
+            self._count(call_site, "db_hits")
+            return response
+
+        self._count(call_site, "misses")
+        response = self._complete(client, model, messages, params)
+        self._memory_put(key, response, ttl)
+        self._db_put(key, call_site, model, response, ttl)
+        return response
+
+    @staticmethod
+    def _complete(client, model: str, messages: List[Dict], params: Dict) -> str:
+        resp = client.chat.completions.create(model=model, messages=messages, **params)
+        return resp.choices[0].message.content or ""
+
+    def clear(self):
+        """Drop the memory tier (the table keeps serving until rows expire)"""
+        with self._lock:
+            self._memory.clear()
+
+
+# Service instance
+llm_cache = LLMCacheService()
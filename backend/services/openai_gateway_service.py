@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+OpenAI Gateway Service
+Owns the process's OpenAI client. Calls first take capacity from the shared
+RPM/TPM buckets, then run on a fixed-size thread pool with a bounded wait queue
+and a per-call timeout, so a degraded upstream costs web requests a bounded
+wait instead of pinning every worker. Exposes the same
+`chat.completions.create` / `embeddings.create` surface as the SDK client.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from types import SimpleNamespace
+from typing import Dict
+import openai
+from openai import OpenAI
+from config import (OPENAI_KEY, OPENAI_MAX_CONCURRENCY, OPENAI_MAX_QUEUE, OPENAI_MAX_RETRIES,
+                    OPENAI_QUEUE_TIMEOUT_SECONDS, OPENAI_TIMEOUT_SECONDS)
+from services.openai_rate_limiter_service import estimate_tokens, openai_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # end-of-stream marker
+
+
+class OpenAIGatewayBusy(RuntimeError):
+    """The call could not start: the queue was full or it waited past the queue timeout"""
+
+
+class OpenAIGatewayTimeout(TimeoutError):
+    """The call started but produced no result within its timeout"""
+
+
+class _Endpoint:
+    def __init__(self, gateway: "OpenAIGateway", name: str, resolve):
+        self._gateway = gateway
+        self._name = name
+        self._resolve = resolve
+
+    def create(self, **kwargs):
+        return self._gateway.call(self._name, self._resolve, kwargs)
+
+
+class OpenAIGateway:
+    def __init__(self, api_key: str = OPENAI_KEY, timeout: float = OPENAI_TIMEOUT_SECONDS,
+                 max_retries: int = OPENAI_MAX_RETRIES, max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+                 max_queue: int = OPENAI_MAX_QUEUE, queue_timeout: float = OPENAI_QUEUE_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._client = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="openai")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._waits = deque(maxlen=1000)  # recent queue waits in seconds
+        self._counters = {"submitted": 0, "completed": 0, "errors": 0, "timeouts": 0, "rejected": 0}
+
+        # SDK-shaped surface so existing `client.chat.completions.create(...)` call sites work unchanged
+        self.chat = SimpleNamespace(completions=_Endpoint(self, "chat.completions", lambda c: c.chat.completions))
+        self.embeddings = _Endpoint(self, "embeddings", lambda c: c.embeddings)
+
+    @property
+    def client(self) -> OpenAI:
+        """The underlying SDK client, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = OpenAI(api_key=self.api_key, timeout=self.timeout, max_retries=self.max_retries)
+        return self._client
+
+    # ─── Bookkeeping ──────────────────────────────────────────────────────────
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _start(self, name: str, enqueued: float):
+        """Leave the queue; refuse to start a call whose caller has already given up"""
+        waited = time.monotonic() - enqueued
+        with self._lock:
+            self._queued -= 1
+            self._waits.append(waited)
+            if waited > self.queue_timeout:
+                self._counters["rejected"] += 1
+                raise OpenAIGatewayBusy(f"OpenAI {name} call waited {waited:.1f}s for a slot")
+            self._in_flight += 1
+
+    def _finish(self, failed: Exception = None):
+        if isinstance(failed, openai.RateLimitError):
+            retry_after = failed.response.headers.get("retry-after") if failed.response is not None else None
+            try:
+                openai_rate_limiter.block(float(retry_after or 1.0))
+            except ValueError:
+                openai_rate_limiter.block(1.0)
+        with self._lock:
+            self._in_flight -= 1
+            if failed is None:
+                self._counters["completed"] += 1
+            elif isinstance(failed, openai.APITimeoutError):
+                self._counters["timeouts"] += 1
+            else:
+                self._counters["errors"] += 1
+
+    # ─── Calls ────────────────────────────────────────────────────────────────
+    def call(self, name: str, resolve, kwargs: Dict):
+        """
+        Run `resolve(client).create(**kwargs)` on the pool. A `timeout` kwarg
+        overrides the default for this call and `priority` its rate-limit class
+        (defaults to the caller's openai_rate_limiter.priority()). With
+        stream=True the result is an iterator of chunks, drained by the pool
+        thread that holds the slot.
+        """
+        timeout = kwargs.pop("timeout", None) or self.timeout
+        kind = "embeddings" if name == "embeddings" else "chat"
+        estimated = estimate_tokens(kind, kwargs)
+        # Waiting for rate capacity happens in the caller's thread, so it never holds a pool slot
+        openai_rate_limiter.acquire(kind, estimated, kwargs.pop("priority", None))
+        with self._lock:
+            full = self._queued >= self.max_queue
+            if full:
+                self._counters["rejected"] += 1
+            else:
+                self._queued += 1
+                self._counters["submitted"] += 1
+        if full:
+            # Nothing was sent: hand the request and tokens back to the shared buckets
+            openai_rate_limiter.settle(kind, estimated, 0, requests=1)
+            raise OpenAIGatewayBusy(f"OpenAI gateway queue is full ({self.max_queue} calls waiting)")
+        enqueued = time.monotonic()
+
+        if kwargs.get("stream"):
+            return self._stream(name, resolve, kwargs, timeout, enqueued, kind, estimated)
+
+        future = self._executor.submit(self._run, name, resolve, kwargs, timeout, enqueued, kind, estimated)
+        try:
+            return future.result(timeout=self.queue_timeout + timeout)
+        except FutureTimeout:
+            if future.cancel():
+                with self._lock:
+                    self._queued -= 1
+                    self._counters["rejected"] += 1
+                openai_rate_limiter.settle(kind, estimated, 0, requests=1)
+                raise OpenAIGatewayBusy(f"OpenAI {name} call did not get a slot within {self.queue_timeout:g}s")
+            self._count("timeouts")
+            raise OpenAIGatewayTimeout(f"OpenAI {name} call timed out after {timeout:g}s")
+
+    def _run(self, name: str, resolve, kwargs: Dict, timeout: float, enqueued: float, kind: str, estimated: int):
+        try:
+            self._start(name, enqueued)
+        except OpenAIGatewayBusy:
+            openai_rate_limiter.settle(kind, estimated, 0, requests=1)
+            raise
+        try:
+            result = resolve(self.client).create(timeout=timeout, **kwargs)
+        except Exception as e:
+            self._finish(e)
+            raise
+        self._finish()
+        usage = getattr(result, "usage", None)
+        if usage is not None:
+            openai_rate_limiter.settle(kind, estimated, getattr(usage, "total_tokens", None))
+        return result
+
+    def _stream(self, name: str, resolve, kwargs: Dict, timeout: float, enqueued: float, kind: str, estimated: int):
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+
+        def pump():
+            try:
+                self._start(name, enqueued)
+            except OpenAIGatewayBusy as e:
+                openai_rate_limiter.settle(kind, estimated, 0, requests=1)
+                chunks.put(e)
+                return
+            try:
+                stream = resolve(self.client).create(timeout=timeout, **kwargs)
+                for chunk in stream:
+                    if cancelled.is_set():
+                        stream.response.close()
+                        break
+                    chunks.put(chunk)
+                chunks.put(_DONE)
+            except Exception as e:
+                self._finish(e)
+                chunks.put(e)
+                return
+            self._finish()
+
+        self._executor.submit(pump)
+
+        def iterate():
+            wait = self.queue_timeout + timeout  # the first chunk may still be queued
+            try:
+                while True:
+                    try:
+                        item = chunks.get(timeout=wait)
+                    except queue.Empty:
+                        self._count("timeouts")
+                        raise OpenAIGatewayTimeout(f"OpenAI {name} stream stalled for {wait:g}s")
+                    wait = timeout
+                    if item is _DONE:
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                cancelled.set()
+
+        return iterate()
+
+    # ─── Metrics ──────────────────────────────────────────────────────────────
+    def stats(self) -> Dict:
+        """Queue depth, in-flight calls, outcome counters and recent queue-wait percentiles"""
+        with self._lock:
+            waits = sorted(self._waits)
+            out = dict(self._counters, queued=self._queued, in_flight=self._in_flight,
+                       max_concurrency=self.max_concurrency, max_queue=self.max_queue)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else 0.0
+
+        out["queue_wait_ms"] = {"p50": pct(0.50), "p95": pct(0.95), "max": pct(1.0)}
+        return out
+
+
+# Service instance
+openai_gateway = OpenAIGateway()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+OpenAI Rate Limiter Service
+Requests-per-minute and tokens-per-minute token buckets for OpenAI calls,
+shared by every thread and worker process on the host through a small JSON
+state file guarded by a file lock. Callers carry a priority class: while an
+interactive call is waiting, background calls stop drawing from the buckets.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from filelock import FileLock
+from config import (OPENAI_CHAT_RPM_LIMIT, OPENAI_CHAT_TPM_LIMIT, OPENAI_EMBEDDING_RPM_LIMIT,
+                    OPENAI_EMBEDDING_TPM_LIMIT, OPENAI_RATE_STATE_PATH)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, DEFAULT, BACKGROUND = "interactive", "default", "background"
+PRIORITIES = (INTERACTIVE, DEFAULT, BACKGROUND)
+
+# Share of each bucket a class must leave untouched for higher classes
+RESERVE = {INTERACTIVE: 0.0, DEFAULT: 0.1, BACKGROUND: 0.25}
+# Longest a caller of each class waits for capacity before giving up
+MAX_WAIT_SECONDS = {INTERACTIVE: 15.0, DEFAULT: 30.0, BACKGROUND: 300.0}
+INTERACTIVE_HOLD_SECONDS = 1.0   # how long a waiting interactive call holds off lower classes
+POLL_SECONDS = 0.25
+DEFAULT_COMPLETION_TOKENS = 256  # reserved when a chat call does not set max_tokens
+
+_priority = contextvars.ContextVar("openai_priority", default=DEFAULT)
+
+
+class OpenAIRateLimited(RuntimeError):
+    """No capacity became available within the caller's priority wait budget"""
+
+
+def estimate_tokens(kind: str, kwargs: Dict) -> int:
+    """Upper-bound token charge for a request, before usage is known (~4 chars per token)"""
+    if kind == "embeddings":
+        inputs = kwargs.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return sum(len(str(t)) // 4 + 1 for t in inputs)
+    prompt = sum(len(str(m.get("content") or "")) // 4 + 4 for m in kwargs.get("messages") or [])
+    return prompt + int(kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+class OpenAIRateLimiter:
+    def __init__(self, state_path: str = OPENAI_RATE_STATE_PATH, limits: Optional[Dict] = None):
+        self.state_path = state_path
+        self.limits = limits or {
+            "chat": (OPENAI_CHAT_RPM_LIMIT, OPENAI_CHAT_TPM_LIMIT),
+            "embeddings": (OPENAI_EMBEDDING_RPM_LIMIT, OPENAI_EMBEDDING_TPM_LIMIT),
+        }
+        self._file_lock = FileLock(f"{state_path}.lock") if state_path else None
+        self._lock = threading.Lock()
+        self._memory_state: Dict = {}  # used when no state file is configured
+        self._counters = {p: {"granted": 0, "waited": 0, "wait_seconds": 0.0, "rejected": 0} for p in PRIORITIES}
+
+    # ─── Priority ─────────────────────────────────────────────────────────────
+    @staticmethod
+    def current_priority() -> str:
+        return _priority.get()
+
+    @staticmethod
+    @contextmanager
+    def priority(level: str):
+        """Run the enclosed OpenAI calls at `level` (interactive, default or background)"""
+        token = _priority.set(level if level in PRIORITIES else DEFAULT)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    # ─── Shared state ─────────────────────────────────────────────────────────
+    @contextmanager
+    def _state(self):
+        """Read-modify-write the bucket state under the thread lock and the cross-process file lock"""
+        with self._lock:
+            if self._file_lock is None:
+                yield self._memory_state
+                return
+            with self._file_lock:
+                try:
+                    with open(self.state_path, encoding="utf8") as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                yield state
+                tmp = f"{self.state_path}.tmp"
+                with open(tmp, "w", encoding="utf8") as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.state_path)
+
+    def _refill(self, state: Dict, kind: str, now: float) -> Dict:
+        rpm, tpm = self.limits[kind]
+        bucket = state.setdefault(kind, {"requests": float(rpm), "tokens": float(tpm), "ts": now})
+        elapsed = max(0.0, now - bucket["ts"])
+        bucket["requests"] = min(float(rpm), bucket["requests"] + elapsed * rpm / 60.0)
+        bucket["tokens"] = min(float(tpm), bucket["tokens"] + elapsed * tpm / 60.0)
+        bucket["ts"] = now
+        return bucket
+
+    def _try_take(self, kind: str, tokens: int, level: str) -> float:
+        """Consume capacity and return 0, or return the seconds to wait before retrying"""
+        rpm, tpm = self.limits[kind]
+        reserve = RESERVE[level]
+        # A request larger than this class may ever draw waits for a full share, not forever
+        tokens = min(tokens, (1 - reserve) * tpm)
+        now = time.time()
+        with self._state() as state:
+            bucket = self._refill(state, kind, now)
+            blocked_until = state.get("blocked_until", 0.0)
+            if now < blocked_until:
+                return blocked_until - now
+            if level != INTERACTIVE and now < state.get("interactive_waiting_until", 0.0):
+                return POLL_SECONDS
+
+            need_requests = 1 + reserve * rpm
+            need_tokens = tokens + reserve * tpm
+            if bucket["requests"] >= need_requests and bucket["tokens"] >= need_tokens:
+                bucket["requests"] -= 1
+                bucket["tokens"] -= tokens
+                return 0.0
+
+            if level == INTERACTIVE:
+                state["interactive_waiting_until"] = now + INTERACTIVE_HOLD_SECONDS
+            short_requests = max(0.0, need_requests - bucket["requests"])
+            short_tokens = max(0.0, need_tokens - bucket["tokens"])
+            return max(short_requests * 60.0 / rpm, short_tokens * 60.0 / tpm, 0.01)
+
+    # ─── Public API ───────────────────────────────────────────────────────────
+    def enabled(self, kind: str) -> bool:
+        rpm, tpm = self.limits.get(kind, (0, 0))
+        return rpm > 0 and tpm > 0
+
+    def acquire(self, kind: str, tokens: int, level: Optional[str] = None):
+        """Block until one request and `tokens` tokens are available for `kind`"""
+        if not self.enabled(kind):
+            return
+        level = level if level in PRIORITIES else self.current_priority()
+        started = time.monotonic()
+        deadline = started + MAX_WAIT_SECONDS[level]
+        waited = False
+        while True:
+            wait = self._try_take(kind, tokens, level)
+            if wait <= 0:
+                break
+            if time.monotonic() + min(wait, POLL_SECONDS) > deadline:
+                self._count(level, "rejected")
+                raise OpenAIRateLimited(f"No OpenAI {kind} capacity for a {level} call within {MAX_WAIT_SECONDS[level]:g}s")
+            waited = True
+            time.sleep(min(wait, POLL_SECONDS))
+        with self._lock:
+            c = self._counters[level]
+            c["granted"] += 1
+            if waited:
+                c["waited"] += 1
+                c["wait_seconds"] += time.monotonic() - started
+
+    def settle(self, kind: str, estimated: int, actual: int, requests: int = 0):
+        """
+        Return (or charge) the difference once the response reports real usage;
+        `requests` also hands back request slots for calls that were never sent
+        """
+        if not self.enabled(kind) or actual is None or (actual == estimated and not requests):
+            return
+        rpm, tpm = self.limits[kind]
+        with self._state() as state:
+            bucket = self._refill(state, kind, time.time())
+            bucket["tokens"] = min(float(tpm), bucket["tokens"] + (estimated - actual))
+            bucket["requests"] = min(float(rpm), bucket["requests"] + requests)
+
+    def block(self, seconds: float):
+        """Pause every caller on this host, e.g. after the API answered 429 with Retry-After"""
+        with self._state() as state:
+            state["blocked_until"] = max(state.get("blocked_until", 0.0), time.time() + seconds)
+
+    def _count(self, level: str, name: str):
+        with self._lock:
+            self._counters[level][name] += 1
+
+    def stats(self) -> Dict:
+        """Per-priority grant/wait/reject counters for this worker plus the shared bucket levels"""
+        with self._lock:
+            counters = {p: dict(c, wait_seconds=round(c["wait_seconds"], 2)) for p, c in self._counters.items()}
+        buckets = {}
+        with self._state() as state:
+            now = time.time()
+            for kind in self.limits:
+                if self.enabled(kind):
+                    bucket = self._refill(state, kind, now)
+                    buckets[kind] = {"requests": int(bucket["requests"]), "tokens": int(bucket["tokens"]),
+                                     "rpm_limit": self.limits[kind][0], "tpm_limit": self.limits[kind][1]}
+        return {"priorities": counters, "buckets": buckets}
+
+
+# Service instance
+openai_rate_limiter = OpenAIRateLimiter()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Prompt Context Service
+Token-budgeted prompt assembly. Context items (KB excerpts, past answers,
+conversation turns) are scored for relevance, packed best-first into a
+per-model token budget and emitted in their original order; the system prompt
+and the current user turn are always kept. Every assembled prompt is logged
+with its token counts and aggregated per call site.
+"""
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Tuple
+from config import CHAT_MODEL, PROMPT_TOKEN_BUDGET
+from services.embedding_service import embeddings
+from services.kb_bm25_service import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Context window per model; the prompt budget never exceeds window - completion tokens
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+}
+# Default prompt budget per model when PROMPT_TOKEN_BUDGET is not set
+MODEL_PROMPT_BUDGETS = {
+    "gpt-3.5-turbo": 3000,
+}
+FALLBACK_PROMPT_BUDGET = 3000
+MESSAGE_OVERHEAD_TOKENS = 4   # role/separator tokens the chat format adds per message
+RECENT_TURNS_PINNED = 2       # the latest turns always outrank older ones
+
+
+@dataclass
+class ContextSnippet:
+    text: str
+    score: float
+    order: int = 0          # position among the selected snippets when rendered
+    min_tokens: int = 0     # shortest useful truncation; 0 means keep whole or drop
+    payload: Any = None     # caller data carried through packing (e.g. the message dict)
+
+
+class PromptContextService:
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    # ─── Tokens ───────────────────────────────────────────────────────────────
+    def count_tokens(self, text: str, model: str = CHAT_MODEL) -> int:
+        return embeddings.count_tokens(text or "", model) if text else 0
+
+    def truncate(self, text: str, max_tokens: int, model: str = CHAT_MODEL) -> str:
+        """Cut `text` to at most `max_tokens`, on a word boundary where possible"""
+        n = self.count_tokens(text, model)
+        if n <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+        cut = text[:max(1, int(len(text) * max_tokens / n))]
+        while cut and self.count_tokens(cut + " …", model) > max_tokens:
+            cut = cut[:int(len(cut) * 0.9)]
+        space = cut.rfind(" ")
+        if space > len(cut) * 0.8:
+            cut = cut[:space]
+        return cut.rstrip() + " …" if cut else ""
+
+    def budget_for(self, model: str = CHAT_MODEL, completion_tokens: int = 0) -> int:
+        """Prompt token budget for `model`, leaving room for `completion_tokens`"""
+        budget = self.budget or MODEL_PROMPT_BUDGETS.get(model, FALLBACK_PROMPT_BUDGET)
+        window = MODEL_CONTEXT_WINDOWS.get(model)
+        if window:
+            budget = min(budget, window - completion_tokens)
+        return max(budget, 0)
+
+    # ─── Ranking and packing ──────────────────────────────────────────────────
+    @staticmethod
+    def relevance(query: str, text: str) -> float:
+        """Share of the query's distinct terms that appear in `text` (0..1)"""
+        terms = set(tokenize(query))
+        if not terms:
+            return 0.0
+        return len(terms & set(tokenize(text))) / len(terms)
+
+    def pack(self, snippets: List[ContextSnippet], budget: int, model: str = CHAT_MODEL,
+             overhead: int = 0) -> Tuple[List[ContextSnippet], Dict[str, int]]:
+        """
+        Highest-scoring snippets first until `budget` tokens are used; the first
+        snippet that no longer fits is truncated if it allows it. Returns the
+        chosen snippets in `order` plus packing stats.
+        """
+        chosen, used, dropped, truncated = [], 0, 0, 0
+        for snippet in sorted(snippets, key=lambda s: -s.score):
+            n = self.count_tokens(snippet.text, model) + overhead
+            if used + n <= budget:
+                chosen.append(snippet)
+                used += n
+                continue
+            room = budget - used - overhead
+            if snippet.min_tokens and room >= snippet.min_tokens:
+                text = self.truncate(snippet.text, room, model)
+                kept = self.count_tokens(text, model) + overhead
+                chosen.append(replace(snippet, text=text))
+                used += kept
+                dropped += n - kept
+                truncated += 1
+            else:
+                dropped += n
+        chosen.sort(key=lambda s: s.order)
+        return chosen, {"tokens": used, "dropped_tokens": dropped, "truncated": truncated,
+                        "selected": len(chosen), "candidates": len(snippets)}
+
+    def fit_messages(self, call_site: str, messages: List[Dict], query: str = "",
+                     model: str = CHAT_MODEL, completion_tokens: int = 0) -> List[Dict]:
+        """
+        Fit a chat prompt into the model's budget. The first (system) and last
+        (current user) messages are kept, the system one truncated if it alone
+        overflows; the turns between are ranked by relevance to `query` and
+        recency and packed into what is left, in their original order.
+        """
+        if len(messages) < 2:
+            return messages
+        budget = self.budget_for(model, completion_tokens)
+        system, history, current = messages[0], messages[1:-1], messages[-1]
+
+        current_tokens = self.count_tokens(current.get("content"), model) + MESSAGE_OVERHEAD_TOKENS
+        system_room = budget - current_tokens - MESSAGE_OVERHEAD_TOKENS
+        system_tokens = self.count_tokens(system.get("content"), model)
+        dropped = 0
+        if system_tokens > system_room:
+            system = dict(system, content=self.truncate(system.get("content") or "", system_room, model))
+            dropped += system_tokens - self.count_tokens(system["content"], model)
+            system_tokens = self.count_tokens(system["content"], model)
+        used = system_tokens + MESSAGE_OVERHEAD_TOKENS + current_tokens
+
+        snippets = []
+        for i, m in enumerate(history):
+            recency = (i + 1) / len(history)
+            pinned = 1.0 if i >= len(history) - RECENT_TURNS_PINNED else 0.0
+            score = pinned + 0.5 * recency + 0.5 * self.relevance(query, m.get("content") or "")
+            snippets.append(ContextSnippet(text=m.get("content") or "", score=score, order=i, payload=m))
+        chosen, stats = self.pack(snippets, budget - used, model, overhead=MESSAGE_OVERHEAD_TOKENS)
+
+        self.record(call_site, prompt_tokens=used + stats["tokens"], budget=budget,
+                    dropped_tokens=dropped + stats["dropped_tokens"],
+                    context_items=stats["selected"], context_candidates=stats["candidates"])
+        return [system] + [s.payload for s in chosen] + [current]
+
+    # ─── Stats ────────────────────────────────────────────────────────────────
+    def record(self, call_site: str, prompt_tokens: int, budget: int, dropped_tokens: int = 0,
+               context_items: int = 0, context_candidates: int = 0):
+        logger.info(f"[PROMPT] {call_site}: {prompt_tokens}/{budget} prompt tokens, "
+                    f"{context_items}/{context_candidates} history turns, {dropped_tokens} tokens dropped")
+        with self._lock:
+            site = self._stats.setdefault(call_site, {"prompts": 0, "prompt_tokens": 0, "max_prompt_tokens": 0,
+                                                      "dropped_tokens": 0, "over_budget_trims": 0})
+            site["prompts"] += 1
+            site["prompt_tokens"] += prompt_tokens
+            site["max_prompt_tokens"] = max(site["max_prompt_tokens"], prompt_tokens)
+            site["dropped_tokens"] += dropped_tokens
+            if dropped_tokens:
+                site["over_budget_trims"] += 1
+
+    def stats(self) -> Dict:
+        """Per-call-site prompt sizes for this worker"""
+        with self._lock:
+            out = {name: dict(s) for name, s in self._stats.items()}
+        for s in out.values():
+            s["avg_prompt_tokens"] = round(s["prompt_tokens"] / s["prompts"], 1) if s["prompts"] else 0.0
+        return out
+
+
+# Service instance
+prompt_context = PromptContextService()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+SMTP Pool Service
+Keeps authenticated SMTP connections open between sends so a batch of queued
+emails pays for the TCP/TLS handshake and login once instead of per message.
+Connections are checked with NOOP after sitting idle, recycled after a message
+cap, and replaced transparently when the server has dropped them. A message
+is only resent on a new connection if the old one failed before DATA; after
+that the server may already have accepted it, so delivery is at most once.
+"""
+import logging
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from email.message import EmailMessage
+from typing import Dict, List
+from config import (SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_SECURITY, SMTP_POOL_SIZE,
+                    SMTP_POOL_IDLE_SECONDS, SMTP_MAX_MESSAGES_PER_CONNECTION, SMTP_TIMEOUT_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+NOOP_AFTER_IDLE_SECONDS = 10  # verify a connection with NOOP before reuse once idle this long
+
+# Failures that mean the connection (not the message) is bad: reconnect and retry once
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError, ssl.SSLError)
+# Rejections of one message; the session is still good (smtplib already sent RSET)
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class SMTPDeliveryUncertain(smtplib.SMTPException):
+    """The connection failed after DATA was sent; the server may have accepted the message"""
+
+
+class _DataTracking:
+    """Records whether DATA was issued on this connection since the flag was last cleared"""
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class _SMTP(_DataTracking, smtplib.SMTP):
+    pass
+
+
+class _SMTP_SSL(_DataTracking, smtplib.SMTP_SSL):
+    pass
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    True when a failed send is worth retrying later: dropped/refused connections,
+    timeouts and 4xx replies (greylisting, Gmail's rate-limit 421/451/454).
+    Follows the __cause__ chain, so wrapped errors are classified too. A drop
+    after DATA is not retried, since resending could deliver the email twice.
+    """
+    while exc is not None:
+        if isinstance(exc, SMTPDeliveryUncertain):
+            return False
+        if isinstance(exc, smtplib.SMTPRecipientsRefused):
+            return bool(exc.recipients) and all(400 <= code < 500 for code, _ in exc.recipients.values())
+        if isinstance(exc, smtplib.SMTPResponseException):
+            return 400 <= exc.smtp_code < 500
+        if isinstance(exc, (smtplib.SMTPServerDisconnected, OSError)):  # incl. timeouts and TLS errors
+            return True
+        exc = exc.__cause__
+    return False
+
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.sent = 0
+
+
+class SMTPPool:
+    def __init__(self, host: str = SMTP_SERVER, port: int = SMTP_PORT, user: str = SMTP_USER,
+                 password: str = SMTP_PASS, security: str = SMTP_SECURITY, size: int = SMTP_POOL_SIZE,
+                 idle_seconds: float = SMTP_POOL_IDLE_SECONDS,
+                 max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION, timeout: float = SMTP_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.security = (security or "ssl").lower()  # ssl | starttls | none
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle: List[_PooledConnection] = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._counters = {"sent": 0, "connects": 0, "reconnects": 0, "recycled": 0, "errors": 0}
+
+    # ─── Connections ──────────────────────────────────────────────────────────
+    def _connect(self) -> _PooledConnection:
+        if self.security == "ssl":
+            smtp = _SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            smtp = _SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                smtp.starttls(context=ssl.create_default_context())
+        try:
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+        except Exception:
+            self._quit(smtp)
+            raise
+        with self._lock:
+            self._counters["connects"] += 1
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _quit(smtp: smtplib.SMTP):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _usable(self, conn: _PooledConnection) -> bool:
+        idle = time.monotonic() - conn.last_used
+        if idle > self.idle_seconds or (self.max_messages and conn.sent >= self.max_messages):
+            return False
+        if idle > NOOP_AFTER_IDLE_SECONDS:
+            try:
+                return conn.smtp.noop()[0] == 250
+            except Exception:
+                return False
+        return True
+
+    def _checkout(self) -> _PooledConnection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._usable(conn):
+                return conn
+            self._retire(conn)
+
+    def _retire(self, conn: _PooledConnection):
+        with self._lock:
+            self._counters["recycled"] += 1
+        self._quit(conn.smtp)
+
+    def _checkin(self, conn: _PooledConnection):
+        conn.last_used = time.monotonic()
+        if self.max_messages and conn.sent >= self.max_messages:
+            self._retire(conn)
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow an authenticated connection; it goes back to the pool unless the connection itself failed"""
+        with self._slots:
+            conn = self._checkout()
+            try:
+                yield conn
+            except _MESSAGE_ERRORS:
+                self._checkin(conn)
+                raise
+            except Exception:
+                self._quit(conn.smtp)
+                raise
+            self._checkin(conn)
+
+    # ─── Sending ──────────────────────────────────────────────────────────────
+    def send(self, message: EmailMessage):
+        """Send on a pooled connection, reconnecting once if the server dropped it before DATA"""
+        for attempt in (1, 2):
+            conn = None
+            try:
+                with self.connection() as conn:
+                    conn.smtp.data_started = False
+                    conn.smtp.send_message(message)
+                    conn.sent += 1
+                break
+            except _CONNECTION_ERRORS as e:
+                if conn is not None and conn.smtp.data_started:
+                    self._count("errors")
+                    raise SMTPDeliveryUncertain(f"SMTP connection lost after DATA ({e!r}); not resending") from e
+                if attempt == 2:
+                    self._count("errors")
+                    raise
+                self._count("reconnects")
+                logger.warning(f"SMTP connection lost ({e!r}); reconnecting")
+            except Exception:
+                self._count("errors")
+                raise
+        self._count("sent")
+
+    def close_idle(self):
+        """Log out of every pooled connection (e.g. once the email queue is drained)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn.smtp)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._counters, idle=len(self._idle), size=self.size)
+
+
+# Service instance
+smtp_pool = SMTPPool()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Ticket Activity Service
+Buffers "last viewed" activity in memory and flushes it to ticket_activity
+in one multi-row upsert every few seconds, so reads never write to tickets.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import TicketActivity, db
+
+logger = logging.getLogger(__name__)
+
+
+class TicketActivityService:
+    def __init__(self, flush_seconds: float = 5.0):
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+        self._registered_exit = False
+
+    def record_view(self, ticket_id: str, agent_id: Optional[int] = None):
+        """Note that a ticket was viewed; cheap, in-memory only"""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._pending.get(ticket_id)
+            if entry:
+                entry["last_viewed_at"] = now
+                entry["last_viewed_by"] = agent_id or entry["last_viewed_by"]
+                entry["view_count"] += 1
+            else:
+                self._pending[ticket_id] = {
+                    "ticket_id": ticket_id,
+                    "last_viewed_at": now,
+                    "last_viewed_by": agent_id,
+                    "view_count": 1,
+                }
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._thread and self._thread.is_alive():
+            return
+        from flask import current_app
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._app = current_app._get_current_object()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ticket-activity-flusher", daemon=True)
+            self._thread.start()
+            if not self._registered_exit:
+                atexit.register(self.stop)
+                self._registered_exit = True
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def stop(self):
+        """Stop the flusher and write out whatever is still buffered"""
+        self._stop.set()
+        if self._app is not None:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write all buffered views in a single statement; returns the number of tickets flushed"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch = list(self._pending.values())
+            self._pending = {}
+
+        with self._app.app_context():
+            try:
+                self._upsert(batch)
+                db.session.commit()
+                return len(batch)
+            except OperationalError as e:
+                # Transient (lock timeout, lost connection): keep the views for the next flush
+                db.session.rollback()
+                logger.error(f"Failed to flush {len(batch)} ticket activity rows, will retry: {e}")
+                self._requeue(batch)
+                return 0
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Batch flush of {len(batch)} ticket activity rows failed, retrying row by row: {e}")
+            return self._flush_rows(batch)
+
+    def _flush_rows(self, batch) -> int:
+        """
+        Fallback after a failed batch: write rows one at a time and drop the ones
+        that can never succeed (e.g. the ticket or agent was deleted after the view)
+        """
+        flushed, retry = 0, []
+        for row in batch:
+            try:
+                self._upsert([row])
+                db.session.commit()
+                flushed += 1
+            except IntegrityError as e:
+                db.session.rollback()
+                logger.warning(f"Dropping ticket activity for {row['ticket_id']}: {e.orig}")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to flush ticket activity for {row['ticket_id']}: {e}")
+                retry.append(row)
+        if retry:
+            self._requeue(retry)
+        return flushed
+
+    def _upsert(self, batch):
+        table = TicketActivity.__table__
+        if db.engine.dialect.name == "mysql":
+            stmt = mysql_insert(table).values(batch)
+            stmt = stmt.on_duplicate_key_update(
+                last_viewed_at=stmt.inserted.last_viewed_at,
+                last_viewed_by=db.func.coalesce(stmt.inserted.last_viewed_by, table.c.last_viewed_by),
+                view_count=table.c.view_count + stmt.inserted.view_count,
+            )
+        else:
+            stmt = sqlite_insert(table).values(batch)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.ticket_id],
+                set_={
+                    "last_viewed_at": stmt.excluded.last_viewed_at,
+                    "last_viewed_by": db.func.coalesce(stmt.excluded.last_viewed_by, table.c.last_viewed_by),
+                    "view_count": table.c.view_count + stmt.excluded.view_count,
+                },
+            )
+        db.session.execute(stmt)
+
+    def _requeue(self, batch):
+        """Merge a failed batch back into the buffer so the next flush retries it"""
+        with self._lock:
+            for row in batch:
+                entry = self._pending.get(row["ticket_id"])
+                if entry:
+                    entry["view_count"] += row["view_count"]
+                    entry["last_viewed_by"] = entry["last_viewed_by"] or row["last_viewed_by"]
+                else:
+                    self._pending[row["ticket_id"]] = row
+
+
+# Service instance
+ticket_activity = TicketActivityService()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Ticket Embedding Service
+Embeds each ticket subject once, stores it as float32 bytes in ticket_embeddings
+and keeps every vector in an in-process index, so related-ticket lookups are a
+single matrix product instead of re-embedding the whole table per request.
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
+from models import Ticket, TicketEmbedding, db
+from openai_helpers import EMB_MODEL
+from services.embedding_service import embeddings
+from services.openai_rate_limiter_service import BACKGROUND, openai_rate_limiter
+from services.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_SIZE = 256          # tickets per backfill step (the embedding client packs its own API batches)
+BACKFILL_INTERVAL_SECONDS = 300  # minimum gap between background backfill sweeps
+
+
+class TicketEmbeddingService:
+    def __init__(self, model: str = EMB_MODEL):
+        self.model = model
+        self.index = VectorIndex()
+        self._hashes: Dict[str, str] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ticket-embeddings")
+        self._backfill_running = False
+        self._last_backfill = 0.0
+
+    @staticmethod
+    def embedding_text(ticket: Ticket) -> str:
+        return (ticket.subject or "").strip()
+
+    def content_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{text}".encode("utf-8")).hexdigest()
+
+    def _ensure_loaded(self):
+        """Load all stored vectors for the current model into memory, once per process"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = (db.session.query(TicketEmbedding.ticket_id, TicketEmbedding.content_hash,
+                                     TicketEmbedding.dim, TicketEmbedding.vector)
+                    .filter(TicketEmbedding.model == self.model)
+                    .all())
+            for ticket_id, digest, dim, blob in rows:
+                vec = np.frombuffer(blob, dtype=np.float32)
+                if vec.shape[0] != dim:
+                    logger.warning(f"Skipping corrupt embedding for ticket {ticket_id}")
+                    continue
+                self.index.add(ticket_id, vec)
+                self._hashes[ticket_id] = digest
+            self._loaded = True
+            logger.info(f"Loaded {len(self.index)} ticket embeddings ({self.model})")
+
+    def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        return embeddings.embed(texts, self.model)
+
+    def index_tickets(self, tickets: List[Ticket]) -> int:
+        """Embed and persist tickets whose subject changed since they were last embedded"""
+        self._ensure_loaded()
+        todo = []
+        for t in tickets:
+            text = self.embedding_text(t)
+            if not text:
+                continue
+            digest = self.content_hash(text)
+            if self._hashes.get(t.id) != digest:
+                todo.append((t.id, text, digest))
+        if not todo:
+            return 0
+
+        vectors = self._embed([text for _, text, _ in todo])
+        for (ticket_id, _, digest), vec in zip(todo, vectors):
+            db.session.merge(TicketEmbedding(
+                ticket_id=ticket_id,
+                model=self.model,
+                dim=int(vec.shape[0]),
+                content_hash=digest,
+                vector=vec.astype("<f4").tobytes(),
+            ))
+        db.session.commit()
+
+        with self._lock:
+            for (ticket_id, _, digest), vec in zip(todo, vectors):
+                self.index.add(ticket_id, vec)
+                self._hashes[ticket_id] = digest
+        return len(todo)
+
+    def remove(self, ticket_id: str):
+        """Forget a ticket's vector (the table row goes with the ticket via ON DELETE CASCADE)"""
+        with self._lock:
+            self.index.remove(ticket_id)
+            self._hashes.pop(ticket_id, None)
+
+    def _refresh_from_db(self, ticket_id: str, digest: str) -> bool:
+        """Pick up a vector another process already stored for this ticket version"""
+        row = db.session.get(TicketEmbedding, ticket_id)
+        if not row or row.model != self.model or row.content_hash != digest:
+            return False
+        with self._lock:
+            self.index.add(ticket_id, np.frombuffer(row.vector, dtype=np.float32))
+            self._hashes[ticket_id] = digest
+        return True
+
+    def related(self, ticket: Ticket, k: int = 5) -> List[Tuple[str, float]]:
+        """Top-k most similar other tickets as (ticket_id, similarity)"""
+        self._ensure_loaded()
+        self.schedule_backfill()
+
+        text = self.embedding_text(ticket)
+        digest = self.content_hash(text)
+        if self._hashes.get(ticket.id) != digest and not self._refresh_from_db(ticket.id, digest):
+            if text:
+                self.index_tickets([ticket])
+            else:
+                # Nothing to embed; an empty subject matches nothing meaningfully
+                return []
+        vec = self.index.get(ticket.id)
+        if vec is None:
+            return []
+        return self.index.search(vec, k=k, exclude=[ticket.id])
+
+    def schedule_backfill(self, force: bool = False) -> bool:
+        """Embed any tickets missing from the index in the background, at most every few minutes"""
+        from flask import current_app
+        with self._lock:
+            if self._backfill_running:
+                return False
+            if not force and time.monotonic() - self._last_backfill < BACKFILL_INTERVAL_SECONDS:
+                return False
+            self._backfill_running = True
+            self._last_backfill = time.monotonic()
+
+        app = current_app._get_current_object()
+        self._executor.submit(self._backfill, app)
+        return True
+
+    def _backfill(self, app):
+        try:
+            with app.app_context(), openai_rate_limiter.priority(BACKGROUND):
+                count = self.backfill()
+                if count:
+                    logger.info(f"Embedded {count} tickets in background backfill")
+        except Exception as e:
+            logger.error(f"Ticket embedding backfill failed: {e}")
+        finally:
+            with self._lock:
+                self._backfill_running = False
+
+    def backfill(self) -> int:
+        """Embed every ticket whose subject has no current vector; returns how many were embedded"""
+        self._ensure_loaded()
+        stale = {}
+        for ticket_id, subject in db.session.query(Ticket.id, Ticket.subject):
+            text = (subject or "").strip()
+            digest = self.content_hash(text) if text else None
+            if digest and self._hashes.get(ticket_id) != digest:
+                stale[ticket_id] = digest
+
+        # Vectors stored by other worker processes only need loading, not re-embedding
+        ids = list(stale)
+        for i in range(0, len(ids), EMBED_BATCH_SIZE):
+            rows = (TicketEmbedding.query
+                    .filter(TicketEmbedding.ticket_id.in_(ids[i:i + EMBED_BATCH_SIZE]),
+                            TicketEmbedding.model == self.model)
+                    .all())
+            with self._lock:
+                for row in rows:
+                    if row.content_hash == stale[row.ticket_id]:
+                        self.index.add(row.ticket_id, np.frombuffer(row.vector, dtype=np.float32))
+                        self._hashes[row.ticket_id] = row.content_hash
+                        del stale[row.ticket_id]
+
+        stale = list(stale)
+        total = 0
+        for i in range(0, len(stale), EMBED_BATCH_SIZE):
+            chunk = Ticket.query.filter(Ticket.id.in_(stale[i:i + EMBED_BATCH_SIZE])).all()
+            total += self.index_tickets(chunk)
+        return total
+
+
+# Service instance
+ticket_embeddings = TicketEmbeddingService()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Ticket Summary Service
+Persists one GPT summary per ticket content version and regenerates it
+in the background only when the subject or messages change.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from models import Ticket, TicketSummary, db
+from openai_helpers import client, CHAT_MODEL
+from services.openai_rate_limiter_service import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# How much of the conversation feeds the summary prompt
+SUMMARY_MAX_MESSAGES = 6
+SUMMARY_MAX_MESSAGE_CHARS = 300
+
+
+class TicketSummaryService:
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ticket-summary")
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def build_summary_input(self, ticket: Ticket, messages: List[Dict]) -> str:
+        """Build the text that gets summarized: subject plus the latest conversation turns"""
+        subject = (ticket.subject or "").strip()
+        turns = [m for m in messages if m.get("type") != "system" and m.get("content")]
+        turns = turns[-SUMMARY_MAX_MESSAGES:]
+        if not turns:
+            return subject
+
+        lines = [subject, "", "Recent conversation:"]
+        for m in turns:
+            content = str(m.get("content") or "").strip().replace("\n", " ")
+            lines.append(f"- {m.get('sender')}: {content[:SUMMARY_MAX_MESSAGE_CHARS]}")
+        return "\n".join(lines)
+
+    def content_hash(self, summary_input: str) -> str:
+        """Version key for a summary: any change to the summarized text yields a new hash"""
+        return hashlib.sha256(f"{CHAT_MODEL}\n{summary_input}".encode("utf-8")).hexdigest()
+
+    def get_summary(self, ticket: Ticket, messages: List[Dict]) -> str:
+        """
+        Return the stored summary for the ticket without calling OpenAI.
+        If the stored version is stale or missing, a background regeneration is
+        scheduled and the previous summary (or the raw subject) is served meanwhile.
+        """
+        summary_input = self.build_summary_input(ticket, messages)
+        if not summary_input:
+            return ""
+
+        digest = self.content_hash(summary_input)
+        row = db.session.get(TicketSummary, ticket.id)
+        if row and row.content_hash == digest:
+            return row.summary
+
+        self.schedule_regeneration(ticket.id, summary_input, digest)
+        if row and row.summary:
+            return row.summary
+        return ticket.subject or ""
+
+    def schedule_regeneration(self, ticket_id: str, summary_input: str, digest: str) -> bool:
+        """Queue a summary refresh unless one is already running for this version"""
+        from flask import current_app
+        key = (ticket_id, digest)
+        with self._lock:
+            if key in self._inflight:
+                return False
+            self._inflight.add(key)
+
+        app = current_app._get_current_object()
+        self._executor.submit(self._regenerate, app, ticket_id, summary_input, digest)
+        return True
+
+    def _regenerate(self, app, ticket_id: str, summary_input: str, digest: str):
+        try:
+            summary = self._generate(summary_input)
+            if summary is None:
+                return
+            with app.app_context():
+                row = db.session.get(TicketSummary, ticket_id)
+                if not row:
+                    row = TicketSummary(ticket_id=ticket_id)
+                    db.session.add(row)
+                row.content_hash = digest
+                row.summary = summary
+                row.model = CHAT_MODEL
+                row.updated_at = datetime.now(timezone.utc)
+                db.session.commit()
+                logger.info(f"Stored summary for ticket {ticket_id} ({digest[:12]})")
+        except Exception as e:
+            logger.error(f"Failed to regenerate summary for ticket {ticket_id}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard((ticket_id, digest))
+
+    def _generate(self, summary_input: str) -> Optional[str]:
+        try:
+            resp = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": "Summarize the following support ticket in 1-2 sentences."},
+                    {"role": "user", "content": summary_input}
+                ],
+                max_tokens=60, temperature=0.5, priority=BACKGROUND
+            )
+            return resp.choices[0].message.content.strip()
+        except Exception as e:
+            logger.warning(f"OpenAI summary generation failed: {e}")
+            return None
+
+
+# Service instance
+ticket_summaries = TicketSummaryService()
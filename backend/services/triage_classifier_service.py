@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Triage Classifier Service
+Scores ticket subjects with the local TF-IDF + LogisticRegression model in one
+vectorized batch and persists the result per ticket. GPT is only consulted, in
+the background, for tickets the model is not confident about.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from category_map import LABELS, TEAM_MAP
+from config import TRIAGE_CLASSIFIER_PATH, TRIAGE_CONFIDENCE_THRESHOLD
+from models import Ticket, TicketTriage, db
+from openai_helpers import categorize_with_gpt
+from services.openai_rate_limiter_service import BACKGROUND, openai_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_LABEL = "other"
+GPT_RETRY_SECONDS = 600  # wait before re-asking GPT about a ticket whose triage call failed
+_IN_CHUNK = 500
+
+
+class TriageClassifierService:
+    def __init__(self, max_workers: int = 2):
+        self.vectorizer = None
+        self.model = None
+        self.threshold = TRIAGE_CONFIDENCE_THRESHOLD
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="triage-gpt")
+        self._inflight = set()
+        self._retry_after: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.vectorizer is not None and self.model is not None
+
+    def load(self, path: Optional[str] = None) -> bool:
+        """Load the pickled classifier once per process; returns False if unavailable"""
+        path = path or TRIAGE_CLASSIFIER_PATH
+        if not os.path.exists(path):
+            logger.info(f"Triage classifier not found at {path}; GPT fallback only")
+            return False
+        try:
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+            self.vectorizer = payload["vectorizer"]
+            self.model = payload["model"]
+            unknown = [c for c in self.model.classes_ if c not in TEAM_MAP]
+            if unknown:
+                logger.warning(f"Triage classifier has labels outside LABELS {unknown}; they will defer to GPT")
+            logger.info(f"Loaded triage classifier from {path} ({len(self.model.classes_)} labels)")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load triage classifier from {path}: {e}")
+            self.vectorizer = None
+            self.model = None
+            return False
+
+    def predict(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """Return (label, probability) for every text from a single vectorized pass"""
+        if not texts:
+            return []
+        if not self.is_loaded:
+            return [(FALLBACK_LABEL, 0.0)] * len(texts)
+        probs = self.model.predict_proba(self.vectorizer.transform(texts))
+        best = probs.argmax(axis=1)
+        return [(str(self.model.classes_[i]), float(probs[row, i])) for row, i in enumerate(best)]
+
+    def ensure_triaged(self, tickets: List[Ticket]) -> Dict[str, TicketTriage]:
+        """
+        Return the stored triage row for each ticket, classifying any that are
+        missing with the local model. Never calls the network; low-confidence
+        tickets get a provisional label and are queued for background GPT triage.
+        """
+        rows = self._load_rows([t.id for t in tickets])
+        missing = [t for t in tickets if t.id not in rows]
+
+        if missing:
+            predictions = self.predict([t.subject or "" for t in missing])
+            for ticket, (label, confidence) in zip(missing, predictions):
+                source = "model"
+                if not (ticket.subject or "").strip():
+                    label, confidence = FALLBACK_LABEL, 0.0
+                elif label not in TEAM_MAP or confidence < self.threshold:
+                    label = label if label in TEAM_MAP else FALLBACK_LABEL
+                    source = "pending_gpt"
+                row = TicketTriage(
+                    ticket_id=ticket.id,
+                    predicted_category=label,
+                    assigned_team=TEAM_MAP[label],
+                    confidence=confidence,
+                    source=source,
+                )
+                db.session.add(row)
+                rows[ticket.id] = row
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another request triaged the same tickets first; use its rows
+                db.session.rollback()
+                rows = self._load_rows([t.id for t in tickets])
+
+        subjects = {t.id: t.subject or "" for t in tickets}
+        for ticket_id, row in rows.items():
+            if row.source == "pending_gpt":
+                self.schedule_gpt_triage(ticket_id, subjects.get(ticket_id, ""))
+        return rows
+
+    def _load_rows(self, ticket_ids: List[str]) -> Dict[str, TicketTriage]:
+        rows = {}
+        for i in range(0, len(ticket_ids), _IN_CHUNK):
+            chunk = ticket_ids[i:i + _IN_CHUNK]
+            for row in TicketTriage.query.filter(TicketTriage.ticket_id.in_(chunk)).all():
+                rows[row.ticket_id] = row
+        return rows
+
+    def schedule_gpt_triage(self, ticket_id: str, text: str) -> bool:
+        """Queue a GPT triage for a low-confidence ticket unless one is already running"""
+        from flask import current_app
+        with self._lock:
+            if ticket_id in self._inflight or self._retry_after.get(ticket_id, 0) > time.monotonic():
+                return False
+            self._inflight.add(ticket_id)
+
+        app = current_app._get_current_object()
+        self._executor.submit(self._gpt_triage, app, ticket_id, text)
+        return True
+
+    def _gpt_triage(self, app, ticket_id: str, text: str):
+        try:
+            # Executor threads don't inherit the caller's priority context
+            with openai_rate_limiter.priority(BACKGROUND):
+                label, team = categorize_with_gpt(text)
+            if label not in TEAM_MAP:
+                # categorize_with_gpt swallows API errors into a generic fallback; keep the ticket pending
+                logger.warning(f"GPT triage for ticket {ticket_id} returned unknown label {label!r}")
+                with self._lock:
+                    self._retry_after[ticket_id] = time.monotonic() + GPT_RETRY_SECONDS
+                return
+            with app.app_context():
+                row = db.session.get(TicketTriage, ticket_id)
+                if not row:
+                    return
+                row.predicted_category = label
+                row.assigned_team = team
+                row.source = "gpt"
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"GPT triage failed for ticket {ticket_id}: {e}")
+            with self._lock:
+                self._retry_after[ticket_id] = time.monotonic() + GPT_RETRY_SECONDS
+        finally:
+            with self._lock:
+                self._inflight.discard(ticket_id)
+
+    def training_data(self) -> Tuple[List[str], List[str]]:
+        """Subjects and labels confirmed by GPT, for retraining the local model"""
+        rows = (db.session.query(Ticket.subject, TicketTriage.predicted_category)
+                .join(TicketTriage, TicketTriage.ticket_id == Ticket.id)
+                .filter(TicketTriage.source == "gpt", TicketTriage.predicted_category.in_(LABELS))
+                .all())
+        texts = [subject for subject, _ in rows if subject]
+        labels = [label for subject, label in rows if subject]
+        return texts, labels
+
+
+# Service instance
+triage_classifier = TriageClassifierService()
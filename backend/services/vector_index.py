@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Vector Index
+In-process store of unit-normalized float32 vectors keyed by id, shared by the
+ticket and KB embedding services. Cosine top-k is one matrix-vector product.
+An internal lock keeps searches consistent while a backfill adds or removes rows.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+class VectorIndex:
+    """Unit-normalized float32 rows keyed by id, with O(1) add/remove and top-k cosine search"""
+
+    def __init__(self, dim: Optional[int] = None, capacity: int = 1024):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32) if dim else None
+        self._ids: List[str] = []
+        self._pos: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key):
+        return key in self._pos
+
+    def add(self, key: str, vector: np.ndarray):
+        """Insert or replace the vector for `key`"""
+        vec = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            if self.dim is None:
+                self.dim = vec.shape[0]
+                self._matrix = np.zeros((1024, self.dim), dtype=np.float32)
+        if vec.shape[0] != self.dim:
+            raise ValueError(f"vector for {key} has dim {vec.shape[0]}, index has {self.dim}")
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+
+        with self._lock:
+            row = self._pos.get(key)
+            if row is None:
+                row = len(self._ids)
+                if row == self._matrix.shape[0]:
+                    grown = np.zeros((row * 2, self.dim), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._ids.append(key)
+                self._pos[key] = row
+            self._matrix[row] = vec
+
+    def remove(self, key: str) -> bool:
+        """Drop `key` by moving the last row into its slot"""
+        with self._lock:
+            row = self._pos.pop(key, None)
+            if row is None:
+                return False
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved
+                self._pos[moved] = row
+            self._ids.pop()
+            return True
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._pos.get(key)
+            return None if row is None else self._matrix[row].copy()
+
+    def search(self, vector: np.ndarray, k: int = 5, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """Top-k (id, cosine similarity) pairs, best first"""
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        # Score and copy the ids under the lock, so a concurrent add/remove can't move rows mid-search
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return []
+            sims = self._matrix[:n] @ query
+            ids = list(self._ids)
+
+        exclude = set(exclude)
+        want = min(n, k + len(exclude))
+        top = np.argpartition(-sims, want - 1)[:want] if want < n else np.arange(n)
+        top = top[np.argsort(-sims[top])]
+        results = []
+        for row in top:
+            key = ids[row]
+            if key in exclude:
+                continue
+            results.append((key, float(sims[row])))
+            if len(results) >= k:
+                break
+        return results
@@ -42,4 +42,4 @@ fi
 
 echo "Starting Gunicorn server..."
 # Start Gunicorn with better configuration for Azure
-gunicorn --bind=0.0.0.0:$PORT --timeout 600 --workers=2 --max-requests=1000 --preload run:app
\ No newline at end of file
+gunicorn --bind=0.0.0.0:$PORT --timeout 600 --workers=2 --threads=4 --max-requests=1000 --preload run:app
\ No newline at end of file
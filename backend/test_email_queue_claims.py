@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for the email worker's claim/lease logic against a temporary SQLite DB:
+claiming a batch, a second claim finding nothing, reclaiming after the lease
+expires, and a transient send failure being rescheduled as PENDING.
+"""
+
+import os
+import smtplib
+import sys
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(__file__))
+
+from flask import Flask
+from extensions import db
+from models import EmailQueue
+from urls import _claim_pending_ids, _finish_email_batch, _email_result
+
+
+def _make_app(path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def _queue(n):
+    for i in range(n):
+        db.session.add(EmailQueue(to_email=f"user{i}@example.com", subject=f"Update {i}", body="Body", status="PENDING"))
+    db.session.commit()
+    return [e.id for e in EmailQueue.query.order_by(EmailQueue.id)]
+
+
+def _job(row):
+    return {"id": row.id, "attempts": row.attempts, "ticket_id": row.ticket_id, "subject": row.subject,
+            "to_email": row.to_email, "cc": []}
+
+
+def test_claim_and_second_claim():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "queue.db"))
+        with app.app_context():
+            db.create_all()
+            queued = _queue(3)
+
+            token, ids = _claim_pending_ids(limit=10)
+            assert sorted(ids) == queued
+            rows = EmailQueue.query.all()
+            assert all(r.status == "SENDING" and r.claim_token == token and r.lease_expires_at for r in rows)
+
+            # Everything is leased to the first batch
+            _, again = _claim_pending_ids(limit=10)
+            assert again == []
+
+
+def test_expired_lease_is_reclaimed():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "queue.db"))
+        with app.app_context():
+            db.create_all()
+            queued = _queue(2)
+            old_token, ids = _claim_pending_ids(limit=10)
+            assert sorted(ids) == queued
+
+            # The first worker died: its lease runs out
+            for row in EmailQueue.query.all():
+                row.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+
+            new_token, reclaimed = _claim_pending_ids(limit=10)
+            assert new_token != old_token
+            assert sorted(reclaimed) == queued
+            assert all(r.claim_token == new_token for r in EmailQueue.query.all())
+
+            # A late result from the old batch must not overwrite the new owner's rows
+            row = db.session.get(EmailQueue, queued[0])
+            _finish_email_batch(old_token, [_email_result(_job(row), None)])
+            db.session.expire_all()
+            row = db.session.get(EmailQueue, queued[0])
+            assert row.status == "SENDING" and row.claim_token == new_token
+
+
+def test_transient_failure_is_rescheduled():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "queue.db"))
+        with app.app_context():
+            db.create_all()
+            (email_id,) = _queue(1)
+            token, ids = _claim_pending_ids(limit=10)
+            assert ids == [email_id]
+
+            row = db.session.get(EmailQueue, email_id)
+            error = smtplib.SMTPResponseException(451, b"Try again later")
+            _finish_email_batch(token, [_email_result(_job(row), error)])
+            db.session.expire_all()
+
+            row = db.session.get(EmailQueue, email_id)
+            assert row.status == "PENDING"
+            assert row.attempts == 1
+            assert row.claim_token is None and row.lease_expires_at is None
+            assert row.next_attempt_at > datetime.utcnow()
+
+            # Not claimable until the retry is due
+            _, ids = _claim_pending_ids(limit=10)
+            assert ids == []
+            row.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            _, ids = _claim_pending_ids(limit=10)
+            assert ids == [email_id]
+
+
+if __name__ == "__main__":
+    test_claim_and_second_claim()
+    test_expired_lease_is_reclaimed()
+    test_transient_failure_is_rescheduled()
+    print("✅ email queue claim tests passed")
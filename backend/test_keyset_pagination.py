@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Regression tests for keyset_page on SQLite: paging through tickets whose
+updated_at was written by CURRENT_TIMESTAMP (no fractional seconds) must
+terminate, and a non-positive limit must not crash.
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+sys.path.append(os.path.dirname(__file__))
+
+from flask import Flask
+from sqlalchemy import text
+from extensions import db
+from models import Ticket
+from db_helpers import keyset_page
+
+
+def _make_app(path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def _add_ticket(ticket_id):
+    db.session.add(Ticket(id=ticket_id, subject=ticket_id, requester_name="Test", category="General",
+                          priority="Low", impact_level="Low", urgency_level="Low",
+                          requester_email="test@example.com"))
+
+
+def _walk(limit):
+    """Follow X-Next-Cursor style cursors until exhausted; fail on a repeated cursor"""
+    seen, cursors, cursor = [], set(), None
+    while True:
+        rows, cursor = keyset_page(Ticket.query, Ticket, limit, cursor=cursor)
+        seen.extend(t.id for t in rows)
+        if cursor is None:
+            return seen
+        assert cursor not in cursors, f"cursor repeated after {seen}"
+        cursors.add(cursor)
+
+
+def test_keyset_page_terminates_with_second_precision_timestamps():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "keyset.db"))
+        with app.app_context():
+            db.create_all()
+            for i in range(1, 6):
+                _add_ticket(f"T{i}")
+            db.session.commit()
+            # Same text format the onupdate/backfill path writes on SQLite
+            db.session.execute(text("UPDATE tickets SET updated_at = CURRENT_TIMESTAMP"))
+            db.session.commit()
+
+            assert _walk(2) == ["T5", "T4", "T3", "T2", "T1"]
+
+
+def test_keyset_page_mixed_timestamp_formats():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "keyset.db"))
+        with app.app_context():
+            db.create_all()
+            for i in range(1, 7):
+                _add_ticket(f"T{i}")
+            db.session.commit()
+            db.session.execute(text("UPDATE tickets SET updated_at = '2024-05-01 10:00:00' WHERE id IN ('T1','T2','T3')"))
+            db.session.execute(text("UPDATE tickets SET updated_at = NULL WHERE id = 'T6'"))
+            for ticket_id in ("T4", "T5"):
+                db.session.get(Ticket, ticket_id).updated_at = datetime(2024, 5, 1, 10, 0, 0, 250000)
+            db.session.commit()
+
+            assert _walk(1) == ["T5", "T4", "T3", "T2", "T1", "T6"]
+            assert _walk(4) == ["T5", "T4", "T3", "T2", "T1", "T6"]
+
+
+def test_keyset_page_non_positive_limit():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, "keyset.db"))
+        with app.app_context():
+            db.create_all()
+            for i in range(1, 4):
+                _add_ticket(f"T{i}")
+            db.session.commit()
+
+            for limit in (0, -5):
+                rows, cursor = keyset_page(Ticket.query, Ticket, limit)
+                assert [t.id for t in rows] == ["T3"]
+                assert cursor is not None
+
+
+if __name__ == "__main__":
+    test_keyset_page_terminates_with_second_precision_timestamps()
+    test_keyset_page_mixed_timestamp_formats()
+    test_keyset_page_non_positive_limit()
+    print("✅ keyset pagination tests passed")
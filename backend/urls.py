@@ -1,27 +1,49 @@
 import enum
 import io
 import json
+import random
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from time import time, sleep
-from flask import Blueprint, redirect, request, jsonify, abort, make_response, send_file, current_app
+from flask import Blueprint, redirect, request, jsonify, abort, make_response, send_file, current_app, stream_with_context
 from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
 from sqlalchemy import func, text, case
+from sqlalchemy.exc import IntegrityError
 import re
 import os
 from extensions import db
-from db_helpers import get_next_attempt_no, has_pending_attempt, save_steps, insert_message_with_mentions, get_messages, ensure_ticket_record_from_csv, log_event, add_event, _derive_subject_from_text, log_ticket_history, save_message
+from db_helpers import thread_list_query, keyset_page, get_next_attempt_no, has_pending_attempt, save_steps, insert_message_with_mentions, get_messages, ensure_ticket_record_from_csv, log_event, add_event, _derive_subject_from_text, log_ticket_history, save_message
 from email_helpers import _serializer, _utcnow, send_via_gmail, enqueue_status_email
-from openai_helpers import _inject_system_message, _start_step_sequence_basic, categorize_department_with_gpt, is_materially_different, next_action_for, categorize_with_gpt
+from openai_helpers import _inject_system_message, _start_step_sequence_basic, categorize_department_with_gpt, is_materially_different, next_action_for
 from utils import extract_mentions, route_department_from_category
 from cli import client, load_df
-from utils import _can_view, extract_json
+from utils import _can_view, extract_json, JsonReplyStream
 from openai_helpers import build_prompt_from_intent
-from config import CONFIRM_REDIRECT_URL, CONFIRM_REDIRECT_URL_REJECT, CONFIRM_REDIRECT_URL_SUCCESS, SECRET_KEY, CHAT_MODEL, ASSISTANT_STYLE, EMB_MODEL
+from services.ticket_summary_service import ticket_summaries
+from services.ticket_activity_service import ticket_activity
+from services.triage_classifier_service import triage_classifier
+from services.ticket_embedding_service import ticket_embeddings
+from services.kb_embedding_service import kb_embeddings
+from services.kb_bm25_service import kb_bm25
+from services.answer_retrieval_service import answer_retrieval
+from services.llm_cache_service import llm_cache
+from services.openai_gateway_service import openai_gateway
+from services.openai_rate_limiter_service import INTERACTIVE, openai_rate_limiter
+from services.prompt_context_service import ContextSnippet, prompt_context
+from services.conversation_summary_service import conversation_summaries
+from services.smtp_pool_service import smtp_pool, is_transient_error
+from services.email_wakeup_service import email_wakeup
+from config import CONFIRM_REDIRECT_URL, CONFIRM_REDIRECT_URL_REJECT, CONFIRM_REDIRECT_URL_SUCCESS, SECRET_KEY, CHAT_MODEL, ASSISTANT_STYLE, EMB_MODEL, KB_SEARCH_MIN_SIMILARITY, KB_CONTEXT_TOKEN_BUDGET
 import jwt
 from models import EmailQueue, KBArticle, KBArticleSource, KBArticleStatus, KBFeedback, KBFeedbackType, SolutionConfirmedVia, Ticket, Department, Agent, Message, TicketAssignment, TicketCC, TicketEvent, ResolutionAttempt, Solution, SolutionGeneratedBy, SolutionStatus, TicketFeedback, EscalationSummary, TicketHistory, DashboardView, AIAutomationSettings, AIAction
 from utils import require_role
-from sqlalchemy import text as _sql_text, case
-from config import FRONTEND_ORIGINS
+from sqlalchemy import text as _sql_text, case, bindparam
+from config import (FRONTEND_ORIGINS, EMAIL_CLAIM_BATCH_SIZE, EMAIL_LEASE_SECONDS, EMAIL_SEND_CONCURRENCY,
+                    EMAIL_DOMAIN_CONCURRENCY, EMAIL_MAX_ATTEMPTS, EMAIL_RETRY_BASE_SECONDS, EMAIL_RETRY_MAX_SECONDS,
+                    EMAIL_POLL_FALLBACK_SECONDS)
 import pandas as pd
 
 urls = Blueprint('urls', __name__)
@@ -154,11 +176,12 @@ def login():
 @urls.route("/threads", methods=["GET"])
 @require_role("L1","L2","L3","MANAGER")
 def list_threads():
-    """Database-based threads with full role filtering and GPT categorization"""
+    """Database-based threads with role filtering, SQL pagination and local triage categories"""
     try:
         # Get pagination parameters
         limit = int(request.args.get("limit", 20))
         offset = int(request.args.get("offset", 0))
+        cursor = request.args.get("cursor")  # opaque keyset cursor; takes precedence over offset
         
         # Get filter parameters
         show_archived = request.args.get("archived", "false").lower() == "true"
@@ -170,66 +193,39 @@ def list_threads():
         role = user.get("role") if user else None
         user_department_id = user.get("department_id") if user else None
 
-        # Query tickets based on archive filter and department restrictions
-        query = Ticket.query
-        
-        # Apply archive filter
-        if show_archived:
-            query = query.filter_by(archived=True)
-        else:
-            query = query.filter_by(archived=False)
-        
         # Apply manual department filter if provided (overrides automatic rules)
+        dept_id = None
         if department_filter:
             try:
                 dept_id = int(department_filter)
-                # Check if user has permission to view this department
-                if user_department_id == 7:  # Helpdesk can filter by any department
-                    query = query.filter_by(department_id=dept_id)
-                    current_app.logger.info(f"Manual department filter: Helpdesk user filtering by dept {dept_id}")
-                elif user_department_id == dept_id:  # User can filter their own department
-                    query = query.filter_by(department_id=dept_id)
-                    current_app.logger.info(f"Manual department filter: User filtering by their own dept {dept_id}")
-                elif not user_department_id:  # Admin users can filter any department
-                    query = query.filter_by(department_id=dept_id)
-                    current_app.logger.info(f"Manual department filter: Admin user filtering by dept {dept_id}")
-                else:
-                    # User trying to access department they don't have permission for
-                    current_app.logger.warning(f"Access denied: User dept {user_department_id} tried to filter dept {dept_id}")
-                    return jsonify(error="Access denied to filter by this department"), 403
             except ValueError:
                 return jsonify(error="Invalid department_id parameter"), 400
-        else:
-            # Apply automatic department-based visibility rules
-            # Helpdesk (department_id = 7) can see all tickets
-            # Other departments can only see their own tickets
-            # Users without departments can see all tickets (fallback for admins/unassigned users)
-            if user_department_id == 7:  # Helpdesk
-                current_app.logger.info(f"Department filtering: Helpdesk user can see all tickets")
-                # No filtering - see all tickets
-            elif user_department_id:  # Specific department
-                query = query.filter_by(department_id=user_department_id)
-                current_app.logger.info(f"Department filtering: User dept {user_department_id} can only see tickets from their department")
-            else:
-                # If user has no department, show all tickets (for admin/system users)
-                current_app.logger.info(f"Department filtering: User has no department, showing all tickets (admin fallback)")
-                # No filtering - see all tickets
-        
-        tickets = query.all()
-        current_app.logger.info(f"Department filtering result: {len(tickets)} tickets returned for user dept {user_department_id}")
+            # Helpdesk, the user's own department and users without a department may filter
+            if user_department_id not in (7, dept_id, None, 0):
+                current_app.logger.warning(f"Access denied: User dept {user_department_id} tried to filter dept {dept_id}")
+                return jsonify(error="Access denied to filter by this department"), 403
+
+        # Visibility, status and pagination all run in SQL; only the page is materialized
+        query = thread_list_query(
+            role,
+            user_department_id=user_department_id,
+            archived=show_archived,
+            status=status_filter,
+            department_id=dept_id,
+        )
+        total = query.order_by(None).count()
+        tickets, next_cursor = keyset_page(query, Ticket, limit, cursor=cursor, offset=offset)
         dept_map = {d.id: d.name for d in Department.query.all()}
+        # Local batch triage (persisted per ticket); GPT only runs in the background for low-confidence subjects
+        triage = triage_classifier.ensure_triaged(tickets)
         
-        # Build all threads with full enrichment (like original)
-        threads_all = []
+        # Build the page with full enrichment (like original)
+        threads = []
         for ticket in tickets:
-            # GPT categorization (preserve original logic)
             text = ticket.subject or ""
-            cat, team = categorize_with_gpt(text)
-            # Check if ticket has been escalated (preserve original logic)
-            escalated = TicketEvent.query.filter_by(
-                ticket_id=ticket.id, 
-                event_type="ESCALATED"
-            ).count() > 0
+            cat, team = triage[ticket.id].predicted_category, triage[ticket.id].assigned_team
+            # Escalated = has at least one ESCALATED event (denormalized onto the ticket)
+            escalated = (ticket.escalation_count or 0) > 0
             
             # Department info
             department = {
@@ -243,14 +239,14 @@ def list_threads():
                 "text": text,  # Map subject -> text for frontend compatibility
                 "subject": ticket.subject,  # Keep original field too
                 "status": ticket.status or "open",
-                "predicted_category": cat,  # From GPT
-                "assigned_team": team,      # From GPT
+                "predicted_category": cat,  # From triage classifier
+                "assigned_team": team,      # From triage classifier
                 "updated_at": ticket.updated_at.isoformat() if ticket.updated_at else None,
                 "created_at": ticket.created_at.isoformat() if ticket.created_at else None,
                 "department_id": ticket.department_id,
             "department": department,
                 "level": ticket.level or 1,  # Critical for role filtering
-                "escalated": escalated,       # From TicketEvent query
+                "escalated": escalated,       # From tickets.escalation_count
                 "priority": ticket.priority,
                 "category": ticket.category,
                 "requester_name": ticket.requester_name,
@@ -261,44 +257,21 @@ def list_threads():
                 "archived": ticket.archived or False,  # Include archived status
                 "lastActivity": ticket.updated_at.isoformat() if ticket.updated_at else None
             }
-            threads_all.append(enriched_ticket)
-        
-        # PRESERVE ORIGINAL ROLE-BASED FILTERING
-        if role == "L2":
-                # L2 sees tickets with level >= 2 (escalated tickets)
-            threads_filtered = [t for t in threads_all if (t.get("level") or 1) >= 2]
-        elif role == "L3":
-                # L3 sees only tickets with level == 3 (highest escalation)
-            threads_filtered = [t for t in threads_all if (t.get("level") or 1) == 3]
-        else:  # L1 and MANAGER see all
-            threads_filtered = threads_all
-
-        # Apply status filtering 
-        if status_filter != "all":
-            if status_filter == "open":
-                threads_filtered = [t for t in threads_filtered if t.get("status") == "open"]
-            elif status_filter == "escalated":
-                threads_filtered = [t for t in threads_filtered if t.get("status") == "escalated"]
-            elif status_filter == "closed":
-                threads_filtered = [t for t in threads_filtered if t.get("status") == "closed"]
-            elif status_filter == "resolved":
-                threads_filtered = [t for t in threads_filtered if t.get("status") == "resolved"]
-        # Apply pagination after filtering (preserve original logic)
-        total = len(threads_filtered)
-        threads = threads_filtered[offset:offset+limit]
+            threads.append(enriched_ticket)
 
     except ValueError:
-        return jsonify(error="limit and offset must be integers"), 400
+        return jsonify(error="limit and offset must be integers and cursor must be a valid cursor"), 400
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-    # Return exact same format as original
+    # Original format plus the keyset cursor for the next page
     return jsonify(
         total=total,
         limit=limit,
         offset=offset,
-        threads=threads
+        threads=threads,
+        next_cursor=next_cursor
     ), 200
         
 @urls.route('/admin/ai-automation/settings', methods=['GET'])
@@ -353,9 +326,28 @@ def update_ai_automation_settings():
     
     settings.updated_by = agent_id
     db.session.commit()
-    
+
     return jsonify({'success': True})
 
+@urls.route('/admin/llm-cache/stats', methods=['GET'])
+@require_role("MANAGER")
+def get_llm_cache_stats():
+    """LLM response cache hit rates per call site (this worker since start)"""
+    return jsonify(llm_cache.stats()), 200
+
+@urls.route('/admin/openai/stats', methods=['GET'])
+@require_role("MANAGER")
+def get_openai_gateway_stats():
+    """OpenAI gateway queue depth, in-flight calls, outcomes, queue-wait percentiles and rate-limit buckets"""
+    return jsonify(dict(openai_gateway.stats(), rate_limits=openai_rate_limiter.stats(),
+                        prompts=prompt_context.stats())), 200
+
+@urls.route('/admin/smtp/stats', methods=['GET'])
+@require_role("MANAGER")
+def get_smtp_pool_stats():
+    """SMTP connection pool: messages sent, connects/reconnects and idle connections"""
+    return jsonify(smtp_pool.stats()), 200
+
 @urls.route('/admin/ai-automation/actions', methods=['GET'])
 @require_role("MANAGER")
 def get_ai_actions():
@@ -600,20 +592,14 @@ def download_ticket_summary(thread_id):
                     report_lines.append(f"  {line}")
                 report_lines.append("")
         
-        # Generate AI Summary if available
+        # AI summary: the rolling conversation summary, brought up to date with any new messages
         try:
             if messages:
-                chat_content = "\n".join([f"{msg.sender}: {msg.content}" for msg in messages[-10:]])  # Last 10 messages
-                resp = client.chat.completions.create(
-                    model=CHAT_MODEL,
-                    messages=[
-                        {"role": "system", "content": "Create a brief technical summary of this support ticket escalation, focusing on the key issues, actions taken, and current status. Keep it professional and concise."},
-                        {"role": "user", "content": f"Ticket: {ticket.subject}\nCategory: {ticket.category}\nRecent conversation:\n{chat_content}"}
-                    ],
-                    max_tokens=200,
-                    temperature=0.3
-                )
-                ai_summary = resp.choices[0].message.content.strip()
+                # At most one fold in-line; any remaining backlog is folded in the background
+                summary, pending = conversation_summaries.current(thread_id, ticket.subject or "", priority=INTERACTIVE)
+                ai_summary = conversation_summaries.with_backlog_note(summary, pending)
+                if not summary:
+                    raise ValueError("empty conversation summary")
                 
                 report_lines.append("AI TECHNICAL SUMMARY:")
                 report_lines.append("-" * 30)
@@ -783,10 +769,8 @@ def get_thread(thread_id):
     if not _can_view(user.get("role"), t.level or 1):
         return jsonify(error="forbidden"), 403
 
-    # PRESERVE: Update last activity timestamp to now
-    from datetime import datetime, timezone
-    t.updated_at = datetime.now(timezone.utc)
-    db.session.commit()
+    # Views are buffered and flushed to ticket_activity in batches; reads never touch tickets.updated_at
+    ticket_activity.record_view(t.id, user.get("id"))
     
     # PRESERVE: Build ticket response with exact original structure
     ticket = {
@@ -805,26 +789,13 @@ def get_thread(thread_id):
         "text": t.subject or "",  # Use subject as text for UI compatibility
     }
 
-    # PRESERVE: OpenAI summary generation with exact original logic
-    ticket_text = ticket["text"] or ticket["subject"] or ""
-    summary = ""
-    if ticket_text:
-        try:
-            resp = client.chat.completions.create(
-                model=CHAT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Summarize the following support ticket in 1-2 sentences."},
-                    {"role": "user", "content": ticket_text}
-                ],
-                max_tokens=60, temperature=0.5
-            )
-            summary = resp.choices[0].message.content.strip()
-        except Exception as e:
-            summary = ticket_text
+    # Summary is served from the ticket summary store; a stale version is
+    # regenerated in the background instead of calling OpenAI on every GET
+    raw_messages = get_messages(thread_id)
+    summary = ticket_summaries.get_summary(t, raw_messages)
     ticket["summary"] = summary
 
     # PRESERVE: Messages with special summary message structure
-    raw_messages = get_messages(thread_id)
     summary_msg = {
         "id": "ticket-summary", "sender": "bot",
         "content": summary, "timestamp": ticket.get("created_at") or datetime.utcnow().isoformat()
@@ -843,6 +814,26 @@ def get_thread(thread_id):
     return jsonify(ticket), 200
 
 
+@urls.route("/threads/<thread_id>/state", methods=["GET"])
+@require_role("L1","L2","L3","MANAGER")
+def get_thread_state(thread_id):
+    """Compact status/level/version view for pollers; answers 304 when the ETag still matches"""
+    row = (db.session.query(Ticket.status, Ticket.level, Ticket.version)
+           .filter(Ticket.id == thread_id)
+           .first())
+    if not row:
+        return jsonify(error="not found"), 404
+
+    user = getattr(request, "agent_ctx", {}) or {}
+    if not _can_view(user.get("role"), row.level or 1):
+        return jsonify(error="forbidden"), 403
+
+    resp = jsonify(id=thread_id, status=row.status, level=row.level, version=row.version or 1)
+    resp.set_etag(f"{thread_id}-v{row.version or 1}")
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
 
 
 # @urls.route("/threads/<thread_id>/chat", methods=["POST"])
@@ -1289,24 +1280,26 @@ def get_thread(thread_id):
 #     except Exception as e:
 #         return jsonify(error=f"Failed to process chat: {str(e)}"), 500
 
-def get_relevant_kb_context(query: str, department_id: int = None, max_articles: int = 3) -> str:
-    """Get relevant KB articles as context for OpenAI"""
+def get_relevant_kb_context(query: str, department_id: int = None, max_articles: int = 3, exclude_ticket_id: str = None,
+                            token_budget: int = None) -> str:
+    """
+    Relevant KB articles plus similar past answers as prompt context, packed
+    best-first into `token_budget` tokens (KB_CONTEXT_TOKEN_BUDGET by default)
+    """
     try:
         # Import here to avoid startup issues if KB system has problems
         from kb_loader import get_kb_loader
         loader = get_kb_loader()
         articles = loader.search_relevant_articles(query, department_id, max_articles)
-        
-        if not articles:
-            return ""
-        
-        context_parts = ["## Relevant Company Knowledge Base Articles:"]
-        
-        for i, article in enumerate(articles, 1):
-            context_parts.append(f"\n### KB Article {i}: {article.title}")
-            context_parts.append(f"**Source:** {'Protocol Document' if article.source.value == 'protocol' else 'Previous Solution'}")
-            context_parts.append(f"**Problem:** {article.problem_summary}")
-            
+
+        snippets = []
+        for rank, article in enumerate(articles):
+            is_protocol = article.source.value == 'protocol'
+            parts = [
+                f"{article.title}",
+                f"**Source:** {'Protocol Document' if is_protocol else 'Previous Solution'}",
+                f"**Problem:** {article.problem_summary}",
+            ]
             # Extract key solution points from markdown content
             content = article.content_md or ""
             solution_section = ""
@@ -1314,12 +1307,34 @@ def get_relevant_kb_context(query: str, department_id: int = None, max_articles:
                 solution_section = content.split("## Solution")[1].split("##")[0].strip()
             elif "SOLUTION STEPS:" in content:
                 solution_section = content.split("SOLUTION STEPS:")[1].split("ENVIRONMENT:")[0].strip()
-            
             if solution_section:
-                context_parts.append(f"**Solution Steps:** {solution_section[:800]}...")  # Limit length
-        
-        context_parts.append("\n**Instructions:** Use the above KB articles as reference when generating solutions. Prioritize protocol documents. Adapt steps to the specific user issue.\n")
-        
+                parts.append(f"**Solution Steps:** {solution_section}")
+            # Search order ranks articles; protocol documents are preferred
+            score = 1.0 - 0.1 * rank + (0.2 if is_protocol else 0.0)
+            snippets.append(ContextSnippet("\n".join(parts), score, order=rank, min_tokens=60, payload="kb"))
+
+        for j, a in enumerate(_similar_answers(query, exclude_ticket_id=exclude_ticket_id)):
+            snippets.append(ContextSnippet(f"- (Ticket {a['ticket_id']}) {a['chunk']}", 0.8 * a["similarity"],
+                                           order=len(articles) + j, min_tokens=40, payload="answer"))
+        if not snippets:
+            return ""
+
+        chosen, stats = prompt_context.pack(snippets, token_budget or KB_CONTEXT_TOKEN_BUDGET)
+        current_app.logger.debug(f"KB context: {stats}")
+
+        context_parts = []
+        kb = [s for s in chosen if s.payload == "kb"]
+        if kb:
+            context_parts.append("## Relevant Company Knowledge Base Articles:")
+            for i, snippet in enumerate(kb, 1):
+                context_parts.append(f"\n### KB Article {i}: {snippet.text}")
+            context_parts.append("\n**Instructions:** Use the above KB articles as reference when generating solutions. Prioritize protocol documents. Adapt steps to the specific user issue.\n")
+        answers = [s for s in chosen if s.payload == "answer"]
+        if answers:
+            context_parts.append("## Similar Past Ticket Answers:")
+            context_parts.extend(s.text for s in answers)
+            context_parts.append("")
+
         return "\n".join(context_parts)
         
     except Exception as e:
@@ -1327,10 +1342,115 @@ def get_relevant_kb_context(query: str, department_id: int = None, max_articles:
         return ""
 
 
+def _similar_answers(query: str, max_answers: int = 2, exclude_ticket_id: str = None) -> list:
+    """Similar past ticket answers from the FAISS answer index; empty on any failure"""
+    try:
+        return answer_retrieval.similar_answers(
+            query, k=max_answers, min_similarity=KB_SEARCH_MIN_SIMILARITY, exclude_ticket_id=exclude_ticket_id
+        )
+    except Exception as e:
+        current_app.logger.warning(f"Similar-answer lookup failed: {e}")
+        return []
+
+
+# Most recent client-supplied turns considered for post_chat; the prompt budget decides how many are sent
+CHAT_HISTORY_CANDIDATES = 20
+
+
+def _conversation_context(ticket_id: str, subject: str = "") -> str:
+    """
+    System-prompt section with the ticket's rolling conversation summary, so
+    turns that fall outside the chat history window are not lost. Queues a
+    background fold when enough new messages have piled up; never blocks.
+    """
+    try:
+        summary, _ = conversation_summaries.summary_and_pending(ticket_id)
+        conversation_summaries.schedule_refresh(ticket_id, subject)
+    except Exception as e:
+        current_app.logger.warning(f"Conversation summary unavailable for ticket {ticket_id}: {e}")
+        return ""
+    return f"## Conversation so far\n{summary}" if summary else ""
+
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(events):
+    resp = current_app.response_class(stream_with_context(events), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # don't let a reverse proxy buffer the stream
+    return resp
+
+
+def _chat_completion_reply(messages, params, finalize, fallback, stream, visible=None):
+    """
+    Run one chat completion for post_chat. `finalize(raw)` persists the reply
+    and returns the JSON payload; `fallback(exc)` supplies raw text on error.
+    When streaming, tokens go out as `delta` events and the payload as `done`;
+    `visible(token)` maps raw tokens to the text clients should see (e.g. only
+    the reply field of a JSON answer).
+    """
+    if not stream:
+        try:
+            resp = client.chat.completions.create(model=CHAT_MODEL, messages=messages, priority=INTERACTIVE, **params)
+            raw = (resp.choices[0].message.content or "").strip() if resp.choices else ""
+        except Exception as e:
+            current_app.logger.error(f"OpenAI error: {e!r}")
+            raw = fallback(e)
+        return jsonify(finalize(raw)), 200
+
+    def events():
+        parts = []
+        try:
+            for chunk in client.chat.completions.create(model=CHAT_MODEL, messages=messages, stream=True,
+                                                        priority=INTERACTIVE, **params):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    shown = visible(delta) if visible else delta
+                    if shown:
+                        yield _sse_event("delta", {"text": shown})
+            raw = "".join(parts).strip()
+        except GeneratorExit:
+            # Client went away mid-stream: keep what was generated so the thread history is complete
+            if parts:
+                finalize("".join(parts).strip())
+            raise
+        except Exception as e:
+            current_app.logger.error(f"OpenAI stream error: {e!r}")
+            raw = fallback(e)
+        yield _sse_event("done", finalize(raw))
+
+    return _sse_response(events())
+
+
 @urls.route("/threads/<thread_id>/chat", methods=["POST"])
 @require_role("L1","L2","L3","MANAGER")
 def post_chat(thread_id):
     """CORRECTED: Clean chat logic without duplicates or message duplication"""
+    return _handle_chat(thread_id, stream=False)
+
+
+@urls.route("/threads/<thread_id>/chat/stream", methods=["POST"])
+@require_role("L1","L2","L3","MANAGER")
+def post_chat_stream(thread_id):
+    """
+    Same request body and branches as post_chat, answered as Server-Sent Events.
+    Model replies arrive as `delta` events ({"text"}: user-facing reply text,
+    never raw model JSON) followed by one `done` event carrying the payload
+    post_chat would return, which is authoritative; replies that need no model
+    call are sent as a single `done` event. Errors stay plain JSON.
+    """
+    return _handle_chat(thread_id, stream=True)
+
+
+def _handle_chat(thread_id, stream):
+    def respond(**payload):
+        if stream:
+            return _sse_response(iter([_sse_event("done", payload)]))
+        return jsonify(**payload), 200
+
     # Load ticket validation
     t = db.session.get(Ticket, thread_id)
     if not t:
@@ -1363,7 +1483,7 @@ def post_chat(thread_id):
         # DON'T save user greeting message - just respond
         reply = "👋 Hello! How can I assist you with your support ticket today?"
         insert_message_with_mentions(thread_id, "assistant", reply)
-        return jsonify(ticketId=thread_id, reply=reply), 200
+        return respond(ticketId=thread_id, reply=reply)
 
     # SAVE USER MESSAGE FIRST (so mentions get stored in database)
     TRIGGER_PHRASES = [
@@ -1384,7 +1504,7 @@ def post_chat(thread_id):
         names = ", ".join(mentions)
         reply = f"🛎 Notified {names}! They'll jump in shortly."
         insert_message_with_mentions(thread_id, "assistant", reply)
-        return jsonify(ticketId=thread_id, reply=reply), 200
+        return respond(ticketId=thread_id, reply=reply)
 
     current_app.logger.info(f"[CHAT] Incoming message for Ticket {thread_id}: {text}")
     msg_lower = text.lower()
@@ -1398,69 +1518,77 @@ def post_chat(thread_id):
         kb_context = ""
         if any(phrase in text.lower() for phrase in ["solution", "fix", "resolve", "troubleshoot", "help"]):
             search_query = f"{subject} {text}"
-            kb_context = get_relevant_kb_context(search_query, t.department_id, max_articles=3)
+            kb_context = get_relevant_kb_context(search_query, t.department_id, max_articles=3, exclude_ticket_id=thread_id)
         
         # Enhanced system message with KB context
         enhanced_system_content = ASSISTANT_STYLE
+        conversation = _conversation_context(thread_id, subject)
+        if conversation:
+            enhanced_system_content += f"\n\n{conversation}"
         if kb_context:
             enhanced_system_content += f"\n\n{kb_context}"
         
         messages = [{"role": "system", "content": enhanced_system_content}]
-        for h in history[-6:]:
+        for h in history[-CHAT_HISTORY_CANDIDATES:]:
             role = "assistant" if (h.get("role") == "assistant") else "user"
             content = str(h.get("content") or "")
             messages.append({"role": role, "content": content})
         messages.append({"role": "user", "content": user_instruction})
+        # Keep the most relevant/recent turns that fit the model's prompt budget
+        messages = prompt_context.fit_messages("chat.suggested", messages, query=f"{subject} {text}", completion_tokens=600)
 
-        try:
-            resp = client.chat.completions.create(
-                model=CHAT_MODEL, messages=messages, temperature=0.25, max_tokens=600
-            )
-            raw = resp.choices[0].message.content.strip() if resp.choices and resp.choices[0].message.content else ""
-        except Exception as e:
-            current_app.logger.error(f"GPT error: {e!r}")
-            raw = '{"reply":"(fallback) Could not get response: %s","type":"chat"}' % e
-
-        try:
-            parsed = extract_json(raw)
-        except Exception:
-            parsed = {"reply": raw, "type": "chat"}
-
-        reply_text = (parsed.get("reply") or "").strip()
-        reply_type = (parsed.get("type") or "chat").strip()
-        next_actions = parsed.get("next_actions") if isinstance(parsed.get("next_actions"), list) else []
-
-        # Solution handling
-        if reply_type == "solution" or text.strip().lower() in TRIGGER_PHRASES:
-            solution_text = reply_type == "solution" and reply_text or (reply_text or parsed.get("text") or "(No solution generated)")
-            from db_helpers import create_solution
-            sol = create_solution(thread_id, solution_text, proposed_by=user.get("name"))
-            insert_message_with_mentions(thread_id, "assistant", {
-                "type": "solution", "text": solution_text, "askToSend": True, "next_actions": next_actions
-            })
-            return jsonify(ticketId=thread_id, type="solution", text=solution_text, askToSend=True, next_actions=next_actions, solution_id=sol.id), 200
-
-        # Clarifying questions formatting
-        if text.strip().lower().startswith("ask me 3 clarifying questions"):
-            import json
+        def finalize_suggested(raw):
             try:
-                questions = json.loads(reply_text)
-                if isinstance(questions, list):
-                    reply_text = "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions))
+                parsed = extract_json(raw)
             except Exception:
-                pass
+                parsed = {"reply": raw, "type": "chat"}
+
+            reply_text = (parsed.get("reply") or "").strip()
+            reply_type = (parsed.get("type") or "chat").strip()
+            next_actions = parsed.get("next_actions") if isinstance(parsed.get("next_actions"), list) else []
+
+            # Solution handling
+            if reply_type == "solution" or text.strip().lower() in TRIGGER_PHRASES:
+                solution_text = reply_type == "solution" and reply_text or (reply_text or parsed.get("text") or "(No solution generated)")
+                from db_helpers import create_solution
+                sol = create_solution(thread_id, solution_text, proposed_by=user.get("name"))
+                insert_message_with_mentions(thread_id, "assistant", {
+                    "type": "solution", "text": solution_text, "askToSend": True, "next_actions": next_actions
+                })
+                return dict(ticketId=thread_id, type="solution", text=solution_text, askToSend=True, next_actions=next_actions, solution_id=sol.id)
 
-        # Insert response
-        if not user_msg_inserted and source == "user":
-            insert_message_with_mentions(thread_id, "user", text)
-        insert_message_with_mentions(thread_id, "assistant", reply_text)
-        return jsonify(ticketId=thread_id, reply=reply_text, next_actions=next_actions), 200
+            # Clarifying questions formatting
+            if text.strip().lower().startswith("ask me 3 clarifying questions"):
+                try:
+                    questions = json.loads(reply_text)
+                    if isinstance(questions, list):
+                        reply_text = "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions))
+                except Exception:
+                    pass
+
+            # Insert response
+            if not user_msg_inserted and source == "user":
+                insert_message_with_mentions(thread_id, "user", text)
+            insert_message_with_mentions(thread_id, "assistant", reply_text)
+            return dict(ticketId=thread_id, reply=reply_text, next_actions=next_actions)
+
+        # Stream only the reply text out of the model's JSON; clarifying questions are
+        # reformatted in finalize_suggested, so they arrive with the `done` event only
+        if text.strip().lower().startswith("ask me 3 clarifying questions"):
+            visible = lambda delta: ""
+        else:
+            visible = JsonReplyStream().feed
+        return _chat_completion_reply(
+            messages, {"temperature": 0.25, "max_tokens": 600}, finalize_suggested,
+            lambda e: '{"reply":"(fallback) Could not get response: %s","type":"chat"}' % e,
+            stream, visible,
+        )
 
     # STEP-BY-STEP MODE
     if "step-by-step" in msg_lower or "step by step" in msg_lower:
         # ENHANCE: Add KB context for step-by-step solutions
         search_query = f"{subject} {text}"
-        kb_context = get_relevant_kb_context(search_query, t.department_id, max_articles=2)
+        kb_context = get_relevant_kb_context(search_query, t.department_id, max_articles=2, exclude_ticket_id=thread_id)
         
         step_prompt = (
             "Please break your solution into 3 concise, numbered steps "
@@ -1470,22 +1598,26 @@ def post_chat(thread_id):
         
         # Enhanced system message with KB context
         system_content = "You are a helpful IT support assistant."
+        conversation = _conversation_context(thread_id, subject)
+        if conversation:
+            system_content += f"\n\n{conversation}"
         if kb_context:
             system_content += f"\n\n{kb_context}"
         
         try:
             resp = client.chat.completions.create(
                 model=CHAT_MODEL,
-                messages=[{"role": "system", "content": system_content},
-                          {"role": "user", "content": step_prompt}],
-                temperature=0.2
+                messages=prompt_context.fit_messages("chat.steps", [{"role": "system", "content": system_content},
+                                                                    {"role": "user", "content": step_prompt}]),
+                temperature=0.2,
+                priority=INTERACTIVE
             )
             raw = resp.choices[0].message.content if resp.choices and resp.choices[0].message.content else None
         except Exception as e:
             current_app.logger.error(f"OpenAI step-gen error: {e!r}")
             fallback = f"(fallback) Could not reach OpenAI: {e}"
             insert_message_with_mentions(thread_id, "assistant", fallback)
-            return jsonify(ticketId=thread_id, reply=fallback), 200
+            return respond(ticketId=thread_id, reply=fallback)
 
         try:
             parsed_json = extract_json(raw) if raw else None
@@ -1494,17 +1626,17 @@ def post_chat(thread_id):
             current_app.logger.error(f"JSON parse error: {e!r} — raw: {raw!r}")
             fallback = f"(fallback) Could not parse steps: {e}"
             insert_message_with_mentions(thread_id, "assistant", fallback)
-            return jsonify(ticketId=thread_id, reply=fallback), 200
+            return respond(ticketId=thread_id, reply=fallback)
 
         if not steps or not isinstance(steps, list):
             fallback = "(fallback) No steps generated."
             insert_message_with_mentions(thread_id, "assistant", fallback)
-            return jsonify(ticketId=thread_id, reply=fallback), 200
+            return respond(ticketId=thread_id, reply=fallback)
 
         save_steps(thread_id, steps)
         first = steps[0]
         insert_message_with_mentions(thread_id, "assistant", first)
-        return jsonify(ticketId=thread_id, reply=first, step=1, total=len(steps)), 200
+        return respond(ticketId=thread_id, reply=first, step=1, total=len(steps))
 
       # DEFAULT: General chat assistance with actual OpenAI
         # DEFAULT: General chat assistance with escalation detection + OpenAI
@@ -1556,34 +1688,40 @@ def post_chat(thread_id):
             
             escalation_msg = f"🚀 Ticket escalated to L{target_level} support as requested."
             insert_message_with_mentions(thread_id, "assistant", escalation_msg)
-            return jsonify(ticketId=thread_id, reply=escalation_msg), 200
+            return respond(ticketId=thread_id, reply=escalation_msg)
         
         # Add KB context for better responses
         search_query = f"{subject} {text}"
-        kb_context = get_relevant_kb_context(search_query, t.department_id, max_articles=2)
+        kb_context = get_relevant_kb_context(search_query, t.department_id, max_articles=2, exclude_ticket_id=thread_id)
         
         # Enhanced system message with KB context
         system_content = ASSISTANT_STYLE
+        conversation = _conversation_context(thread_id, subject)
+        if conversation:
+            system_content += f"\n\n{conversation}"
         if kb_context:
             system_content += f"\n\n{kb_context}"
         
-        resp = client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": f"Ticket #{thread_id}: {subject}\nUser question: {text}"}
-            ],
-            temperature=0.3,
-            max_tokens=300
-        )
-        response_text = resp.choices[0].message.content.strip()
-        
+        messages = prompt_context.fit_messages("chat.default", [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": f"Ticket #{thread_id}: {subject}\nUser question: {text}"}
+        ], completion_tokens=300)
     except Exception as e:
         current_app.logger.error(f"OpenAI error: {e}")
-        response_text = "I understand you need assistance. Let me help you with that. If you need this escalated to a higher level, just let me know!"
-        
-    insert_message_with_mentions(thread_id, "assistant", response_text)
-    return jsonify(ticketId=thread_id, reply=response_text), 200
+        messages = None
+
+    fallback_text = "I understand you need assistance. Let me help you with that. If you need this escalated to a higher level, just let me know!"
+    if messages is None:
+        insert_message_with_mentions(thread_id, "assistant", fallback_text)
+        return respond(ticketId=thread_id, reply=fallback_text)
+
+    def finalize_chat(response_text):
+        insert_message_with_mentions(thread_id, "assistant", response_text)
+        return dict(ticketId=thread_id, reply=response_text)
+
+    return _chat_completion_reply(
+        messages, {"temperature": 0.3, "max_tokens": 300}, finalize_chat, lambda e: fallback_text, stream
+    )
 
     # # DEFAULT: General chat assistance with escalation detection
     # try:
@@ -1789,6 +1927,16 @@ def escalate_ticket(thread_id):
     if old_level >= to_level and current_agent_role != "MANAGER":
         return jsonify(error=f"Ticket already at level {old_level} or higher"), 400
     
+    # Hand the next level the conversation so far; folds at most one batch so escalation stays quick
+    # and says how much is not covered yet (runs before the ticket is touched: refresh commits its own row)
+    try:
+        summary_text, pending = conversation_summaries.current(thread_id, ticket.subject or "")
+        conversation_note = conversation_summaries.with_backlog_note(summary_text, pending) or None
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Could not refresh conversation summary for ticket {thread_id}: {e}")
+        conversation_note = None
+
     # Update ticket
     old_status = ticket.status
     ticket.level = to_level
@@ -1840,7 +1988,8 @@ def escalate_ticket(thread_id):
             escalated_by_agent_id=current_agent_id,
             reason=escalation_reason,
             from_level=old_level,
-            to_level=to_level
+            to_level=to_level,
+            summary_note=conversation_note
         )
         db.session.add(summary)
         db.session.commit()
@@ -2256,16 +2405,17 @@ def summarize():
     text = (data.get("text") or "").strip()
     if not text:
         return jsonify(summary=""), 400
-    resp = client.chat.completions.create(
-        model=CHAT_MODEL,
+    summary = llm_cache.chat(
+        "summarize", client, CHAT_MODEL,
         messages=[
             {"role":"system","content":"Summarize the following support ticket in 1-2 sentences."},
             {"role":"user","content": text}
         ],
         max_tokens=60,
-        temperature=0.5
+        temperature=0.5,
+        priority=INTERACTIVE
     )
-    return jsonify(summary=resp.choices[0].message.content.strip()), 200
+    return jsonify(summary=summary.strip()), 200
 
 
 # Endpoint: Get all messages mentioning a specific agent
@@ -3496,117 +3646,189 @@ def suggested_prompts(thread_id):
 
 @urls.route('/threads/<thread_id>/related-tickets', methods=['GET'])
 def related_tickets(thread_id):
-    """PRESERVE ORIGINAL DESIGN - Embedding-based similarity from database"""
+    """Embedding-based similarity over the persisted ticket embedding index"""
     try:
         # Get current ticket from database
         current_ticket = db.session.get(Ticket, thread_id)
         if not current_ticket:
             return jsonify(tickets=[])
-            
-        # PRESERVE: Use ticket subject as text for embeddings
-        ticket_text = current_ticket.subject or ""
-        
-        # PRESERVE: OpenAI embedding generation (exact original logic)
-        emb_resp = client.embeddings.create(
-            model=EMB_MODEL,
-            input=[ticket_text]
-        )
-        query_emb = emb_resp.data[0].embedding
-        
-        # PRESERVE: Get all other tickets from database
-        all_tickets = Ticket.query.filter(Ticket.id != thread_id).all()
-        all_texts = [t.subject or "" for t in all_tickets]
-        
-        # PRESERVE: Batch embedding generation
-        emb_resp_all = client.embeddings.create(
-            model=EMB_MODEL,
-            input=all_texts
-        )
-        all_embs = [e.embedding for e in emb_resp_all.data]
-        
-        # PRESERVE: Cosine similarity calculation (exact original logic)
-        import numpy as np
-        query_vec = np.array(query_emb)
-        all_vecs = np.array(all_embs)
-        
-        def cosine_sim(a, b):
-            return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-        
-        sims = [cosine_sim(query_vec, v) for v in all_vecs]
-        
-        # PRESERVE: Top 5 results with exact original structure
-        idxs = np.argsort(sims)[::-1]
+
+        # Top 5 by cosine similarity of subject embeddings; only embeds the current
+        # ticket if its subject has no stored vector yet
+        with openai_rate_limiter.priority(INTERACTIVE):
+            matches = ticket_embeddings.related(current_ticket, k=5)
+        tickets_by_id = {t.id: t for t in Ticket.query.filter(Ticket.id.in_([tid for tid, _ in matches]))} if matches else {}
+
         related = []
-        for idx in idxs:
-            ticket = all_tickets[idx]
+        for ticket_id, similarity in matches:
+            ticket = tickets_by_id.get(ticket_id)
+            if not ticket:
+                # Deleted since it was indexed
+                ticket_embeddings.remove(ticket_id)
+                continue
             related.append({
                 "id": str(ticket.id),
                 "title": ticket.subject or "",
                 "text": ticket.subject or "",
                 "summary": ticket.subject or "",  # Could enhance with real summary
                 "resolution": "",  # Could enhance with real resolution
-                "similarity": float(sims[idx])
+                "similarity": similarity
             })
-            if len(related) >= 5:
-                break
                 
     except Exception as e:
+        current_app.logger.error(f"related-tickets failed for {thread_id}: {e}")
         related = []
         
     return jsonify(tickets=related)
 
 
-def _claim_pending_ids(limit=25):
+# PENDING rows that are due, plus SENDING rows whose worker died before finishing the batch
+_CLAIMABLE_EMAILS = ("((status='PENDING' AND (next_attempt_at IS NULL OR next_attempt_at <= :now))"
+                     " OR (status='SENDING' AND (lease_expires_at IS NULL OR lease_expires_at < :now)))")
+
+
+def _claim_pending_ids(limit=EMAIL_CLAIM_BATCH_SIZE):
     """
-    Atomically claim up to `limit` pending emails by setting status=PENDING -> SENDING.
-    Returns the list of claimed ids. Safe even if multiple workers run.
+    Claim up to `limit` queued emails with one UPDATE: status -> SENDING, a lease
+    of EMAIL_LEASE_SECONDS and a fresh claim token. Returns (claim_token, ids).
+    Safe with several workers: MySQL skips rows another worker has locked,
+    SQLite serialises the claiming UPDATE.
     """
-    ids = []
-    # Grab a snapshot of candidates
-    candidates = (EmailQueue.query
-                  .filter_by(status='PENDING')
-                  .order_by(EmailQueue.created_at.asc())
-                  .limit(limit)
-                  .all())
-    for row in candidates:
-        # Atomic claim: only succeed if it's still PENDING
-        res = db.session.execute(_sql_text("""
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    params = {"now": now, "lease": now + timedelta(seconds=EMAIL_LEASE_SECONDS), "token": token, "limit": limit}
+    if db.engine.dialect.name == "mysql":
+        ids = [r[0] for r in db.session.execute(_sql_text(f"""
+            SELECT id FROM email_queue
+            WHERE {_CLAIMABLE_EMAILS}
+            ORDER BY created_at ASC
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        """), params)]
+        if ids:
+            db.session.execute(_sql_text("""
+                UPDATE email_queue
+                SET status='SENDING', claim_token=:token, lease_expires_at=:lease
+                WHERE id IN :ids
+            """).bindparams(bindparam("ids", expanding=True)), dict(params, ids=ids))
+    else:
+        db.session.execute(_sql_text(f"""
             UPDATE email_queue
-            SET status='SENDING'
-            WHERE id=:id AND status='PENDING'
-        """), {"id": row.id})
-        if res.rowcount:  # we won the claim
-            ids.append(row.id)
+            SET status='SENDING', claim_token=:token, lease_expires_at=:lease
+            WHERE id IN (SELECT id FROM email_queue WHERE {_CLAIMABLE_EMAILS} ORDER BY created_at ASC LIMIT :limit)
+        """), params)
+        ids = [r[0] for r in db.session.execute(_sql_text("SELECT id FROM email_queue WHERE claim_token=:token"), params)]
+    db.session.commit()
+    return token, ids
+
+def _finish_email_batch(token, results):
+    """
+    Write a batch's outcomes and EMAIL_SENT events in one commit. Rows are only
+    updated while this batch still holds the claim, so a batch that outlived
+    its lease cannot overwrite the worker that reclaimed them.
+    """
+    if not results:
+        return
+    update = _sql_text("""
+        UPDATE email_queue
+        SET status=:status, sent_at=:sent_at, error=:error, attempts=:attempts, next_attempt_at=:next_attempt_at,
+            claim_token=NULL, lease_expires_at=NULL
+        WHERE id=:id AND claim_token=:token
+    """)
+    for r in results:
+        owned = db.session.execute(update, dict(r["row"], token=token)).rowcount > 0
+        # Only log sends for rows this batch still owned; a reclaimed row belongs to another worker now
+        if owned and r.get("event") and r.get("ticket_id"):
+            add_event(r["ticket_id"], 'EMAIL_SENT', **r["event"])
     db.session.commit()
-    return ids
 
-def email_worker_loop(app, poll_seconds: int = 5):
+def _retry_delay(attempts):
+    """Exponential backoff with jitter: a random delay in [d/2, d], d = base * 2^(attempts-1), capped"""
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+def _email_domain(address):
+    return (address or "").rsplit("@", 1)[-1].strip().lower()
+
+def _interleave_by_domain(jobs):
+    """Round-robin jobs across recipient domains so one busy domain can't occupy every sender thread"""
+    by_domain = {}
+    for job in jobs:
+        by_domain.setdefault(_email_domain(job["to_email"]), []).append(job)
+    queues = list(by_domain.values())
+    ordered = []
+    while queues:
+        ordered.extend(q.pop(0) for q in queues)
+        queues = [q for q in queues if q]
+    return ordered
+
+def _send_email_job(job, domain_slot):
+    """Runs on a sender thread: SMTP only, no database access"""
+    with domain_slot:
+        try:
+            send_via_gmail(job["to_email"], job["subject"], job["body"], cc_list=job["cc"])
+            return job, None
+        except Exception as e:
+            return job, e
+
+def _email_result(job, error):
+    attempts = job["attempts"] + 1
+    row = {"id": job["id"], "attempts": attempts, "sent_at": None, "next_attempt_at": None, "error": None}
+    if error is None:
+        row.update(status='SENT', sent_at=datetime.utcnow().isoformat())
+        return {"row": row, "ticket_id": job["ticket_id"],
+                "event": {"subject": job["subject"], "manual": False, "to": job["to_email"], "cc": job["cc"]}}
+    row["error"] = str(error)
+    if is_transient_error(error) and attempts < EMAIL_MAX_ATTEMPTS:
+        row.update(status='PENDING', next_attempt_at=datetime.utcnow() + timedelta(seconds=_retry_delay(attempts)))
+    else:
+        row["status"] = 'FAILED'
+    return {"row": row}
+
+def _seconds_until_next_retry(limit):
+    """Time until the earliest scheduled retry is due, capped at `limit`"""
+    due = db.session.query(func.min(EmailQueue.next_attempt_at)).filter(EmailQueue.status == 'PENDING').scalar()
+    if due is None:
+        return limit
+    if isinstance(due, str):  # SQLite hands back the stored text
+        due = datetime.fromisoformat(due)
+    return min(limit, max(0.0, (due - datetime.utcnow()).total_seconds()))
+
+def email_worker_loop(app, poll_seconds: float = EMAIL_POLL_FALLBACK_SECONDS):
+    senders = ThreadPoolExecutor(max_workers=EMAIL_SEND_CONCURRENCY, thread_name_prefix="email-send")
+    domain_slots = defaultdict(lambda: threading.BoundedSemaphore(EMAIL_DOMAIN_CONCURRENCY))
+    email_wakeup.listen()
     with app.app_context():
         while True:
-            claimed = _claim_pending_ids(limit=25)
-            if not claimed:
-                sleep(poll_seconds)
-                continue
-
-            rows = EmailQueue.query.filter(EmailQueue.id.in_(claimed)).all()
-            for item in rows:
-                try:
-                    cc_list = json.loads(item.cc or "[]")
-                    send_via_gmail(item.to_email, item.subject, item.body, cc_list=cc_list)
-                    item.status = 'SENT'
-                    item.sent_at = datetime.utcnow().isoformat()
-                    item.error = None
-                    db.session.commit()
-                    log_event(item.ticket_id, 'EMAIL_SENT', {
-                        "subject": item.subject, "manual": False,
-                        "to": item.to_email, "cc": cc_list
-                    })
-                except Exception as e:
-                    item.status = 'FAILED'
-                    item.error = str(e)
-                    db.session.commit()
-            # small breather between batches
-            sleep(1)
+            try:
+                _email_worker_step(senders, domain_slots, poll_seconds)
+            except Exception as e:
+                # Keep the worker alive; claimed rows are picked up again once their lease expires
+                db.session.rollback()
+                current_app.logger.error(f"email worker iteration failed: {e!r}")
+                sleep(min(poll_seconds, 5))
+
+def _email_worker_step(senders, domain_slots, poll_seconds):
+    """Claim one batch, send it and record the outcomes; waits for work when the queue is empty"""
+    token, claimed = _claim_pending_ids()
+    if not claimed:
+        # Queue drained: log out rather than hold idle SMTP sessions open
+        smtp_pool.close_idle()
+        # Sleep until an enqueue signals us or the next retry falls due; polling is only the fallback
+        wait = _seconds_until_next_retry(poll_seconds)
+        db.session.commit()  # don't hold a read transaction open while idle
+        email_wakeup.wait(wait)
+        return
+
+    # Detach plain values so sender threads never touch the session
+    jobs = [{
+        "id": item.id, "ticket_id": item.ticket_id, "to_email": item.to_email,
+        "subject": item.subject, "body": item.body, "cc": json.loads(item.cc or "[]"),
+        "attempts": item.attempts or 0,
+    } for item in EmailQueue.query.filter(EmailQueue.id.in_(claimed)).all()]
+    futures = [senders.submit(_send_email_job, job, domain_slots[_email_domain(job["to_email"])])
+               for job in _interleave_by_domain(jobs)]
+    _finish_email_batch(token, [_email_result(*f.result()) for f in futures])
 
 
 
@@ -3633,7 +3855,8 @@ def emails_preview():
 def emails_pending():
     rows = EmailQueue.query.filter_by(status='PENDING').order_by(EmailQueue.created_at.asc()).all()
     return jsonify([{
-        "id": r.id, "ticket_id": r.ticket_id, "to": r.to_email, "subject": r.subject, "created_at": r.created_at
+        "id": r.id, "ticket_id": r.ticket_id, "to": r.to_email, "subject": r.subject, "created_at": r.created_at,
+        "attempts": r.attempts, "next_attempt_at": r.next_attempt_at
     } for r in rows])
 
 @urls.route("/emails/failed", methods=["GET"])
@@ -3641,7 +3864,8 @@ def emails_pending():
 def emails_failed():
     rows = EmailQueue.query.filter_by(status='FAILED').order_by(EmailQueue.created_at.asc()).all()
     return jsonify([{
-        "id": r.id, "ticket_id": r.ticket_id, "to": r.to_email, "subject": r.subject, "error": r.error
+        "id": r.id, "ticket_id": r.ticket_id, "to": r.to_email, "subject": r.subject, "error": r.error,
+        "attempts": r.attempts
     } for r in rows])
 
 @urls.route("/emails/retry/<int:qid>", methods=["POST"])
@@ -3651,7 +3875,14 @@ def emails_retry(qid):
     if not row: return jsonify(error="not found"), 404
     row.status = 'PENDING'
     row.error = None
-    db.session.commit()
+    row.attempts = 0
+    row.next_attempt_at = None
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(error="an identical email is already queued"), 409
+    email_wakeup.notify()
     return jsonify(ok=True)
 
 @urls.route("/threads/<thread_id>/department", methods=["PATCH"])
@@ -3851,12 +4082,11 @@ def auto_assign_departments():
         if not dep and 'faiss' in globals():
             try:
                 # Use FAISS to find the closest department by embedding
-                emb_resp = client.embeddings.create(model=EMB_MODEL, input=[desc])
-                query_emb = emb_resp.data[0].embedding
-                # Build department embeddings
+                from services.embedding_service import embeddings
+                query_emb = embeddings.embed_one(desc, EMB_MODEL)
+                # Build department embeddings (cached by the embedding client after the first ticket)
                 dept_names = [d.name for d in Department.query.all()]
-                dept_emb_resp = client.embeddings.create(model=EMB_MODEL, input=dept_names)
-                dept_embs = [e.embedding for e in dept_emb_resp.data]
+                dept_embs = embeddings.embed(dept_names, EMB_MODEL)
                 import numpy as np
                 sims = [np.dot(query_emb, v) / (np.linalg.norm(query_emb) * np.linalg.norm(v)) for v in dept_embs]
                 best_idx = int(np.argmax(sims))
@@ -4582,6 +4812,24 @@ def confirm_solution():
     return redirect(CONFIRM_REDIRECT_URL_SUCCESS if is_confirm else CONFIRM_REDIRECT_URL_REJECT)
 
 
+def _refresh_kb_indexes(article):
+    """
+    Bring the KB search indexes up to date for one changed article: store its
+    embedding (published articles only) and apply it to the BM25 index.
+    Failures only log; the indexes self-heal on the next backfill/resync.
+    """
+    if article.status == KBArticleStatus.published:
+        try:
+            kb_embeddings.embed_articles([article])
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Could not embed KB article {article.id}: {e}")
+    try:
+        kb_bm25.update_articles([article])
+    except Exception as e:
+        current_app.logger.warning(f"Could not update BM25 index for KB article {article.id}: {e}")
+
+
 # A route to promote a solution to a Knowledge Base (KB) article.
 @urls.route("/solutions/<solution_id>/promote", methods=["POST"])
 @require_role("L1", "L2", "L3", "MANAGER")
@@ -4620,6 +4868,7 @@ def promote_solution_to_kb(solution_id):
             solution.status = 'promoted'
     
     db.session.commit()
+    _refresh_kb_indexes(kb_article)
 
     # Do NOT email the customer when publishing a KB article
     return jsonify(message="Solution successfully promoted to KB article", article_id=kb_article.id), 200
@@ -4714,7 +4963,7 @@ def get_solutions():
     ]
     return jsonify(results)
 
-# GET /kb/articles?status=...&limit=... for kb dashboard 
+# GET /kb/articles?status=...&limit=...&cursor=... for kb dashboard 
 @urls.route('/kb/articles', methods=['GET'])
 @require_role("L1", "L2", "L3", "MANAGER")
 def get_kb_articles():
@@ -4724,6 +4973,7 @@ def get_kb_articles():
         status = request.args.get('status')
         source = request.args.get('source')
         limit = int(request.args.get('limit', 50))
+        cursor = request.args.get('cursor')
         q = KBArticle.query
         if status:
             status_list = [s.strip() for s in status.split(',')]
@@ -4735,7 +4985,8 @@ def get_kb_articles():
             except Exception as e:
                 current_app.logger.warning(f"Could not filter by source: {e}")
         
-        real_articles = q.order_by(KBArticle.id.asc()).limit(limit).all()
+        # Keyset page; the next cursor goes in a header so the response stays a bare list
+        real_articles, next_cursor = keyset_page(q, KBArticle, limit, cursor=cursor)
         results = [
             {
                 'id': a.id,
@@ -4807,9 +5058,16 @@ def get_kb_articles():
                 'created_at': '2024-01-10T09:30:00Z',
             }
         ]
-        results.extend(demo_data)
+        if not cursor:
+            results.extend(demo_data)
         
-        return jsonify(results)
+        resp = jsonify(results)
+        if next_cursor:
+            resp.headers['X-Next-Cursor'] = next_cursor
+        return resp
+
+    except ValueError:
+        return jsonify({"error": "limit must be an integer and cursor must be a valid cursor"}), 400
         
     except Exception as e:
         # Return demo data if database fails
@@ -5044,15 +5302,31 @@ def search_kb_articles():
     query = data.get('query', '').strip()
     department_id = data.get('department_id')
     limit = data.get('limit', 5)
+    mode = (data.get('mode') or 'semantic').strip().lower()  # semantic | bm25
     
     if not query:
         return jsonify({'error': 'Query is required'}), 400
+    if mode not in ('semantic', 'bm25'):
+        return jsonify({'error': "mode must be 'semantic' or 'bm25'"}), 400
+    if department_id not in (None, ''):
+        try:
+            department_id = int(department_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid department_id'}), 400
+    else:
+        department_id = None
     
     try:
-        # Import here to avoid startup issues
-        from kb_loader import get_kb_loader
-        loader = get_kb_loader()
-        articles = loader.search_relevant_articles(query, department_id, limit)
+        if mode == 'bm25':
+            # Exact keyword match (error codes, product names) from the in-process inverted index
+            hits = kb_bm25.search(query, department_id=department_id, limit=limit)
+            by_id = {a.id: a for a in KBArticle.query.filter(KBArticle.id.in_([i for i, _ in hits]))} if hits else {}
+            articles = [by_id[i] for i, _ in hits if i in by_id]
+        else:
+            # Import here to avoid startup issues
+            from kb_loader import get_kb_loader
+            loader = get_kb_loader()
+            articles = loader.search_relevant_articles(query, department_id, limit)
         
         results = [
             {
@@ -5066,7 +5340,7 @@ def search_kb_articles():
             for a in articles
         ]
         
-        return jsonify({'articles': results}), 200
+        return jsonify({'articles': results, 'mode': mode}), 200
         
     except Exception as e:
         current_app.logger.error(f"KB search failed: {e}")
@@ -5091,6 +5365,7 @@ def archive_kb_article(article_id):
         article.updated_at = datetime.utcnow()
         
         db.session.commit()
+        _refresh_kb_indexes(article)
         
         current_app.logger.info(f"Archived KB article {article_id}: {article.title}")
         
@@ -5129,6 +5404,7 @@ def publish_kb_article(article_id):
             article.approved_by = agent.get('name') or agent.get('email') or agent.get('sub') or 'system'
         
         db.session.commit()
+        _refresh_kb_indexes(article)
         
         current_app.logger.info(f"Published KB article {article_id}: {article.title}")
         
@@ -6012,39 +6288,46 @@ def get_my_dashboard():
         if agent_department_id:
             department = db.session.get(Department, agent_department_id)
         
+        # Page sizes and keyset cursors for the two ticket lists (defaults match the old fixed slices)
+        my_limit = int(request.args.get("limit", 20))
+        my_cursor = request.args.get("cursor")
+        dept_limit = int(request.args.get("dept_limit", 30))
+        dept_cursor = request.args.get("dept_cursor")
+
+        def status_counts(query):
+            """Per-status counts and the overall total, computed in SQL"""
+            counts = {"open": 0, "closed": 0, "escalated": 0, "resolved": 0}
+            total = 0
+            status_col = func.coalesce(Ticket.status, 'open')
+            for status, n in query.order_by(None).with_entities(status_col, func.count(Ticket.id)).group_by(status_col):
+                total += n
+                if status in counts:
+                    counts[status] = n
+            return counts, total
+
+        def message_preview(ticket_id):
+            latest_message = Message.query.filter_by(ticket_id=ticket_id).order_by(Message.timestamp.desc()).first()
+            if not latest_message:
+                return ""
+            content = latest_message.content or ""
+            if isinstance(content, str) and len(content) > 100:
+                return content[:100] + "..."
+            return str(content)
+
+        dept_map = {d.id: d.name for d in Department.query.all()}
+
         # === MY TICKETS (assigned to this agent) ===
         my_tickets_query = Ticket.query.filter_by(assigned_to=agent_id, archived=False)
-        my_tickets = my_tickets_query.all()
+        my_tickets_counts, my_tickets_total = status_counts(my_tickets_query)
+        my_tickets, my_next_cursor = keyset_page(my_tickets_query, Ticket, my_limit, cursor=my_cursor)
         
         # Build my tickets with enriched data
         my_tickets_list = []
-        my_tickets_counts = {"open": 0, "closed": 0, "escalated": 0, "resolved": 0}
-        
         for ticket in my_tickets:
-            # Get department info for ticket
-            ticket_dept = None
-            if ticket.department_id:
-                ticket_dept = db.session.get(Department, ticket.department_id)
-            
-            # Count by status
-            status = ticket.status or 'open'
-            if status in my_tickets_counts:
-                my_tickets_counts[status] += 1
-            
-            # Get latest message preview
-            latest_message = Message.query.filter_by(ticket_id=ticket.id).order_by(Message.timestamp.desc()).first()
-            message_preview = ""
-            if latest_message:
-                content = latest_message.content or ""
-                if isinstance(content, str) and len(content) > 100:
-                    message_preview = content[:100] + "..."
-                else:
-                    message_preview = str(content)
-            
             my_tickets_list.append({
                 "id": ticket.id,
                 "subject": ticket.subject or "No subject",
-                "status": status,
+                "status": ticket.status or 'open',
                 "priority": ticket.priority,
                 "impact_level": ticket.impact_level,
                 "urgency_level": ticket.urgency_level,
@@ -6053,61 +6336,39 @@ def get_my_dashboard():
                 "requester_name": ticket.requester_name,
                 "requester_email": ticket.requester_email,
                 "department": {
-                    "id": ticket_dept.id if ticket_dept else None,
-                    "name": ticket_dept.name if ticket_dept else "Unassigned"
+                    "id": ticket.department_id if ticket.department_id in dept_map else None,
+                    "name": dept_map.get(ticket.department_id, "Unassigned")
                 },
                 "created_at": ticket.created_at.isoformat() if ticket.created_at else None,
                 "updated_at": ticket.updated_at.isoformat() if ticket.updated_at else None,
-                "latest_message_preview": message_preview
+                "latest_message_preview": message_preview(ticket.id)
             })
         
         # === DEPARTMENT TICKETS (all tickets in agent's department OR all tickets for helpdesk) ===
         dept_tickets_list = []
         dept_tickets_counts = {"open": 0, "closed": 0, "escalated": 0, "resolved": 0}
+        dept_tickets_total = 0
+        dept_next_cursor = None
         
         if agent_department_id:
             # Helpdesk (department_id = 7) can see all tickets across all departments
             if agent_department_id == 7:  # Helpdesk department
-                # Query all tickets across all departments
                 dept_tickets_query = Ticket.query.filter_by(archived=False)
-                dept_tickets = dept_tickets_query.all()
-                current_app.logger.info(f"Helpdesk agent {agent_id} viewing all department tickets: {len(dept_tickets)} total")
             else:
                 # Other departments only see their own tickets
                 dept_tickets_query = Ticket.query.filter_by(department_id=agent_department_id, archived=False)
-                dept_tickets = dept_tickets_query.all()
-                current_app.logger.info(f"Department agent {agent_id} viewing department {agent_department_id} tickets: {len(dept_tickets)} total")
+            dept_tickets_counts, dept_tickets_total = status_counts(dept_tickets_query)
+            dept_tickets, dept_next_cursor = keyset_page(dept_tickets_query, Ticket, dept_limit, cursor=dept_cursor)
+            current_app.logger.info(f"Agent {agent_id} (department {agent_department_id}) viewing department tickets: {dept_tickets_total} total")
+
+            agent_ids = {t.assigned_to for t in dept_tickets if t.assigned_to}
+            agent_map = {a.id: a.name for a in Agent.query.filter(Agent.id.in_(agent_ids))} if agent_ids else {}
             
             for ticket in dept_tickets:
-                # Count by status
-                status = ticket.status or 'open'
-                if status in dept_tickets_counts:
-                    dept_tickets_counts[status] += 1
-                
-                # Get assigned agent info
-                assigned_agent = None
-                if ticket.assigned_to:
-                    assigned_agent = db.session.get(Agent, ticket.assigned_to)
-                
-                # Get latest message preview
-                latest_message = Message.query.filter_by(ticket_id=ticket.id).order_by(Message.timestamp.desc()).first()
-                message_preview = ""
-                if latest_message:
-                    content = latest_message.content or ""
-                    if isinstance(content, str) and len(content) > 100:
-                        message_preview = content[:100] + "..."
-                    else:
-                        message_preview = str(content)
-                
-                # Get ticket department info (especially important for helpdesk viewing all departments)
-                ticket_dept = None
-                if ticket.department_id:
-                    ticket_dept = db.session.get(Department, ticket.department_id)
-                
                 dept_tickets_list.append({
                     "id": ticket.id,
                     "subject": ticket.subject or "No subject",
-                    "status": status,
+                    "status": ticket.status or 'open',
                     "priority": ticket.priority,
                     "impact_level": ticket.impact_level,
                     "urgency_level": ticket.urgency_level,
@@ -6116,16 +6377,16 @@ def get_my_dashboard():
                     "requester_name": ticket.requester_name,
                     "requester_email": ticket.requester_email,
                     "department": {
-                        "id": ticket_dept.id if ticket_dept else None,
-                        "name": ticket_dept.name if ticket_dept else "Unassigned"
+                        "id": ticket.department_id if ticket.department_id in dept_map else None,
+                        "name": dept_map.get(ticket.department_id, "Unassigned")
                     },
                     "assigned_agent": {
-                        "id": assigned_agent.id if assigned_agent else None,
-                        "name": assigned_agent.name if assigned_agent else "Unassigned"
+                        "id": ticket.assigned_to if ticket.assigned_to in agent_map else None,
+                        "name": agent_map.get(ticket.assigned_to, "Unassigned")
                     },
                     "created_at": ticket.created_at.isoformat() if ticket.created_at else None,
                     "updated_at": ticket.updated_at.isoformat() if ticket.updated_at else None,
-                    "latest_message_preview": message_preview,
+                    "latest_message_preview": message_preview(ticket.id),
                     "is_mine": ticket.assigned_to == agent_id
                 })
         
@@ -6180,28 +6441,33 @@ def get_my_dashboard():
                 }
             },
             "my_tickets": {
-                "total": len(my_tickets_list),
+                "total": my_tickets_total,
                 "counts": my_tickets_counts,
-                "tickets": my_tickets_list[:20]  # Limit to 20 for performance
+                "tickets": my_tickets_list,
+                "next_cursor": my_next_cursor
             },
             "department_tickets": {
-                "total": len(dept_tickets_list),
+                "total": dept_tickets_total,
                 "counts": dept_tickets_counts,
-                "tickets": dept_tickets_list[:30],  # Limit to 30 for performance
+                "tickets": dept_tickets_list,
+                "next_cursor": dept_next_cursor,
                 "department_name": "All Departments" if agent_department_id == 7 else (department.name if department else "No Department"),
                 "is_helpdesk_view": agent_department_id == 7
             },
             "recent_activity": recent_activity[:10],
             "summary": {
                 "my_open_tickets": my_tickets_counts["open"],
-                "my_total_tickets": len(my_tickets_list),
+                "my_total_tickets": my_tickets_total,
                 "dept_open_tickets": dept_tickets_counts["open"],
-                "dept_total_tickets": len(dept_tickets_list),
+                "dept_total_tickets": dept_tickets_total,
                 "recent_activity_count": len(recent_activity)
             }
         }
         
         return jsonify(dashboard_data)
+
+    except ValueError:
+        return jsonify({"error": "limit must be an integer and cursor must be a valid cursor"}), 400
         
     except Exception as e:
         current_app.logger.error(f"Dashboard error: {str(e)}")
@@ -1,8 +1,10 @@
 # Utility: Extract @mentions from message text
+import base64
+from datetime import datetime
 from flask import json, jsonify, request
 import jwt
 from functools import wraps
-from sqlalchemy import Engine, event
+from sqlalchemy import Engine, event, false, func, true
 import re
 from config import SECRET_KEY
 from models import Department
@@ -43,6 +45,49 @@ def extract_json(text: str) -> dict:
     json_str = cleaned[start:end]
     return json.loads(json_str)
 
+class JsonReplyStream:
+    """
+    Pulls the string value of `"reply"` out of a JSON object while it is still
+    streaming in. `feed(chunk)` returns the newly decoded reply text (possibly
+    ""), so a client sees the user-facing text and never the raw JSON.
+    """
+    _REPLY_START = re.compile(r'"reply"\s*:\s*"')
+
+    def __init__(self):
+        self._buf = ""
+        self._start = None   # index just past the opening quote of the value
+        self._scan = 0       # how far the closing quote has been searched for
+        self._closed = False
+        self._sent = ""
+
+    def feed(self, chunk: str) -> str:
+        if self._closed:
+            return ""
+        self._buf += chunk
+        if self._start is None:
+            m = self._REPLY_START.search(self._buf)
+            if not m:
+                return ""
+            self._start = self._scan = m.end()
+        i = self._scan
+        while i < len(self._buf):
+            if self._buf[i] == "\\":
+                i += 2
+                continue
+            if self._buf[i] == '"':
+                self._closed = True
+                break
+            i += 1
+        self._scan = i
+        try:
+            text = json.loads(f'"{self._buf[self._start:min(i, len(self._buf))]}"')
+        except ValueError:
+            return ""  # ends inside an escape sequence; wait for the rest
+        if text and "\ud800" <= text[-1] <= "\udbff":
+            text = text[:-1]  # first half of a surrogate pair
+        new, self._sent = text[len(self._sent):], text
+        return new
+
 def _can_view(role: str, lvl: int) -> bool:
     """Role-based ticket visibility rules:
     - L1: can see all tickets (level 1, 2, 3, 4)
@@ -51,6 +96,7 @@ def _can_view(role: str, lvl: int) -> bool:
     - MANAGER: can see all tickets (level 1, 2, 3, 4)
     """
     ticket_level = lvl or 1
+    role = (role or "").upper()  # same normalization as _can_view_clause and require_role
     
     if role == "L1":
         return True  # L1 sees all tickets
@@ -63,6 +109,34 @@ def _can_view(role: str, lvl: int) -> bool:
     else:
         return False  # Unknown role, no access
 
+def _can_view_clause(role: str, level_column):
+    """SQL counterpart of _can_view: a filter on level_column matching the same role rules."""
+    ticket_level = func.coalesce(level_column, 1)
+    role = (role or "").upper()
+
+    if role in ("L1", "MANAGER"):
+        return true()
+    elif role == "L2":
+        return ticket_level.in_([2, 3])
+    elif role == "L3":
+        return ticket_level == 3
+    else:
+        return false()
+
+def encode_cursor(updated_at, row_id) -> str:
+    """Opaque keyset cursor for the (updated_at, id) position of the last row on a page."""
+    raw = json.dumps([updated_at.isoformat() if updated_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; raises ValueError for anything that isn't a cursor we issued."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return (datetime.fromisoformat(updated_at) if updated_at else None), row_id
+    except Exception:
+        raise ValueError("invalid cursor")
+
 def require_role(*allowed):
     def deco(fn):
         @wraps(fn)
@@ -1192,9 +1192,21 @@ const openDraftEditor = (prefill) => {
   // If a request is in-flight, skip setting up the poller
   if (!activeThreadId || sending || loadingStep || actionLoading) return;
 
+  // Poll the compact state endpoint; an unchanged ticket answers 304 with no body
+  let etag = null;
   const interval = setInterval(() => {
-    apiGet(`/threads/${activeThreadId}`)
-      .then(data => setTicket(t => {
+    fetch(`${API_BASE}/threads/${activeThreadId}/state`, {
+      method: 'GET',
+      credentials: 'include',
+      headers: { ...authHeaders(), ...(etag ? { 'If-None-Match': etag } : {}) },
+    })
+      .then(res => {
+        if (res.status === 304) return null;
+        if (!res.ok) throw new Error(`${res.status}`);
+        etag = res.headers.get('ETag') || etag;
+        return res.json();
+      })
+      .then(data => data && setTicket(t => {
         if (!t) return t;
         const statusChanged = t.status !== data.status;
         const levelChanged = Number(t.level) !== Number(data.level);